@@ -0,0 +1,39 @@
+"""Add question.answer_options JSON array next to the comma-joined answers
+
+Revision ID: 5e2b7c9a41f3
+Revises: 96bcd1296431
+Create Date: 2026-10-19 14:02:37.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2b7c9a41f3'
+down_revision: Union[str, None] = '96bcd1296431'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable and without a default, so adding it does not rewrite the table.
+    # Existing rows are filled in by `python -m generators.backfill_answer_options`.
+    op.add_column('question', sa.Column('answer_options', sa.JSON().with_variant(postgresql.JSONB(astext_type=sa.Text()), 'postgresql'), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        # Lets queries such as `answer_options @> '["word"]'` find distractors
+        with op.get_context().autocommit_block():
+            op.create_index('ix_question_answer_options', 'question', ['answer_options'], unique=False,
+                            postgresql_using='gin', postgresql_ops={'answer_options': 'jsonb_path_ops'},
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_question_answer_options', table_name='question')
+    op.drop_column('question', 'answer_options')
@@ -0,0 +1,39 @@
+"""Add storyline_batch table for bulk storyline creation
+
+Revision ID: 96bcd1296431
+Revises: d014ff85f4db
+Create Date: 2026-10-19 09:14:02.511874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '96bcd1296431'
+down_revision: Union[str, None] = 'd014ff85f4db'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('storyline_batch',
+    sa.Column('batch_id', sa.String(length=36), nullable=False),
+    sa.Column('classroom', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('batch_id')
+    )
+    op.add_column('storyline', sa.Column('batch_id', sa.String(length=36), nullable=True))
+    op.create_index(op.f('ix_storyline_batch_id'), 'storyline', ['batch_id'], unique=False)
+    op.create_foreign_key('storyline_batch_id_fkey', 'storyline', 'storyline_batch', ['batch_id'], ['batch_id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('storyline_batch_id_fkey', 'storyline', type_='foreignkey')
+    op.drop_index(op.f('ix_storyline_batch_id'), table_name='storyline')
+    op.drop_column('storyline', 'batch_id')
+    op.drop_table('storyline_batch')
@@ -0,0 +1,46 @@
+"""Add storyline_pool_entry table for the warm storyline pool
+
+Revision ID: a6d3e9f2c714
+Revises: f4a2d8c61b37
+Create Date: 2026-10-19 21:07:44.180352
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d3e9f2c714'
+down_revision: Union[str, None] = 'f4a2d8c61b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('storyline_pool_entry',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('storyline_id', sa.Integer(), nullable=False),
+    sa.Column('classroom', sa.Text(), nullable=False),
+    sa.Column('words_key', sa.String(length=40), nullable=False),
+    sa.Column('words', sa.JSON(), nullable=False),
+    sa.Column('genre', sa.Text(), nullable=False),
+    sa.Column('style', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['storyline_id'], ['storyline.storyline_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('storyline_id')
+    )
+    op.create_index('ix_storyline_pool_entry_bucket', 'storyline_pool_entry', ['classroom', 'words_key', 'status', 'genre', 'style'], unique=False)
+    # Fill with `python -m generators.refill_storyline_pool`
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_storyline_pool_entry_bucket', table_name='storyline_pool_entry')
+    op.drop_table('storyline_pool_entry')
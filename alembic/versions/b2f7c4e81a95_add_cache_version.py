@@ -0,0 +1,33 @@
+"""Add cache_version table for cross-process cache invalidation
+
+Revision ID: b2f7c4e81a95
+Revises: a6d3e9f2c714
+Create Date: 2026-10-19 22:14:36.520913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2f7c4e81a95'
+down_revision: Union[str, None] = 'a6d3e9f2c714'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('cache_version',
+    sa.Column('namespace', sa.String(length=64), nullable=False),
+    sa.Column('key', sa.Text(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('namespace', 'key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('cache_version')
@@ -0,0 +1,28 @@
+"""Add storyline_progress.answer so submissions can be re-graded
+
+Revision ID: b7d40e18c6a2
+Revises: 5e2b7c9a41f3
+Create Date: 2026-10-19 15:26:51.440932
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d40e18c6a2'
+down_revision: Union[str, None] = '5e2b7c9a41f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('storyline_progress', sa.Column('answer', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('storyline_progress', 'answer')
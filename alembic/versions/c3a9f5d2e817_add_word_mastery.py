@@ -0,0 +1,44 @@
+"""Add word_mastery rollup table
+
+Revision ID: c3a9f5d2e817
+Revises: b7d40e18c6a2
+Create Date: 2026-10-19 16:48:10.305517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a9f5d2e817'
+down_revision: Union[str, None] = 'b7d40e18c6a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('word_mastery',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('classroom', sa.Text(), nullable=False),
+    sa.Column('subject_type', sa.String(length=16), nullable=False),
+    sa.Column('subject_id', sa.Integer(), nullable=False),
+    sa.Column('word', sa.Text(), nullable=False),
+    sa.Column('answers', sa.Integer(), nullable=False),
+    sa.Column('correct_answers', sa.Integer(), nullable=False),
+    sa.Column('total_attempts', sa.Integer(), nullable=False),
+    sa.Column('last_score', sa.Integer(), nullable=True),
+    sa.Column('ewma_duration', sa.Float(), nullable=True),
+    sa.Column('last_answered_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_word_mastery_classroom_subject_word', 'word_mastery', ['classroom', 'subject_type', 'subject_id', 'word'], unique=True)
+    # Populate with `python -m generators.rebuild_word_mastery`
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_word_mastery_classroom_subject_word', table_name='word_mastery')
+    op.drop_table('word_mastery')
@@ -0,0 +1,41 @@
+"""Add task_queue.storyline_id so a storyline's queued steps are found by index
+
+Revision ID: c8e5a1f07d32
+Revises: b2f7c4e81a95
+Create Date: 2026-10-20 09:26:51.304117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e5a1f07d32'
+down_revision: Union[str, None] = 'b2f7c4e81a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('task_queue', sa.Column('storyline_id', sa.Integer(), sa.ForeignKey('storyline.storyline_id', name='task_queue_storyline_id_fkey', ondelete='CASCADE'), nullable=True))
+    op.create_index('ix_task_queue_storyline_title_status', 'task_queue', ['storyline_id', 'title', 'status'], unique=False)
+
+    # Copy the storyline of the per-storyline tasks out of their JSON context
+    task_queue = sa.table('task_queue', sa.column('title', sa.String), sa.column('context', sa.JSON), sa.column('storyline_id', sa.Integer))
+    storyline = sa.table('storyline', sa.column('storyline_id', sa.Integer))
+    context_storyline_id = task_queue.c.context['storyline_id'].as_integer()
+    op.execute(
+        task_queue.update()
+        .where(task_queue.c.title.in_(['generate_storyline', 'generate_storyline_step']))
+        .where(context_storyline_id.in_(sa.select(storyline.c.storyline_id)))
+        .values(storyline_id=context_storyline_id)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_task_queue_storyline_title_status', table_name='task_queue')
+    op.drop_column('task_queue', 'storyline_id')
@@ -0,0 +1,37 @@
+"""Add spaced repetition schedule columns to word_mastery
+
+Revision ID: e81c6b0f9d54
+Revises: c3a9f5d2e817
+Create Date: 2026-10-19 18:05:44.902361
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81c6b0f9d54'
+down_revision: Union[str, None] = 'c3a9f5d2e817'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('word_mastery', sa.Column('ease_factor', sa.Float(), nullable=True))
+    op.add_column('word_mastery', sa.Column('interval_days', sa.Float(), nullable=True))
+    op.add_column('word_mastery', sa.Column('repetitions', sa.Integer(), nullable=True))
+    op.add_column('word_mastery', sa.Column('due_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_word_mastery_subject_due', 'word_mastery', ['subject_type', 'subject_id', 'due_at'], unique=False)
+    # Fill the schedule for existing rows with `python -m generators.rebuild_word_mastery`
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_word_mastery_subject_due', table_name='word_mastery')
+    op.drop_column('word_mastery', 'due_at')
+    op.drop_column('word_mastery', 'repetitions')
+    op.drop_column('word_mastery', 'interval_days')
+    op.drop_column('word_mastery', 'ease_factor')
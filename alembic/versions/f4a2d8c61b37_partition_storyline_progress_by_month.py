@@ -0,0 +1,138 @@
+"""Range-partition storyline_progress by created_at month on Postgres
+
+Revision ID: f4a2d8c61b37
+Revises: e81c6b0f9d54
+Create Date: 2026-10-19 19:31:08.662410
+
+On Postgres the table is rebuilt as a partitioned table: the rows are copied
+into monthly partitions (plus a default partition for anything outside them)
+and the old table is dropped. This takes a lock on storyline_progress for the
+duration of the copy, so run it in a maintenance window.
+`python -m generators.progress_retention` keeps creating future partitions and
+archives old ones.
+
+Other databases keep the single table and only get the
+(storyline_id, created_at) index.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a2d8c61b37'
+down_revision: Union[str, None] = 'e81c6b0f9d54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = (
+    'storyline_progress_id, story_question_id, duration, score, attempts, created_at, '
+    'storyline_id, storyline_step_id, student_id, answer'
+)
+
+FOREIGN_KEYS = """
+ALTER TABLE storyline_progress ADD CONSTRAINT storyline_progress_story_question_id_fkey
+    FOREIGN KEY (story_question_id) REFERENCES story_question(id) ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE storyline_progress ADD CONSTRAINT storyline_progress_storyline_id_fkey
+    FOREIGN KEY (storyline_id) REFERENCES storyline(storyline_id) ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE storyline_progress ADD CONSTRAINT storyline_progress_storyline_step_id_fkey
+    FOREIGN KEY (storyline_step_id) REFERENCES storyline_step(storyline_step_id) ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE storyline_progress ADD CONSTRAINT storyline_progress_student_id_fkey
+    FOREIGN KEY (student_id) REFERENCES student(id) ON DELETE SET NULL ON UPDATE CASCADE;
+"""
+
+INDEXES = """
+CREATE INDEX ix_storyline_progress_storyline_created ON storyline_progress (storyline_id, created_at);
+CREATE INDEX ix_storyline_progress_student_created ON storyline_progress (student_id, created_at);
+CREATE INDEX ix_storyline_progress_story_question ON storyline_progress (story_question_id);
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_storyline_progress_storyline_created', 'storyline_progress', ['storyline_id', 'created_at'], unique=False)
+        return
+
+    op.execute("ALTER TABLE storyline_progress RENAME TO storyline_progress_unpartitioned")
+    op.execute("ALTER TABLE storyline_progress_unpartitioned RENAME CONSTRAINT storyline_progress_pkey TO storyline_progress_unpartitioned_pkey")
+    # The partition key has to be part of the primary key and can't be NULL
+    op.execute("""
+        CREATE TABLE storyline_progress (
+            storyline_progress_id INTEGER NOT NULL DEFAULT nextval('storyline_progress_storyline_progress_id_seq'),
+            story_question_id INTEGER NOT NULL,
+            duration INTEGER,
+            score INTEGER,
+            attempts INTEGER,
+            created_at TIMESTAMP(6) NOT NULL DEFAULT now(),
+            storyline_id INTEGER NOT NULL,
+            storyline_step_id INTEGER NOT NULL,
+            student_id INTEGER,
+            answer TEXT,
+            CONSTRAINT storyline_progress_pkey PRIMARY KEY (storyline_progress_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    # One partition per month from the oldest row until three months ahead
+    op.execute("""
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE((SELECT min(created_at) FROM storyline_progress_unpartitioned), now())),
+                    date_trunc('month', now()) + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF storyline_progress FOR VALUES FROM (%L) TO (%L)',
+                    'storyline_progress_' || to_char(month, 'YYYY_MM'), month, (month + interval '1 month')::date
+                );
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE TABLE storyline_progress_default PARTITION OF storyline_progress DEFAULT")
+    op.execute(f"""
+        INSERT INTO storyline_progress ({COLUMNS})
+        SELECT storyline_progress_id, story_question_id, duration, score, attempts, COALESCE(created_at, now()),
+               storyline_id, storyline_step_id, student_id, answer
+        FROM storyline_progress_unpartitioned
+    """)
+    op.execute("ALTER SEQUENCE storyline_progress_storyline_progress_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE storyline_progress_unpartitioned")
+    op.execute("ALTER SEQUENCE storyline_progress_storyline_progress_id_seq OWNED BY storyline_progress.storyline_progress_id")
+    op.execute(FOREIGN_KEYS)
+    op.execute(INDEXES)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_storyline_progress_storyline_created', table_name='storyline_progress')
+        return
+
+    op.execute("ALTER TABLE storyline_progress RENAME TO storyline_progress_partitioned")
+    op.execute("ALTER TABLE storyline_progress_partitioned RENAME CONSTRAINT storyline_progress_pkey TO storyline_progress_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE storyline_progress (
+            storyline_progress_id INTEGER NOT NULL DEFAULT nextval('storyline_progress_storyline_progress_id_seq'),
+            story_question_id INTEGER NOT NULL,
+            duration INTEGER,
+            score INTEGER,
+            attempts INTEGER,
+            created_at TIMESTAMP(6),
+            storyline_id INTEGER NOT NULL,
+            storyline_step_id INTEGER NOT NULL,
+            student_id INTEGER,
+            answer TEXT,
+            CONSTRAINT storyline_progress_pkey PRIMARY KEY (storyline_progress_id)
+        )
+    """)
+    op.execute(f"INSERT INTO storyline_progress ({COLUMNS}) SELECT {COLUMNS} FROM storyline_progress_partitioned")
+    op.execute("ALTER SEQUENCE storyline_progress_storyline_progress_id_seq OWNED BY NONE")
+    # Drops every partition with it
+    op.execute("DROP TABLE storyline_progress_partitioned")
+    op.execute("ALTER SEQUENCE storyline_progress_storyline_progress_id_seq OWNED BY storyline_progress.storyline_progress_id")
+    op.execute(FOREIGN_KEYS)
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Never reach the real providers from a load test; set before the generators
+# pick their backends at import time.
+os.environ.setdefault("SNOWDAY_FAKE_BACKENDS", "all")
+
+from src.orm import SessionLocal, Storyline
+from src.vocab_bank import vocabulary_bank
+from generators.stories import generate_story
+from benchmarks.read_paths import git_commit
+from benchmarks.seed import WORDS, bind_engine, reset_database
+
+
+def create_pending_storylines(count: int, words_per_story: int, seed_value: int = 42) -> list:
+    rng = random.Random(seed_value)
+    session = SessionLocal()
+    try:
+        storylines = [
+            Storyline(
+                status="pending",
+                original_request=json.dumps({
+                    "words": rng.sample(WORDS, words_per_story),
+                    "genre": "comedy",
+                    "location": "a bouncy castle",
+                    "style": "Dr. Seuss",
+                    "friend": "Paige",
+                    "selected_interests": ["basketball", "baking"],
+                    "classroom": f"room{n % 5 + 1}",
+                }),
+            )
+            for n in range(count)
+        ]
+        session.add_all(storylines)
+        session.commit()
+        return [storyline.storyline_id for storyline in storylines]
+    finally:
+        session.close()
+
+
+def run_load(storyline_ids: list, concurrency: int) -> dict:
+    """
+    Generate every storyline with `concurrency` workers and measure throughput.
+    """
+    latencies = []
+    failures = 0
+    distractor_cache = {}
+
+    def job(storyline_id):
+        start = time.perf_counter()
+        try:
+            ok = generate_story(storyline_id, distractor_cache) is not None
+        except Exception as e:
+            print(f"Storyline {storyline_id} failed: {e}")
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(job, storyline_id) for storyline_id in storyline_ids]
+        for future in as_completed(futures):
+            ok, latency = future.result()
+            latencies.append(latency)
+            failures += 0 if ok else 1
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "jobs": len(storyline_ids),
+        "concurrency": concurrency,
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "stories_per_s": round(len(storyline_ids) / wall, 3) if wall else None,
+        "median_job_s": round(statistics.median(latencies), 3),
+        "p95_job_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test story generation against the fake LLM/TTS/blob backends.")
+    parser.add_argument("--database-url", default="sqlite:///benchmarks/bench.db",
+                        help="Scratch database; every table is dropped and recreated!")
+    parser.add_argument("--jobs", type=int, default=50, help="Storylines to generate per concurrency level.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated worker counts to try.")
+    parser.add_argument("--words", type=int, default=4, help="Vocabulary words per storyline.")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    engine = bind_engine(args.database_url)
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        reset_database(engine)
+        # Every level starts cold; cached question IDs would point at dropped rows
+        vocabulary_bank.forget()
+        storyline_ids = create_pending_storylines(args.jobs, args.words)
+        result = run_load(storyline_ids, concurrency)
+        results.append(result)
+        print(f"concurrency {concurrency:>3}: {result['stories_per_s']} stories/s, "
+              f"median {result['median_job_s']}s, p95 {result['p95_job_s']}s, {result['failures']} failed")
+
+    report = {
+        "commit": git_commit(),
+        "backends": os.environ["SNOWDAY_FAKE_BACKENDS"],
+        "latency_ms": os.getenv("SNOWDAY_FAKE_LATENCY_MS", "0"),
+        "error_rate": float(os.getenv("SNOWDAY_FAKE_ERROR_RATE", "0")),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
@@ -0,0 +1,202 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func
+
+from src.orm import (
+    Question, SessionLocal, Story, Storyline, StorylineStep,
+    get_storyline_with_step_progress, get_storylines_with_step_progress
+)
+from src.query_log import assert_max_queries, count_queries, instrument_engine
+from src.storyline.progress import QuestionProgress, StorylineProgress, StoryProgress
+from src.storyline.storyline import get_all_storylines, get_storyline_step_details
+from benchmarks.seed import bind_engine, reset_database, seed
+
+DEFAULT_SCALES = [100, 1000]
+
+# Statements each read path may issue at any scale; more means an N+1 crept in
+QUERY_BUDGETS = {
+    "get_all_storylines": 1,
+    "get_storyline_step_details": 1,
+    "StorylineProgress": 1,
+    "QuestionProgress": 1,
+    "StoryProgress": 1,
+    "get_storyline_with_step_progress": 2,
+    "get_storylines_with_step_progress": 2,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pick_ids(column, rng: random.Random, count: int) -> List[int]:
+    session = SessionLocal()
+    try:
+        ids = [row[0] for row in session.query(column).order_by(func.random()).limit(count * 4).all()]
+    finally:
+        session.close()
+    return rng.sample(ids, min(count, len(ids)))
+
+
+def get_storyline_with_step_progress_in_session(storyline_id: int):
+    session = SessionLocal()
+    try:
+        return get_storyline_with_step_progress(session, storyline_id)
+    finally:
+        session.close()
+
+
+def get_storylines_with_step_progress_in_session(storyline_ids: List[int]):
+    session = SessionLocal()
+    try:
+        return get_storylines_with_step_progress(session, storyline_ids)
+    finally:
+        session.close()
+
+
+def read_paths(rng: random.Random, samples: int) -> Dict[str, Callable[[], None]]:
+    """
+    Every read path under test, each bound to a rotating set of real IDs.
+    """
+    storyline_ids = pick_ids(Storyline.storyline_id, rng, samples)
+    step_ids = pick_ids(StorylineStep.storyline_step_id, rng, samples)
+    question_ids = pick_ids(Question.id, rng, samples)
+    story_ids = pick_ids(Story.id, rng, samples)
+
+    def rotating(fn, ids):
+        ids = list(ids)
+        position = [0]
+
+        def call():
+            fn(ids[position[0] % len(ids)])
+            position[0] += 1
+        return call
+
+    return {
+        "get_all_storylines": get_all_storylines,
+        "get_storyline_step_details": rotating(get_storyline_step_details, step_ids),
+        "StorylineProgress": rotating(StorylineProgress, storyline_ids),
+        "QuestionProgress": rotating(QuestionProgress, question_ids),
+        "StoryProgress": rotating(StoryProgress, story_ids),
+        "get_storyline_with_step_progress": rotating(get_storyline_with_step_progress_in_session, storyline_ids),
+        # A class report: every sampled storyline in one call
+        "get_storylines_with_step_progress": lambda: get_storylines_with_step_progress_in_session(storyline_ids),
+    }
+
+
+def time_call(fn: Callable[[], None], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        with count_queries() as counter:
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+
+    timings.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "queries": statistics.median(queries),
+    }
+
+
+def run(database_url: str, scales: List[int], repeat: int, only: Optional[List[str]] = None) -> Dict:
+    """
+    Seed each scale from scratch and time every read path against it.
+    """
+    engine = bind_engine(database_url)
+    instrument_engine(engine)
+
+    results = []
+    for scale in scales:
+        reset_database(engine)
+        seed_start = time.perf_counter()
+        counts = seed(scale)
+        print(f"Seeded {counts} in {time.perf_counter() - seed_start:.1f}s")
+
+        rng = random.Random(scale)
+        for name, fn in read_paths(rng, samples=min(repeat, 20)).items():
+            if only and name not in only:
+                continue
+            with assert_max_queries(QUERY_BUDGETS[name]):
+                fn()
+            stats = time_call(fn, repeat)
+            print(f"  {scale:>6} {name:<34} median {stats['median_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  queries {stats['queries']}")
+            results.append({"scale": scale, "function": name, "rows": counts, **stats})
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "database": engine.dialect.name,
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline_path: str) -> None:
+    """
+    Print how each median moved against an earlier results file.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["scale"], r["function"]): r for r in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit')} ({baseline_path}):")
+    for result in current["results"]:
+        previous = before.get((result["scale"], result["function"]))
+        if previous is None:
+            continue
+        ratio = result["median_ms"] / previous["median_ms"] if previous["median_ms"] else float("inf")
+        print(
+            f"  {result['scale']:>6} {result['function']:<34} "
+            f"{previous['median_ms']:>9.2f}ms -> {result['median_ms']:>9.2f}ms ({ratio:.2f}x), "
+            f"queries {previous['queries']} -> {result['queries']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the web read paths against synthetic data at several scales.")
+    parser.add_argument("--database-url", default="sqlite:///benchmarks/bench.db",
+                        help="Scratch database; every table is dropped and recreated for each scale!")
+    parser.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES), help="Comma separated storyline counts to seed.")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per read path.")
+    parser.add_argument("--only", default=None, help="Comma separated read paths to run.")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare medians against.")
+    args = parser.parse_args()
+
+    current = run(
+        args.database_url,
+        [int(s) for s in args.scales.split(",")],
+        args.repeat,
+        only=args.only.split(",") if args.only else None,
+    )
+
+    output = args.output or os.path.join("benchmarks", "results", f"{current['commit'] or 'working'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(current, args.compare)
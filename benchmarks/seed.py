@@ -0,0 +1,139 @@
+import argparse
+import datetime
+import random
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+
+from src.orm import Base, SessionLocal, StoryQuestion, StorylineProgress, StorylineStep, create_storyline_from_dict
+from src.utils import GENRES, LOCATIONS
+
+WORDS = [
+    "adventure", "balloon", "canyon", "dragon", "echo", "feather", "glacier", "harbor",
+    "island", "jungle", "kettle", "lantern", "meadow", "nectar", "orchard", "pebble",
+    "quiver", "riddle", "saddle", "thunder", "umbrella", "velvet", "whistle", "yonder",
+]
+
+
+def bind_engine(database_url: str):
+    """
+    Point the app's sessions at the benchmark database and create the schema.
+    """
+    # SQLite allows one writer at a time, so let concurrent generators wait for the lock
+    connect_args = {"timeout": 30} if database_url.startswith("sqlite") else {}
+    engine = create_engine(database_url, connect_args=connect_args)
+    SessionLocal.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def reset_database(engine) -> None:
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+
+def fake_story(rng: random.Random, words: List[str]) -> str:
+    sentences = [
+        f"In the {rng.choice(LOCATIONS)}, a {rng.choice(GENRES)} tale about the {word} began."
+        for word in words
+    ]
+    return " ".join(sentences) * 3
+
+
+def fake_stories_data(rng: random.Random, classroom: str, steps: int, questions_per_step: int) -> List[Dict]:
+    """
+    The `stories_data` payload of one storyline, shaped like generator output.
+    """
+    stories_data = []
+    for _ in range(steps):
+        words = rng.sample(WORDS, questions_per_step)
+        stories_data.append({
+            "content": fake_story(rng, words),
+            "questions": [
+                {
+                    "type": "select",
+                    "question": "",
+                    "key": f"vocab_{classroom}_{word}",
+                    "correct": word,
+                    "answers": rng.sample([w for w in WORDS if w != word], 3) + [word],
+                    "classroom": classroom,
+                }
+                for word in words
+            ],
+        })
+    return stories_data
+
+
+def seed(storylines: int, steps: int = 4, questions_per_step: int = 3, progress_ratio: float = 0.6,
+         classrooms: int = 10, seed_value: int = 42) -> Dict[str, int]:
+    """
+    Fill the bound database with synthetic storylines and progress.
+
+    Args:
+        storylines: Number of storylines to create
+        steps: Steps (stories) per storyline
+        questions_per_step: Questions attached to each story
+        progress_ratio: Share of storylines students have worked through
+        classrooms: Number of classrooms the questions are spread over
+        seed_value: Random seed, so runs at the same scale hold the same data
+
+    Returns:
+        Row counts of what was created
+    """
+    rng = random.Random(seed_value)
+    progress_rows = 0
+    start = datetime.datetime(2025, 1, 1)
+
+    for n in range(storylines):
+        classroom = f"room{n % classrooms + 1}"
+        session = SessionLocal()
+        try:
+            storyline = create_storyline_from_dict(session, fake_stories_data(rng, classroom, steps, questions_per_step))
+
+            if rng.random() < progress_ratio:
+                rows = (
+                    session.query(StorylineStep.storyline_step_id, StoryQuestion.id)
+                    .join(StoryQuestion, StoryQuestion.story_id == StorylineStep.story_id)
+                    .filter(StorylineStep.storyline_id == storyline.storyline_id)
+                    .all()
+                )
+                for storyline_step_id, story_question_id in rows:
+                    # Some questions are answered more than once
+                    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                        session.add(StorylineProgress(
+                            storyline_id=storyline.storyline_id,
+                            storyline_step_id=storyline_step_id,
+                            story_question_id=story_question_id,
+                            duration=rng.randint(5, 120),
+                            score=rng.choice([0, 50, 100, 100]),
+                            attempts=rng.randint(1, 4),
+                            created_at=start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+                        ))
+                        progress_rows += 1
+                session.commit()
+        finally:
+            session.close()
+
+    return {
+        "storylines": storylines,
+        "steps": storylines * steps,
+        "questions": storylines * steps * questions_per_step,
+        "progress": progress_rows,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a database with synthetic storylines, questions and progress.")
+    parser.add_argument("--database-url", default="sqlite:///benchmarks/bench.db", help="Database to seed (default: sqlite:///benchmarks/bench.db)")
+    parser.add_argument("--storylines", type=int, default=1000, help="Number of storylines to create.")
+    parser.add_argument("--steps", type=int, default=4, help="Steps per storyline.")
+    parser.add_argument("--questions-per-step", type=int, default=3, help="Questions per step.")
+    parser.add_argument("--progress-ratio", type=float, default=0.6, help="Share of storylines with progress rows.")
+    parser.add_argument("--reset", action="store_true", help="Drop and recreate every table first. Destroys existing data!")
+    args = parser.parse_args()
+
+    engine = bind_engine(args.database_url)
+    if args.reset:
+        reset_database(engine)
+    counts = seed(args.storylines, steps=args.steps, questions_per_step=args.questions_per_step, progress_ratio=args.progress_ratio)
+    print(f"Seeded {counts}")
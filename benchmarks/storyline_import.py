@@ -0,0 +1,110 @@
+import argparse
+import json
+import random
+import time
+
+from src.orm import (
+    Question, SessionLocal, Story, StoryQuestion, Storyline, StorylineStep,
+    create_storyline_from_dict, create_storylines_from_dicts
+)
+from src.query_log import count_queries, instrument_engine
+from benchmarks.read_paths import git_commit
+from benchmarks.seed import bind_engine, fake_stories_data, reset_database
+
+
+def create_storyline_from_dict_legacy(session, stories_data, status="completed"):
+    """
+    The previous implementation, which flushed after every storyline, story
+    and question to learn their IDs. Kept here as the comparison baseline.
+    """
+    storyline = Storyline(status=status)
+    session.add(storyline)
+    session.flush()
+
+    for step_index, item in enumerate(stories_data, start=1):
+        new_story = Story(content=item["content"])
+        session.add(new_story)
+        session.flush()
+
+        for q in item.get("questions", []):
+            new_question = Question(
+                type=q["type"],
+                question=q["question"],
+                key=q["key"],
+                correct=q["correct"],
+                answer_list=q["answers"],
+                classroom=q.get("classroom", "")
+            )
+            session.add(new_question)
+            session.flush()
+            session.add(StoryQuestion(story_id=new_story.id, question_id=new_question.id))
+
+        session.add(StorylineStep(storyline_id=storyline.storyline_id, step=step_index, story_id=new_story.id))
+
+    session.commit()
+    return storyline
+
+
+def import_one_at_a_time(create, payloads):
+    for stories_data in payloads:
+        session = SessionLocal()
+        try:
+            create(session, stories_data)
+        finally:
+            session.close()
+
+
+def import_in_bulk(payloads, chunk_size: int = 100):
+    for i in range(0, len(payloads), chunk_size):
+        session = SessionLocal()
+        try:
+            create_storylines_from_dicts(session, payloads[i:i + chunk_size])
+        finally:
+            session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare storyline import paths: per-row flushes, one flush per storyline, and bulk.")
+    parser.add_argument("--database-url", default="sqlite:///benchmarks/bench.db",
+                        help="Scratch database; every table is dropped and recreated!")
+    parser.add_argument("--storylines", type=int, default=500, help="Storylines to import per run.")
+    parser.add_argument("--steps", type=int, default=6, help="Steps per storyline.")
+    parser.add_argument("--questions-per-step", type=int, default=4, help="Questions per step.")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    engine = bind_engine(args.database_url)
+    instrument_engine(engine)
+
+    rng = random.Random(42)
+    payloads = [
+        fake_stories_data(rng, f"room{n % 10 + 1}", args.steps, args.questions_per_step)
+        for n in range(args.storylines)
+    ]
+
+    variants = {
+        "legacy": lambda: import_one_at_a_time(create_storyline_from_dict_legacy, payloads),
+        "single_flush": lambda: import_one_at_a_time(create_storyline_from_dict, payloads),
+        "bulk": lambda: import_in_bulk(payloads),
+    }
+
+    results = []
+    for name, run in variants.items():
+        reset_database(engine)
+        with count_queries() as counter:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        results.append({
+            "variant": name,
+            "storylines": args.storylines,
+            "seconds": round(elapsed, 3),
+            "storylines_per_s": round(args.storylines / elapsed, 1),
+            "statements": counter.count,
+        })
+        print(f"{name:<13} {elapsed:8.2f}s  {args.storylines / elapsed:8.1f} storylines/s  {counter.count} statements")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "database": engine.dialect.name, "results": results}, f, indent=2)
+        print(f"Wrote {args.output}")
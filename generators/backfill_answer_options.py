@@ -0,0 +1,75 @@
+import argparse
+import logging
+import time
+
+from sqlalchemy import bindparam, update
+
+from src.cache import fragment_cache
+from src.orm import Question, SessionLocal, split_answers
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def backfill_answer_options(batch_size: int = BATCH_SIZE, pause: float = 0.0) -> int:
+    """
+    Copy the comma-joined `question.answers` into `question.answer_options`
+    for rows that don't have it yet.
+
+    Walks the table in ID order and commits after every batch, so it can run
+    against a live database and be stopped and restarted at any point.
+
+    Args:
+        batch_size: Rows updated per transaction
+        pause: Seconds to sleep between batches to leave room for other traffic
+
+    Returns:
+        The number of questions updated
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        session = SessionLocal()
+        try:
+            rows = (
+                session.query(Question.id, Question.answers)
+                .filter(Question.id > last_id, Question.answer_options.is_(None))
+                .order_by(Question.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            session.execute(
+                update(Question.__table__)
+                .where(Question.__table__.c.id == bindparam("question_id"))
+                .values(answer_options=bindparam("options")),
+                [{"question_id": question_id, "options": split_answers(answers)} for question_id, answers in rows],
+            )
+            session.commit()
+        finally:
+            session.close()
+
+        last_id = rows[-1][0]
+        updated += len(rows)
+        logger.info(f"Backfilled {updated} questions (up to ID {last_id})")
+        if pause:
+            time.sleep(pause)
+
+    if updated:
+        fragment_cache.invalidate("classroom_questions")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill question.answer_options from the comma-joined answers column.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows updated per transaction.")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to wait between batches.")
+    args = parser.parse_args()
+
+    total = backfill_answer_options(batch_size=args.batch_size, pause=args.pause)
+    logger.info(f"Done, {total} questions backfilled.")
@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain.schema import HumanMessage, SystemMessage
+
+from src.profiling import enable_cli_profiling
+from src.orm import Storyline, TaskQueue, TaskStatus, db_session
+from generators.stories import load_story_request, save_story_response
+
+# Load environment variables from .env file
+load_dotenv()
+
+OPENAI_MODEL = 'gpt-4o-mini'
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_TASK = 'openai_batch'
+DEFAULT_BATCH_DIR = 'batches'
+
+
+class LocalBatchClient:
+    """
+    Stand-in for the parts of the OpenAI client the batch flow uses.
+
+    Results are replayed from a JSONL file in the Batch API output format.
+    A request whose custom_id is not in the file gets the next canned body in
+    turn, so a handful of fixtures can cover any set of storylines. Every
+    batch completes immediately. Files and batches are kept under
+    `state_dir`, so `poll --replay` works from a later process than `submit`.
+    """
+
+    def __init__(self, replay_path: str, state_dir: str = os.path.join(DEFAULT_BATCH_DIR, 'local')):
+        with open(replay_path, 'r') as f:
+            self._canned = [json.loads(line) for line in f if line.strip()]
+        if not self._canned:
+            raise ValueError(f"No canned batch results in {replay_path}")
+        self._by_custom_id = {item["custom_id"]: item for item in self._canned}
+        self._state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _path(self, object_id: str) -> str:
+        return os.path.join(self._state_dir, f"{object_id}.json")
+
+    def _write_file(self, text: str) -> str:
+        file_id = f"file-local-{uuid.uuid4().hex[:12]}"
+        with open(self._path(file_id), 'w') as f:
+            f.write(text)
+        return file_id
+
+    def _create_file(self, file, purpose: str):
+        file_id = self._write_file(file.read().decode() if hasattr(file, 'read') else file)
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str):
+        with open(self._path(file_id), 'r') as f:
+            return SimpleNamespace(text=f.read())
+
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str, metadata: Optional[Dict] = None):
+        fallback = itertools.cycle(self._canned)
+        output_lines, error_lines = [], []
+        for line in self._file_content(input_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            custom_id = json.loads(line)["custom_id"]
+            canned = {**(self._by_custom_id.get(custom_id) or next(fallback)), "custom_id": custom_id}
+            # Like the real API, failed requests go to the error file
+            failed = canned.get("error") or (canned.get("response") or {}).get("status_code") != 200
+            (error_lines if failed else output_lines).append(json.dumps(canned))
+
+        batch = {
+            "id": f"batch-local-{uuid.uuid4().hex[:12]}",
+            "status": "completed",
+            "input_file_id": input_file_id,
+            "output_file_id": self._write_file("\n".join(output_lines)) if output_lines else None,
+            "error_file_id": self._write_file("\n".join(error_lines)) if error_lines else None,
+        }
+        with open(self._path(batch["id"]), 'w') as f:
+            json.dump(batch, f)
+        return SimpleNamespace(**batch)
+
+    def _retrieve_batch(self, batch_id: str):
+        with open(self._path(batch_id), 'r') as f:
+            return SimpleNamespace(**json.load(f))
+
+
+def get_client(replay_path: Optional[str] = None, batch_dir: str = DEFAULT_BATCH_DIR):
+    if replay_path:
+        return LocalBatchClient(replay_path, state_dir=os.path.join(batch_dir, 'local'))
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+
+def to_openai_messages(messages: list) -> List[Dict[str, str]]:
+    roles = {SystemMessage: "system", HumanMessage: "user"}
+    return [{"role": roles[type(message)], "content": message.content} for message in messages]
+
+
+def storylines_in_flight(session) -> set:
+    """
+    Storyline IDs that already belong to a submitted, not yet ingested batch.
+    """
+    jobs = (
+        session.query(TaskQueue)
+        .filter(TaskQueue.title == BATCH_TASK)
+        .filter(TaskQueue.status == TaskStatus.IN_PROGRESS)
+        .all()
+    )
+    return {sid for job in jobs for sid in (job.context or {}).get("storyline_ids", [])}
+
+
+def build_batch_file(limit: Optional[int] = None, model: str = OPENAI_MODEL) -> tuple:
+    """
+    Collect the prompts of all pending storylines into Batch API JSONL lines.
+
+    Returns:
+        The JSONL content and the storyline IDs it covers
+    """
+    lines = []
+    storyline_ids = []
+    with db_session() as session:
+        in_flight = storylines_in_flight(session)
+        query = (
+            session.query(Storyline.storyline_id)
+            .filter(Storyline.status == 'pending')
+            .order_by(Storyline.storyline_id)
+        )
+        for (storyline_id,) in query.all():
+            if storyline_id in in_flight:
+                continue
+            story_request = load_story_request(session, storyline_id)
+            if story_request is None:
+                continue
+            lines.append(json.dumps({
+                "custom_id": f"storyline-{storyline_id}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "temperature": 1,
+                    "messages": to_openai_messages(story_request["messages"]),
+                },
+            }))
+            storyline_ids.append(storyline_id)
+            if limit and len(storyline_ids) >= limit:
+                break
+
+    return "\n".join(lines), storyline_ids
+
+
+def submit_batch(client, batch_dir: str = DEFAULT_BATCH_DIR, limit: Optional[int] = None, model: str = OPENAI_MODEL) -> Optional[int]:
+    """
+    Write, upload and submit a batch job for the pending storylines.
+
+    Returns:
+        The TaskQueue ID tracking the job, or None if nothing was pending
+    """
+    content, storyline_ids = build_batch_file(limit=limit, model=model)
+    if not storyline_ids:
+        print("No pending storylines to batch.")
+        return None
+
+    os.makedirs(batch_dir, exist_ok=True)
+    batch_path = os.path.join(batch_dir, f"storylines_{int(time.time())}.jsonl")
+    with open(batch_path, 'w') as f:
+        f.write(content)
+    print(f"Wrote {len(storyline_ids)} requests to {batch_path}")
+
+    with open(batch_path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"source": "snow_day storylines"},
+    )
+    print(f"Submitted batch {batch.id} for storylines {storyline_ids}")
+
+    with db_session() as session:
+        job = TaskQueue(
+            title=BATCH_TASK,
+            status=TaskStatus.IN_PROGRESS,
+            context={
+                "batch_id": batch.id,
+                "input_file_id": input_file.id,
+                "batch_path": batch_path,
+                "storyline_ids": storyline_ids,
+            },
+        )
+        session.add(job)
+        session.flush()
+        return job.id
+
+
+def ingest_results(output_text: str, distractor_cache: Optional[Dict[str, List[str]]] = None) -> Dict[int, bool]:
+    """
+    Feed each batch result through the same validation, linking and
+    persistence path as synchronous generation.
+
+    Returns:
+        A mapping of storyline ID to whether it was saved
+    """
+    if distractor_cache is None:
+        distractor_cache = {}
+
+    outcome = {}
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        storyline_id = int(result["custom_id"].split("-", 1)[1])
+
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            print(f"Batch request for storyline {storyline_id} failed: {result.get('error') or response}")
+            outcome[storyline_id] = False
+            continue
+
+        content = response["body"]["choices"][0]["message"]["content"]
+        try:
+            with db_session() as session:
+                story_request = load_story_request(session, storyline_id)
+                if story_request is None:
+                    outcome[storyline_id] = False
+                    continue
+                outcome[storyline_id] = save_story_response(session, story_request, content, distractor_cache) is not None
+        except Exception as e:
+            print(f"Error saving batch result for storyline {storyline_id}: {e}")
+            outcome[storyline_id] = False
+
+    return outcome
+
+
+def poll_batches(client) -> int:
+    """
+    Check every in-flight batch job once, ingesting the ones that finished.
+
+    Returns:
+        The number of jobs still in flight
+    """
+    with db_session() as session:
+        jobs = [
+            (job.id, dict(job.context or {}))
+            for job in session.query(TaskQueue)
+            .filter(TaskQueue.title == BATCH_TASK)
+            .filter(TaskQueue.status == TaskStatus.IN_PROGRESS)
+            .all()
+        ]
+
+    still_running = 0
+    distractor_cache: Dict[str, List[str]] = {}
+    for job_id, context in jobs:
+        batch = client.batches.retrieve(context["batch_id"])
+        print(f"Batch {batch.id}: {batch.status}")
+
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            still_running += 1
+            continue
+
+        # Expired and cancelled batches still carry the requests that finished
+        outcome: Dict[int, bool] = {}
+        if batch.output_file_id:
+            outcome.update(ingest_results(client.files.content(batch.output_file_id).text, distractor_cache))
+        if batch.error_file_id:
+            outcome.update(ingest_results(client.files.content(batch.error_file_id).text, distractor_cache))
+        for storyline_id in context.get("storyline_ids", []):
+            if storyline_id not in outcome:
+                print(f"Batch {batch.id} returned no result for storyline {storyline_id}")
+                outcome[storyline_id] = False
+        context["ingested"] = {str(sid): ok for sid, ok in outcome.items()}
+        print(f"Ingested {sum(outcome.values())} of {len(outcome)} storylines from batch {batch.id}")
+
+        with db_session() as session:
+            job = session.get(TaskQueue, job_id)
+            job.status = TaskStatus.COMPLETED if batch.status == "completed" else TaskStatus.FAILED
+            job.context = {**context, "final_status": batch.status}
+
+    return still_running
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate pending storylines through the OpenAI Batch API.")
+    parser.add_argument("command", choices=["submit", "poll", "run"], help="submit a new batch, poll in-flight batches, or submit and wait")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of storylines in the batch.")
+    parser.add_argument("--model", default=OPENAI_MODEL, help=f"Model for the batch requests (default: {OPENAI_MODEL})")
+    parser.add_argument("--batch-dir", default=DEFAULT_BATCH_DIR, help="Where batch input files are written.")
+    parser.add_argument("--interval", type=int, default=300, help="Seconds between polls for the run command.")
+    parser.add_argument("--replay", default=None, help="Replay canned results from this JSONL file instead of calling OpenAI.")
+    parser.add_argument("--profile", action="store_true", help="Profile this run with cProfile and save the result under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling(f"generators.batch_stories {args.command}")
+
+    client = get_client(args.replay, batch_dir=args.batch_dir)
+
+    if args.command in ("submit", "run"):
+        submit_batch(client, batch_dir=args.batch_dir, limit=args.limit, model=args.model)
+
+    if args.command == "poll":
+        poll_batches(client)
+
+    if args.command == "run":
+        while poll_batches(client):
+            time.sleep(args.interval)
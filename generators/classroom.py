@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from openai import OpenAI, OpenAIError
 
 # Assuming src is in the python path or PYTHONPATH is set correctly
+from src.cache import fragment_cache
 from src.orm import Question, db_session
 
 # --- Configuration ---
@@ -140,6 +141,7 @@ def main(yaml_path: str):
                 continue
 
             print(f"\nProcessing classroom: {classroom_name}")
+            created_before = questions_created
             for word in words:
                 if not isinstance(word, str) or not word:
                     print(f"Warning: Skipping invalid word entry: {word}")
@@ -170,7 +172,6 @@ def main(yaml_path: str):
                 # Prepare answers list (correct + incorrect) and shuffle
                 all_answers = [word] + incorrect_spellings
                 random.shuffle(all_answers)
-                answers_str = ",".join(all_answers)
 
                 # Create Question object
                 new_question = Question(
@@ -178,7 +179,7 @@ def main(yaml_path: str):
                     question=f"Which is the correct spelling of the word '{word}'?",
                     key=word,
                     correct=word,
-                    answers=answers_str,
+                    answer_list=all_answers,
                     classroom=classroom_name
                 )
 
@@ -192,6 +193,10 @@ def main(yaml_path: str):
                     session.rollback() # Rollback this specific question addition
                     questions_failed += 1
 
+            if questions_created > created_before:
+                # Refresh the classroom's question list on the create storyline form
+                fragment_cache.invalidate("classroom_questions", classroom_name, session=session)
+
         try:
             session.commit()
             print("\nDatabase commit successful.")
@@ -0,0 +1,41 @@
+import argparse
+import datetime
+import logging
+
+from src.export import DEFAULT_CHUNK_SIZE, write_export
+from src.profiling import enable_cli_profiling
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export storyline progress joined with questions and stories as CSV or Parquet.")
+    parser.add_argument("output", help="File to write, e.g. progress.csv or progress.parquet.")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None,
+                        help="Output format (default: from the file extension, else csv). Parquet needs pyarrow.")
+    parser.add_argument("--classroom", default=None, help="Only this classroom.")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, default=None, help="First day to include (YYYY-MM-DD).")
+    parser.add_argument("--until", type=datetime.date.fromisoformat, default=None, help="Last day to include (YYYY-MM-DD).")
+    parser.add_argument("--storyline-id", type=int, action="append", default=[], help="Only this storyline; repeat for several.")
+    parser.add_argument("--include-story-content", action="store_true", help="Add the story text to every row.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched and written per chunk.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("export_progress")
+
+    file_format = args.format or ("parquet" if args.output.endswith(".parquet") else "csv")
+    written = write_export(
+        args.output,
+        file_format=file_format,
+        chunk_size=args.chunk_size,
+        classroom=args.classroom,
+        since=args.since,
+        until=args.until,
+        storyline_ids=args.storyline_id,
+        include_story_content=args.include_story_content,
+    )
+    logger.info(f"Wrote {written} bytes of {file_format} to {args.output}")
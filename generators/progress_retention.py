@@ -0,0 +1,36 @@
+import argparse
+import json
+import logging
+
+from src.profiling import enable_cli_profiling
+from src.retention import ARCHIVE_DIR, PARTITION_MONTHS_AHEAD, PROGRESS_RETENTION_MONTHS, apply_retention
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create upcoming storyline_progress partitions and archive months older than the retention window. "
+                    "Run it monthly, e.g. from cron."
+    )
+    parser.add_argument("--retention-months", type=int, default=PROGRESS_RETENTION_MONTHS,
+                        help=f"Months of progress to keep in the database (default: {PROGRESS_RETENTION_MONTHS}).")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                        help=f"Partitions to create beyond the current month (default: {PARTITION_MONTHS_AHEAD}).")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help=f"Where archives are written (default: {ARCHIVE_DIR}).")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the months that would be archived.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("progress_retention")
+
+    report = apply_retention(
+        retention_months=args.retention_months,
+        archive_dir=args.archive_dir,
+        months_ahead=args.months_ahead,
+        dry_run=args.dry_run,
+    )
+    logger.info(json.dumps(report))
@@ -0,0 +1,23 @@
+import argparse
+import logging
+
+from src.mastery import rebuild_word_mastery
+from src.profiling import enable_cli_profiling
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the word_mastery rollup from the storyline_progress history.")
+    parser.add_argument("--classroom", default=None, help="Only rebuild this classroom (default: all).")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Progress rows fetched per round trip.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("rebuild_word_mastery")
+
+    rows = rebuild_word_mastery(classroom=args.classroom, batch_size=args.batch_size)
+    logger.info(f"Wrote {rows} word mastery rows.")
@@ -0,0 +1,62 @@
+import argparse
+import json
+import logging
+
+from src.profiling import enable_cli_profiling
+from src.warm_pool import (
+    CLASSROOM_WORDS_PATH,
+    WARM_POOL_SIZE,
+    WARM_POOL_TTL_HOURS,
+    expire_pool,
+    load_classroom_words,
+    pool_buckets,
+    refill_pool,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Expire old pooled storylines and pre-generate new ones for every classroom word list "
+                    "and genre/style bucket. Run it periodically, e.g. hourly from cron."
+    )
+    parser.add_argument("yaml_file", nargs="?", default=CLASSROOM_WORDS_PATH,
+                        help=f"Classroom word lists to stock (default: {CLASSROOM_WORDS_PATH}).")
+    parser.add_argument("--classroom", action="append", help="Only stock this classroom (repeatable).")
+    parser.add_argument("--size", type=int, default=WARM_POOL_SIZE,
+                        help=f"Ready storylines per bucket (default: {WARM_POOL_SIZE}).")
+    parser.add_argument("--ttl-hours", type=float, default=WARM_POOL_TTL_HOURS,
+                        help=f"Hours a ready storyline waits to be claimed (default: {WARM_POOL_TTL_HOURS:g}).")
+    parser.add_argument("--genres", help="Comma separated genres to stock (default: WARM_POOL_GENRES or all).")
+    parser.add_argument("--styles", help="Comma separated styles to stock (default: WARM_POOL_STYLES or all).")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent generations.")
+    parser.add_argument("--expire-only", action="store_true", help="Only remove expired storylines.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("refill_storyline_pool")
+        # cProfile only sees the main thread
+        args.workers = 1
+
+    if args.expire_only:
+        logger.info(json.dumps({"expired": expire_pool(ttl_hours=args.ttl_hours)}))
+        raise SystemExit(0)
+
+    classroom_words = load_classroom_words(args.yaml_file)
+    if args.classroom:
+        missing = set(args.classroom) - set(classroom_words)
+        if missing:
+            parser.error(f"Classrooms not in {args.yaml_file}: {', '.join(sorted(missing))}")
+        classroom_words = {name: words for name, words in classroom_words.items() if name in args.classroom}
+
+    buckets = pool_buckets(
+        genres=[g.strip() for g in args.genres.split(",")] if args.genres else None,
+        styles=[s.strip() for s in args.styles.split(",")] if args.styles else None,
+    )
+    report = refill_pool(classroom_words, size=args.size, ttl_hours=args.ttl_hours,
+                         buckets=buckets, max_workers=args.workers)
+    logger.info(json.dumps(report))
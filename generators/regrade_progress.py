@@ -0,0 +1,23 @@
+import argparse
+import logging
+
+from src.grading import regrade_progress
+from src.profiling import enable_cli_profiling
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-grade stored answers in storyline_progress with the current grading rules.")
+    parser.add_argument("storyline_ids", type=int, nargs="*", help="Only re-grade these storylines (default: all).")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Progress rows per batch.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("regrade_progress")
+
+    counts = regrade_progress(batch_size=args.batch_size, storyline_ids=args.storyline_ids or None)
+    logger.info(f"Checked {counts['checked']} progress rows, updated {counts['updated']} scores.")
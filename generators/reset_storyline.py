@@ -1,102 +1,221 @@
 import argparse
 import logging
-from sqlalchemy.orm import joinedload
+import os
+from typing import Dict, List, Optional
 
+import requests
+from sqlalchemy import case, delete, exists, select, update
+
+from src.cache import fragment_cache
+from src.fakes import FAKE_BLOB_DIR
+from src.lazy_steps import GENERATE_STEP_TASK
+from src.vocab_bank import vocabulary_bank
+from src.warm_pool import CLAIMED, EXPIRED, POOL_PENDING_STATUS
 from src.orm import (
     db_session,
+    Question,
     Story,
     Storyline,
+    StorylineProgress,
     StorylineStep,
-    StoryQuestion  # Import StoryQuestion although deletion is handled by cascade
+    StoryQuestion,
+    StorylinePoolEntry,
+    TaskQueue,
+    TaskStatus
 )
+from src.profiling import enable_cli_profiling
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Keep IN (...) lists well under every database's bound parameter limit
+CHUNK_SIZE = 500
+
+VERCEL_BLOB_DELETE_URL = "https://blob.vercel-storage.com/delete"
+
+
+def chunked(ids: List[int], size: int = CHUNK_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def delete_blob_audio(urls: List[str]) -> int:
+    """
+    Delete audio clips from Vercel Blob (and the local fake blob store).
+
+    Returns:
+        The number of clips deleted
+    """
+    local = [url for url in urls if url.startswith(f"/{FAKE_BLOB_DIR}/")]
+    for url in local:
+        try:
+            os.remove(url.lstrip("/"))
+        except FileNotFoundError:
+            pass
+
+    remote = [url for url in urls if url.startswith("https://") and "blob.vercel-storage.com" in url]
+    token = os.getenv("BLOB_READ_WRITE_TOKEN")
+    if remote and not token:
+        logger.warning(f"BLOB_READ_WRITE_TOKEN not set, leaving {len(remote)} blob clips in place.")
+        return len(local)
+    for urls_chunk in chunked(remote, 100):
+        response = requests.post(
+            VERCEL_BLOB_DELETE_URL,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"urls": urls_chunk},
+            timeout=30,
+        )
+        response.raise_for_status()
+    return len(local) + len(remote)
+
+
+def reset_storylines(storyline_ids: List[int], gc_questions: bool = False, gc_audio: bool = False) -> Dict[str, int]:
+    """
+    Delete the steps, queued step tasks, stories, question links and progress
+    of many storylines with a handful of set-based statements, and mark them
+    pending again. The storyline rows themselves are kept.
+
+    Args:
+        storyline_ids: Storylines to reset
+        gc_questions: Also delete generated (`vocab_*`) questions no story uses any more
+        gc_audio: Also delete the audio clips of the removed stories
+
+    Returns:
+        Row counts of what was deleted
+    """
+    storyline_ids = sorted(set(storyline_ids))
+    counts = {"storylines": 0, "progress": 0, "steps": 0, "step_tasks": 0, "story_questions": 0, "stories": 0, "questions": 0, "audio": 0}
+    audio_urls: List[str] = []
+
+    with db_session() as session:
+        for ids in chunked(storyline_ids):
+            story_ids = [
+                row[0] for row in
+                session.query(StorylineStep.story_id).filter(StorylineStep.storyline_id.in_(ids)).distinct().all()
+            ]
+            question_ids = []
+            if story_ids and gc_questions:
+                question_ids = [
+                    row[0] for row in
+                    session.query(StoryQuestion.question_id).filter(StoryQuestion.story_id.in_(story_ids)).distinct().all()
+                ]
+            if story_ids and gc_audio:
+                audio_urls += [
+                    row[0] for row in
+                    session.query(Story.audio).filter(Story.id.in_(story_ids), Story.audio.isnot(None)).all()
+                ]
+
+            # Children before parents: progress points at steps and question links
+            counts["progress"] += session.execute(
+                delete(StorylineProgress).where(StorylineProgress.storyline_id.in_(ids))
+            ).rowcount
+            counts["steps"] += session.execute(
+                delete(StorylineStep).where(StorylineStep.storyline_id.in_(ids))
+            ).rowcount
+            # Queued steps of a lazy storyline would be written into the regenerated one
+            counts["step_tasks"] += session.execute(
+                delete(TaskQueue)
+                .where(TaskQueue.storyline_id.in_(ids))
+                .where(TaskQueue.title == GENERATE_STEP_TASK)
+                .where(TaskQueue.status.in_([TaskStatus.PENDING, TaskStatus.IN_PROGRESS]))
+            ).rowcount
+            for story_chunk in chunked(story_ids):
+                counts["story_questions"] += session.execute(
+                    delete(StoryQuestion).where(StoryQuestion.story_id.in_(story_chunk))
+                ).rowcount
+                counts["stories"] += session.execute(
+                    delete(Story).where(Story.id.in_(story_chunk))
+                ).rowcount
+
+            for question_chunk in chunked(question_ids):
+                still_used = exists().where(StoryQuestion.question_id == Question.id)
+                deleted = session.execute(
+                    delete(Question)
+                    .where(Question.id.in_(question_chunk))
+                    .where(Question.key.like("vocab\\_%", escape="\\"))
+                    .where(~still_used)
+                    .returning(Question.id)
+                ).scalars().all()
+                counts["questions"] += len(deleted)
+                # Their IDs can be reused; don't let this process's bank hand them out
+                vocabulary_bank.forget_questions(deleted)
+
+            if counts["questions"]:
+                fragment_cache.invalidate("classroom_questions", session=session)
+
+            # Unclaimed pool storylines leave the pool: the next expire/refill
+            # deletes them and stocks fresh ones. They never become "pending",
+            # which would put them in listings and generation sweeps.
+            unclaimed = (
+                select(StorylinePoolEntry.storyline_id)
+                .where(StorylinePoolEntry.storyline_id.in_(ids))
+                .where(StorylinePoolEntry.status != CLAIMED)
+            )
+            session.execute(
+                update(StorylinePoolEntry)
+                .where(StorylinePoolEntry.storyline_id.in_(ids))
+                .where(StorylinePoolEntry.status != CLAIMED)
+                .values(status=EXPIRED)
+            )
+            counts["storylines"] += session.execute(
+                update(Storyline).where(Storyline.storyline_id.in_(ids)).values(
+                    status=case((Storyline.storyline_id.in_(unclaimed), POOL_PENDING_STATUS), else_="pending")
+                )
+            ).rowcount
+
+        if audio_urls:
+            # Another story may share a clip; only delete the unreferenced ones
+            still_referenced = {
+                row[0] for url_chunk in chunked(audio_urls)
+                for row in session.query(Story.audio).filter(Story.audio.in_(url_chunk)).all()
+            }
+            audio_urls = [url for url in set(audio_urls) if url not in still_referenced]
+
+    # Only touch external storage once the database changes are committed
+    if audio_urls:
+        counts["audio"] = delete_blob_audio(audio_urls)
+
+    logger.info(f"Reset {counts['storylines']} storylines: {counts}")
+    return counts
+
+
 def reset_storyline(storyline_id: int):
     """
     Deletes all StorylineStep, Story, and StoryQuestion objects associated
     with the given storyline_id, but leaves the Storyline object itself.
     """
-    logger.info(f"Attempting to clear associated data for storyline_id: {storyline_id}")
+    return reset_storylines([storyline_id])
+
+
+def storyline_ids_matching(status: Optional[str] = None, batch_id: Optional[str] = None) -> List[int]:
     with db_session() as session:
-        try:
-            # Fetch the storyline and eagerly load related steps and their stories
-            storyline = (
-                session.query(Storyline)
-                .options(
-                    joinedload(Storyline.steps).joinedload(StorylineStep.story)
-                )
-                .filter(Storyline.storyline_id == storyline_id)
-                .one_or_none()
-            )
+        query = session.query(Storyline.storyline_id)
+        if status:
+            query = query.filter(Storyline.status == status)
+        if batch_id:
+            query = query.filter(Storyline.batch_id == batch_id)
+        return [row[0] for row in query.all()]
 
-            if not storyline:
-                logger.warning(f"Storyline with ID {storyline_id} not found.")
-                return
-
-            logger.info(f"Found Storyline {storyline_id}. Preparing to clear associated steps, stories, and questions.")
-
-            # Collect associated Story objects and StorylineStep objects
-            stories_to_delete = []
-            steps_to_delete = list(storyline.steps) # Create a copy to iterate over while deleting
-
-            if steps_to_delete:
-                logger.info(f"Found {len(steps_to_delete)} steps associated with Storyline {storyline_id}.")
-                for step in steps_to_delete:
-                    if step.story:
-                        # Avoid adding duplicates if multiple steps somehow point to the same story
-                        if step.story not in stories_to_delete:
-                             stories_to_delete.append(step.story)
-                    else:
-                         logger.warning(f"StorylineStep {step.storyline_step_id} has no associated Story.")
-            else:
-                logger.info(f"No steps found for Storyline {storyline_id}.")
-
-
-            # Delete the associated StorylineStep objects.
-            # Cascade should handle deleting associated StorylineProgress if configured.
-            if steps_to_delete:
-                logger.info(f"Deleting {len(steps_to_delete)} associated StorylineStep objects...")
-                for step in steps_to_delete:
-                     logger.debug(f"Deleting StorylineStep {step.storyline_step_id}...")
-                     session.delete(step)
-                # Remove steps from the storyline's collection in memory
-                storyline.steps = []
-                logger.info("Associated StorylineStep objects deleted.")
-            else:
-                 logger.info("No associated StorylineStep objects to delete.")
-
-
-            # Delete the associated Story objects.
-            # Cascade should handle deleting associated StoryQuestion links.
-            if stories_to_delete:
-                logger.info(f"Deleting {len(stories_to_delete)} associated Story objects...")
-                for story in stories_to_delete:
-                    logger.debug(f"Deleting Story {story.id}...")
-                    session.delete(story)
-                logger.info("Associated Story objects deleted.")
-            else:
-                logger.info("No associated Story objects to delete.")
-
-            # Commit the transaction
-            # session.commit() is handled by the db_session context manager
-            logger.info(f"Successfully cleared associated data for storyline {storyline_id}.")
-
-            storyline.status = 'pending'
-
-            session.add(storyline)
-
-        except Exception as e:
-            logger.error(f"An error occurred while resetting storyline {storyline_id}: {e}", exc_info=True)
-            # Rollback is handled by the db_session context manager
-            raise # Re-raise the exception after logging
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Clear a storyline by deleting its associated steps, stories, and questions, leaving the storyline record itself.")
-    parser.add_argument("storyline_id", type=int, help="The ID of the storyline to reset.")
+    parser = argparse.ArgumentParser(description="Clear storylines by deleting their steps, stories, question links and progress, leaving the storyline records themselves.")
+    parser.add_argument("storyline_ids", type=int, nargs="*", help="The ID(s) of the storylines to reset.")
+    parser.add_argument("--status", help="Reset every storyline with this status, e.g. completed.")
+    parser.add_argument("--batch-id", help="Reset every storyline of a bulk-created batch.")
+    parser.add_argument("--gc-questions", action="store_true", help="Delete generated questions no longer used by any story.")
+    parser.add_argument("--gc-audio", action="store_true", help="Delete the audio clips of removed stories from blob storage.")
+    parser.add_argument("--profile", action="store_true", help="Profile this run with cProfile and save the result under profiles/.")
 
     args = parser.parse_args()
 
-    reset_storyline(args.storyline_id)
\ No newline at end of file
+    if args.profile:
+        enable_cli_profiling(f"generators.reset_storyline {' '.join(map(str, args.storyline_ids))}".strip())
+
+    storyline_ids = list(args.storyline_ids)
+    if args.status or args.batch_id:
+        storyline_ids += storyline_ids_matching(status=args.status, batch_id=args.batch_id)
+    if not storyline_ids:
+        parser.error("Provide storyline IDs, --status or --batch-id.")
+
+    reset_storylines(storyline_ids, gc_questions=args.gc_questions, gc_audio=args.gc_audio)
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import time
+from typing import Dict, Optional
+
+from src.orm import Storyline, TaskQueue, TaskStatus, claim_task, db_session
+from src.profiling import enable_cli_profiling
+from src.storyline.batch import GENERATE_STORYLINE_TASK
+from generators.batch_stories import storylines_in_flight
+from generators.stories import generate_classroom_stories
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def run_storyline_tasks(limit: Optional[int] = None, max_workers: int = 8, lazy: bool = False) -> Dict[int, bool]:
+    """
+    Claim pending `generate_storyline` tasks, highest priority first, and
+    generate their storylines together.
+
+    Storylines an OpenAI batch is already working on are handed back to the
+    queue, and storylines that are no longer pending just close their task.
+
+    Returns:
+        A mapping of task ID to whether its storyline was generated
+    """
+    with db_session() as session:
+        query = (
+            session.query(TaskQueue.id, TaskQueue.context)
+            .filter(TaskQueue.title == GENERATE_STORYLINE_TASK)
+            .filter(TaskQueue.status == TaskStatus.PENDING)
+            .order_by(TaskQueue.priority.desc(), TaskQueue.created_at, TaskQueue.id)
+        )
+        if limit:
+            query = query.limit(limit)
+        tasks = query.all()
+        in_flight = storylines_in_flight(session)
+        claimed = {
+            task_id: context["storyline_id"] for task_id, context in tasks
+            if context["storyline_id"] not in in_flight and claim_task(session, task_id)
+        }
+    if not claimed:
+        return {}
+
+    generate_classroom_stories(sorted(set(claimed.values())), max_workers=max_workers, lazy=lazy)
+
+    results = {}
+    with db_session() as session:
+        statuses = dict(
+            session.query(Storyline.storyline_id, Storyline.status)
+            .filter(Storyline.storyline_id.in_(claimed.values()))
+            .all()
+        )
+        for task_id, storyline_id in claimed.items():
+            results[task_id] = statuses.get(storyline_id) == "completed"
+            session.query(TaskQueue).filter(TaskQueue.id == task_id).update(
+                {"status": TaskStatus.COMPLETED if results[task_id] else TaskStatus.FAILED}
+            )
+        # Let the batch status report them as done
+        failed = [claimed[task_id] for task_id, ok in results.items() if not ok]
+        if failed:
+            session.query(Storyline).filter(
+                Storyline.storyline_id.in_(failed), Storyline.status == "pending"
+            ).update({"status": "failed"}, synchronize_session=False)
+
+    logger.info(f"Generated {sum(results.values())} of {len(results)} queued storylines")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the storylines queued by POST /storylines/bulk.")
+    parser.add_argument("--limit", type=int, default=None, help="Tasks claimed per round (default: all pending).")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent generations.")
+    parser.add_argument("--lazy", action="store_true", help="Only generate the first step now, later steps as the student reads.")
+    parser.add_argument("--watch", type=float, default=None, help="Keep polling the queue every this many seconds.")
+    parser.add_argument("--profile", action="store_true", help="Profile the run with cProfile and save the stats under profiles/.")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_cli_profiling("run_storyline_tasks")
+        # cProfile only sees the main thread
+        args.workers = 1
+
+    while True:
+        run_storyline_tasks(limit=args.limit, max_workers=args.workers, lazy=args.lazy)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
@@ -4,10 +4,12 @@ import argparse
 import json
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from typing import List, Dict, Optional, Union
 
 from src.utils import (
+    create_llm,
     replace_keywords_with_links,
     generate_tts,
     gen_incorrect_answers,
@@ -18,30 +20,27 @@ from src.utils import (
     INTERESTS,
     FRIENDS
 )
+from sqlalchemy import update
+
 from src.orm import (
-    Question, Story, Storyline, StorylineStep, StoryQuestion, db_session
+    Question, Story, Storyline, StorylineStep, StoryQuestion, TaskQueue, TaskStatus, claim_task, db_session
 )
+from src.lazy_steps import EAGER_STEPS, pending_step_tasks, reclaim_step_tasks, step_task
+from src.profiling import enable_cli_profiling
+from src.fakes import fake_backend_enabled, fake_blob_upload
+from src.vocab_bank import vocabulary_bank
+from src.warm_pool import POOL_PENDING_STATUS, POOLED_STATUS
+from src.tracing import configure_tracing, current_span, record_token_usage, span
 # Removed: from src import assignments - will replace this logic
 
-from langchain_openai import ChatOpenAI
-from langchain.schema import AIMessage, HumanMessage
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
 # Load environment variables from .env file
 load_dotenv()
 
 
 # Initialize the LLM
-try:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=1)
-except Exception as e:
-    print(f"Warning: Could not initialize ChatOpenAI: {e}")
-    # Create a dummy LLM for testing
-    class DummyLLM:
-        def __call__(self, messages):
-            class DummyResponse:
-                content = "This is a dummy response for testing."
-            return DummyResponse()
-    llm = DummyLLM()
+llm = create_llm()
 
 
 def validate_and_rewrite_paragraph(paragraph: str, required_words: List[str]) -> Union[str, None]:
@@ -77,7 +76,10 @@ Rewritten paragraph:
     print("----------------------")
 
     try:
-        rewritten_paragraph = llm([HumanMessage(content=rewrite_prompt)]).content.strip()
+        with span("llm.rewrite", missing_words=len(missing_words)) as rewrite_span:
+            rewrite_message = llm([HumanMessage(content=rewrite_prompt)])
+            record_token_usage(rewrite_span, rewrite_message)
+        rewritten_paragraph = rewrite_message.content.strip()
         print("--- LLM REWRITTEN RESPONSE ---")
         print(rewritten_paragraph)
         print("-----------------------------")
@@ -100,75 +102,509 @@ Rewritten paragraph:
         print(f"Error calling LLM for rewrite: {e}")
         return None # Indicate failure
 
-def generate_story(storyline_id: int):
+def build_shared_prompt_prefix(required_words: List[str]) -> str:
     """
-    Generates a story based on a specific Storyline ID, fetching details
-    from the database and its original_request JSON field.
+    Instructions common to every story written over the same word list.
+
+    Everything that varies per student lives in the user message that follows,
+    so stories for a whole class start with an identical prefix and the
+    provider's prompt cache can be reused across them.
     """
-    print(f"Generating story for storyline_id: {storyline_id}")
-    with db_session() as session: # Start DB session context and get session object
-        storyline = session.get(Storyline, storyline_id) # Use SQLAlchemy session.get()
-        # Serialize and print the storyline object for debugging
-        if not storyline:
-            print(f"Error: Storyline with ID {storyline_id} not found.")
-            return None
-        if not storyline.original_request:
-            print(f"Error: Storyline {storyline_id} does not have an original_request.")
-            return None
-        if storyline.status != 'pending':
-            print(f"Error: Storyline {storyline_id} has already been processed.")
-            return None
+    return f"""
+You write stories for young readers who are practising their vocabulary.
+Every story should be very silly. Over the top silly.
+Make the story about 4 paragraphs long, with paragraphs separated by a blank line.
+Use each of these vocabulary words at least once: {', '.join(sorted(required_words))}
+"""
 
-        try:
-            request_data = json.loads(storyline.original_request)
-            print("Successfully parsed original_request JSON.")
-        except json.JSONDecodeError as e:
-            print(f"Error parsing original_request JSON for storyline {storyline_id}: {e}")
-            return None
 
-        # --- Extract data from request_data ---
-        try:
-            # New vocab-based structure
-            words_list = request_data['words'] # List of words from vocab
-            vocab_id = request_data.get('vocab_id') # Optional vocab ID
-            genre = request_data['genre']
-            location = request_data['location']
-            style = request_data['style']
-            selected_interests = request_data.get('selected_interests', []) # Use .get for optional field
-            friend = request_data['friend']
-            # Assuming 'Maeve' is the user for now, or extract if available
-            user_name = "Maeve"
-            user_age = 8 # Assuming age, or extract if available
-        except KeyError as e:
-            print(f"Error: Missing key '{e}' in original_request JSON for storyline {storyline_id}.")
-            return None
+def build_story_messages(required_words: List[str], genre: str, location: str, style: str,
+                         user_name: str, user_age: int, interests_string: str, friend: str) -> list:
+    user_prompt = f"""
+Write an {genre} story located in {location} in the style of {style} for {user_name} who is {user_age} years old.
+She likes {interests_string}, and her best friend is {friend}.
+"""
+    return [
+        SystemMessage(content=build_shared_prompt_prefix(required_words)),
+        HumanMessage(content=user_prompt),
+    ]
 
-        if not words_list:
-             print(f"Error: 'words' list is empty in original_request for storyline {storyline_id}.")
-             return None
 
-        # --- Adapt data for existing logic ---
-        required_words = words_list
-        interests_string = ", ".join(selected_interests) if selected_interests else "nothing in particular"
+def generate_distractors(word: str) -> List[str]:
+    """
+    Ask the LLM for incorrect spellings of a word.
+    """
+    with span("llm.distractors", word=word):
+        # gen_incorrect_answers mixes the correct word back in, drop it here
+        return [
+            answer.strip() for answer in gen_incorrect_answers(word, num_incorrect=3)
+            if answer.strip() and answer.strip() != word
+        ]
 
-        print(f"Required words: {required_words}")
-        print(f"Genre: {genre}, Location: {location}, Style: {style}")
-        print(f"Interests: {interests_string}, Friend: {friend}")
 
-        # --- Generate User Prompt ---
-        user_prompt = f"""
-Write an {genre} story located in {location} in the style of {style} for {user_name} who is {user_age} years old. It should be very silly. Over the top silly.
-She likes {interests_string}, and her best friend is {friend}.
+def get_select_answers(word: str, distractor_cache: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """
+    Return the shuffled answer choices (the word plus distractors) for a word,
+    generating the distractors only if the cache does not have them yet.
+    """
+    if distractor_cache is not None and word in distractor_cache:
+        incorrect_answers = distractor_cache[word]
+        if current_span():
+            current_span().add("distractor_cache_hits")
+    else:
+        incorrect_answers = generate_distractors(word)
+        if distractor_cache is not None:
+            distractor_cache[word] = incorrect_answers
 
-Make the story about 4 paragraphs long.
-"""
-        print("--- USER PROMPT ---")
-        print(user_prompt)
-        print("--------------------")
+    all_answers = [word] + incorrect_answers
+    random.shuffle(all_answers)  # Randomize answer order
+    return all_answers
+
+
+def generate_paragraph_audio(text: str, filename_base: str, local_audio_dir: str = "./media/tts_temp") -> str:
+    """
+    Run TTS for one paragraph and return the path of the local mp3.
+    """
+    output_filename = f"{filename_base}.mp3"
+    os.makedirs(local_audio_dir, exist_ok=True) # Ensure dir exists
+    local_audio_path = os.path.join(local_audio_dir, output_filename)
+
+    with span("tts", characters=len(text)) as tts_span:
+        generate_tts(text, output_filename, output_dir=local_audio_dir)
+
+        # Check if file exists after generation
+        if not os.path.exists(local_audio_path):
+             raise FileNotFoundError(f"TTS file not found at {local_audio_path} after generation attempt.")
+        tts_span.set_attribute("bytes", os.path.getsize(local_audio_path))
+
+    return local_audio_path
+
+
+def upload_audio_to_blob(local_audio_path: str, blob_pathname: str, vercel_blob_token: str) -> Optional[str]:
+    """
+    Upload a local audio file to Vercel Blob and return its public URL.
+    """
+    if fake_backend_enabled("blob"):
+        with span("blob_upload", pathname=blob_pathname, bytes=os.path.getsize(local_audio_path)):
+            return fake_blob_upload(local_audio_path, blob_pathname)
+
+    upload_url = f"https://blob.vercel-storage.com/{blob_pathname}"
+    headers = {
+        "Authorization": f"Bearer {vercel_blob_token}",
+        "Content-Type": "audio/mpeg",
+        "x-vercel-blob-client": "python-requests-manual-0.1" # Identify client
+    }
+
+    with open(local_audio_path, "rb") as audio_file:
+        audio_data = audio_file.read()
+
+    with span("blob_upload", pathname=blob_pathname, bytes=len(audio_data)):
+        response = requests.put(upload_url, headers=headers, data=audio_data)
+        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+    return response.json().get("url")
+
+
+def question_classroom(request_data: Dict) -> str:
+    """
+    Classroom a story's questions are filed under: the roster classroom when
+    the request names one, otherwise its vocabulary list.
+    """
+    return request_data.get('classroom') or f"vocab_{request_data.get('vocab_id')}"
+
+
+# Storylines in these statuses are waiting to be generated
+GENERATABLE_STATUSES = ('pending', POOL_PENDING_STATUS)
+
+
+def load_story_request(session, storyline_id: int) -> Optional[Dict]:
+    """
+    Load a pending Storyline and turn its original_request JSON into the
+    prompt messages plus everything needed to save the generated story.
+
+    Returns:
+        A dictionary with the storyline, required words, vocab ID and prompt
+        messages, or None if the storyline can not be generated
+    """
+    storyline = session.get(Storyline, storyline_id) # Use SQLAlchemy session.get()
+    # Serialize and print the storyline object for debugging
+    if not storyline:
+        print(f"Error: Storyline with ID {storyline_id} not found.")
+        return None
+    if not storyline.original_request:
+        print(f"Error: Storyline {storyline_id} does not have an original_request.")
+        return None
+    if storyline.status not in GENERATABLE_STATUSES:
+        print(f"Error: Storyline {storyline_id} has already been processed.")
+        return None
+
+    try:
+        request_data = json.loads(storyline.original_request)
+        print("Successfully parsed original_request JSON.")
+    except json.JSONDecodeError as e:
+        print(f"Error parsing original_request JSON for storyline {storyline_id}: {e}")
+        return None
+
+    # --- Extract data from request_data ---
+    try:
+        # New vocab-based structure
+        words_list = request_data['words'] # List of words from vocab
+        vocab_id = request_data.get('vocab_id') # Optional vocab ID
+        genre = request_data['genre']
+        location = request_data['location']
+        style = request_data['style']
+        selected_interests = request_data.get('selected_interests', []) # Use .get for optional field
+        friend = request_data['friend']
+        # Assuming 'Maeve' is the user for now, or extract if available
+        user_name = "Maeve"
+        user_age = 8 # Assuming age, or extract if available
+    except KeyError as e:
+        print(f"Error: Missing key '{e}' in original_request JSON for storyline {storyline_id}.")
+        return None
+
+    if not words_list:
+         print(f"Error: 'words' list is empty in original_request for storyline {storyline_id}.")
+         return None
+
+    # --- Adapt data for existing logic ---
+    required_words = words_list
+    interests_string = ", ".join(selected_interests) if selected_interests else "nothing in particular"
+
+    print(f"Required words: {required_words}")
+    print(f"Genre: {genre}, Location: {location}, Style: {style}")
+    print(f"Interests: {interests_string}, Friend: {friend}")
+
+    # --- Generate Prompt: shared prefix + per-student request ---
+    messages = build_story_messages(
+        required_words, genre, location, style,
+        user_name, user_age, interests_string, friend
+    )
+    print("--- PROMPT ---")
+    for message in messages:
+        print(message.content)
+    print("--------------------")
+
+    return {
+        "storyline": storyline,
+        "required_words": required_words,
+        "vocab_id": vocab_id,
+        "classroom": question_classroom(request_data),
+        "messages": messages,
+    }
+
+
+def get_blob_token() -> Optional[str]:
+    """
+    Vercel Blob token for audio uploads, None when audio is skipped.
+    """
+    vercel_blob_token = os.getenv("BLOB_READ_WRITE_TOKEN")
+    if not vercel_blob_token and fake_backend_enabled("blob"):
+        vercel_blob_token = "fake" # Uploads go to the local fake blob store
+    if not vercel_blob_token:
+        print("Warning: BLOB_READ_WRITE_TOKEN environment variable not set. Audio upload will be skipped.")
+    return vercel_blob_token
+
+
+def process_paragraph(session, storyline_id: int, i: int, para: str, required_words: List[str], classroom: str,
+                      vercel_blob_token: Optional[str], all_questions_map: Dict[str, Question],
+                      distractor_cache: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """
+    Validate (rewriting if needed) and link the paragraph at index `i`, create
+    its questions, and generate and upload its audio.
+
+    Returns:
+        The step's linked content, raw content, questions and audio URL
+    """
+    with span("paragraph", index=i+1) as paragraph_span:
+        print(f"--- PROCESSING PARAGRAPH {i+1} ---")
+        tries = 0
+        max_tries = 7
+
+        while tries < max_tries:
+            tries += 1
+            validated_para = validate_and_rewrite_paragraph(para, required_words)
+            if not validated_para:
+                print(f"Skipping paragraph {i+1} due to validation/rewrite failure.")
+                validated_para = para
+            para = validated_para
+
+            # Find which required words are actually in the *final* paragraph text
+            words_in_para = [word for word in required_words if word.lower().strip() in validated_para.lower()]
+            print(f"Words found in paragraph {i+1}: {words_in_para}")
+
+            # Link keywords in the validated paragraph
+            linked_para = replace_keywords_with_links(validated_para, words_in_para)
+            print(f"Linked paragraph {i+1}: {linked_para}")
+
+            if len(words_in_para) == len(required_words):
+                break
+        paragraph_span.set_attribute("retries", tries - 1)
+
+        # Create Question objects for words in this paragraph
+        para_questions = []
+        for word in words_in_para:
+            if word not in all_questions_map:
+                # Create a new 'select' type question for this word
+                try:
+                    # Reuse the bank's question for this word, generating
+                    # (or reusing) incorrect answers only on a miss
+                    question_obj = vocabulary_bank.get_or_create_question(
+                        session,
+                        word,
+                        classroom=classroom,
+                        key=f"{classroom}_{word}",  # Unique key based on classroom and word
+                        generate_answers=lambda: get_select_answers(word, distractor_cache),
+                    )
+
+                    # Add the question to the map for later use in linking
+                    all_questions_map[word] = question_obj
+                    print(f"Using select question for '{word}': ID={question_obj.id}, Key='{question_obj.key}'")
+
+                except Exception as e:
+                    print(f"Error creating question for word '{word}': {e}")
+                    continue # Skip if we can't create the question
+
+            # Add the Question object (if found/created) to this paragraph's list
+            if word in all_questions_map:
+                para_questions.append(all_questions_map[word])
+
+        audio_url = None # Initialize audio URL for this paragraph
+
+        if validated_para and vercel_blob_token: # Only proceed if paragraph is valid and token exists
+            try:
+                # 1. Generate TTS locally
+                filename_base = f"story_{storyline_id}_para_{i+1}"
+                print(f"Generating TTS for paragraph {i+1}...")
+                # Use validated_para for TTS input
+                local_audio_path = generate_paragraph_audio(validated_para, filename_base)
+
+                # 2. Upload to Vercel Blob
+                # Add random suffix for uniqueness
+                blob_pathname = f"audio/{filename_base}_{random.randint(1000, 9999)}.mp3"
+                print(f"Uploading {local_audio_path} to Vercel Blob at {blob_pathname}...")
+
+                # 3. Get the public URL from response
+                audio_url = upload_audio_to_blob(local_audio_path, blob_pathname, vercel_blob_token)
+                if not audio_url:
+                    print(f"Warning: Vercel Blob upload successful but no URL found in response for {blob_pathname}.")
+                else:
+                    print(f"Vercel Blob upload successful. URL: {audio_url}")
+
+                # 4. Cleanup local file (optional)
+                try:
+                    os.remove(local_audio_path)
+                    print(f"Removed temporary local file: {local_audio_path}")
+                except OSError as e:
+                    print(f"Warning: Could not remove temporary file {local_audio_path}: {e}")
+
+            except FileNotFoundError as e:
+                 print(f"Error during TTS file handling for paragraph {i+1}: {e}")
+            except requests.exceptions.RequestException as e:
+                print(f"Error uploading audio to Vercel Blob for paragraph {i+1}: {e}")
+                if hasattr(e, 'response') and e.response is not None:
+                     print(f"Vercel Response Status: {e.response.status_code}")
+                     print(f"Vercel Response Body: {e.response.text}")
+            except Exception as e:
+                print(f"An unexpected error occurred during audio processing for paragraph {i+1}: {e}")
+
+        elif not vercel_blob_token:
+             print(f"Skipping audio generation/upload for paragraph {i+1} due to missing BLOB_READ_WRITE_TOKEN.")
+        else: # validated_para was None
+             print(f"Skipping audio generation/upload for paragraph {i+1} because paragraph validation failed.")
+
+        # Processed data including the audio_url (which might be None)
+        print("--------------------------")
+        return {
+            "content": linked_para,
+            "raw_content": validated_para, # Keep raw content
+            "questions": para_questions,
+            "audio_url": audio_url # Add the URL here
+        }
+
+
+def add_story_step(session, storyline: Storyline, step_number: int, para_data: Dict) -> StorylineStep:
+    """
+    Save a processed paragraph as step `step_number` of the storyline.
+    """
+    # Create Story object, now including the audio URL
+    story_obj = Story(
+        content=para_data["content"],
+        audio=para_data["audio_url"] # Get URL from processed data
+    )
+    step = StorylineStep(
+        storyline=storyline,
+        step=step_number,
+        story=story_obj
+    )
+    session.add(step) # Explicitly add the new step to the session
+
+    for question_obj in para_data["questions"]:
+        # Link Questions to Story, the bank already added them to the session
+        session.add(StoryQuestion(story=story_obj, question=question_obj))
+    return step
+
+
+def save_story_response(session, story_request: Dict, response: str, distractor_cache: Optional[Dict[str, List[str]]] = None,
+                        eager_steps: Optional[int] = None):
+    """
+    Validate a raw LLM story, split it into steps, create questions and audio,
+    and save everything to the storyline loaded by `load_story_request`.
+
+    Both the synchronous path and the batch ingestion path end up here.
+
+    With `eager_steps`, only the first steps are processed now and the
+    storyline becomes readable straight away. Every later paragraph is queued
+    as a `generate_storyline_step` task and processed once a reader gets
+    close to it (see src/lazy_steps.py).
+    """
+    storyline = story_request["storyline"]
+    storyline_id = storyline.storyline_id
+    required_words = story_request["required_words"]
+    classroom = story_request["classroom"]
+
+    # 3. Break into paragraphs
+    paragraphs = [p.strip() for p in response.split('\n\n') if p.strip()]
+    if not paragraphs:
+        print("Warning: LLM response did not contain paragraphs separated by double newlines.")
+        paragraphs = [response.strip()] if response.strip() else []
+        if not paragraphs:
+            print("Error: LLM response was empty.")
+            return None # Still inside db_session
+
+    all_questions_map = {} # To store questions created for each unique word
+    vercel_blob_token = get_blob_token()
+    eager_count = len(paragraphs) if eager_steps is None else max(1, eager_steps)
+
+    # 4 & 5. Validate, rewrite (if needed), link keywords, and generate/upload audio for each paragraph
+    processed_paragraphs = [
+        process_paragraph(session, storyline_id, i, para, required_words, classroom,
+                          vercel_blob_token, all_questions_map, distractor_cache)
+        for i, para in enumerate(paragraphs[:eager_count])
+    ]
+
+    # --- Save Storyline, Steps, Stories, and Questions to DB ---
+    if not processed_paragraphs:
+        print("Error: No paragraphs were successfully processed after validation/rewriting.")
+        # Storyline object exists, but we won't add steps.
+        return storyline # Return existing storyline, indicating no steps added
+
+    for step_number, para_data in enumerate(processed_paragraphs, start=1):
+        add_story_step(session, storyline, step_number, para_data)
+
+    # Later paragraphs wait, unprocessed, until a reader needs them
+    deferred = paragraphs[len(processed_paragraphs):]
+    for step_number, para in enumerate(deferred, start=len(processed_paragraphs) + 1):
+        session.add(step_task(storyline_id, step_number, para, required_words, classroom))
+
+    with span("db.flush", steps=len(processed_paragraphs)):
+        session.flush()
+
+    print(f"Successfully added {len(processed_paragraphs)} steps to Storyline {storyline_id}")
+    if deferred:
+        print(f"Queued {len(deferred)} more steps of Storyline {storyline_id} for generation on demand")
+    # Pool storylines stay out of listings until someone claims them
+    storyline.status = POOLED_STATUS if storyline.status == POOL_PENDING_STATUS else 'completed'
+    session.add(storyline)
+    return storyline # Return the updated storyline object
+
+
+def generate_storyline_step(task_id: int) -> Optional[int]:
+    """
+    Process the paragraph of a claimed `generate_storyline_step` task and
+    save it as its storyline's step.
+
+    Returns:
+        The storyline_step_id of the step, or None if it could not be generated
+    """
+    try:
+        with span("generate_storyline_step", task_id=task_id), db_session() as session:
+            task = session.get(TaskQueue, task_id)
+            if task is None:
+                print(f"Error: Step task {task_id} not found.")
+                return None
+            context = task.context
+            storyline = session.get(Storyline, context["storyline_id"])
+            if storyline is None:
+                raise LookupError(f"Storyline {context['storyline_id']} not found")
+
+            # A retried task may find its step already written
+            storyline_step_id = (
+                session.query(StorylineStep.storyline_step_id)
+                .filter(StorylineStep.storyline_id == storyline.storyline_id)
+                .filter(StorylineStep.step == context["step"])
+                .scalar()
+            )
+            if storyline_step_id is None:
+                para_data = process_paragraph(
+                    session, storyline.storyline_id, context["step"] - 1, context["paragraph"],
+                    context["required_words"], question_classroom(context), get_blob_token(), {}
+                )
+                step = add_story_step(session, storyline, context["step"], para_data)
+                session.flush()
+                storyline_step_id = step.storyline_step_id
+                print(f"Generated step {context['step']} of Storyline {storyline.storyline_id}")
+
+            task.status = TaskStatus.COMPLETED
+            return storyline_step_id
+    except Exception as e:
+        print(f"Error generating step for task {task_id}: {e}")
+        with db_session() as session:
+            session.execute(update(TaskQueue).where(TaskQueue.id == task_id).values(status=TaskStatus.FAILED))
+        return None
+
+
+def generate_pending_steps(storyline_ids: Optional[List[int]] = None, retry: bool = True) -> Dict[int, bool]:
+    """
+    Generate every queued step nobody has read up to yet, e.g. before a
+    storyline is printed.
+
+    With `retry`, failed steps and steps whose worker stopped responding
+    (see `reclaim_step_tasks`) are queued again and generated too.
+
+    Returns:
+        A mapping of task ID to whether its step was generated
+    """
+    if retry:
+        with db_session() as session:
+            reclaimed = reclaim_step_tasks(session, storyline_ids)
+        if reclaimed:
+            print(f"Retrying {reclaimed} failed or abandoned steps")
+
+    with db_session() as session:
+        if storyline_ids:
+            tasks = [task for sid in storyline_ids for task in pending_step_tasks(session, sid)]
+        else:
+            tasks = pending_step_tasks(session)
+        task_ids = [task.id for task in tasks if claim_task(session, task.id)]
+
+    results = {task_id: generate_storyline_step(task_id) is not None for task_id in task_ids}
+    print(f"Generated {sum(results.values())} of {len(results)} pending steps")
+    return results
+
+
+def generate_story(storyline_id: int, distractor_cache: Optional[Dict[str, List[str]]] = None, lazy: bool = False):
+    """
+    Generates a story based on a specific Storyline ID, fetching details
+    from the database and its original_request JSON field.
+
+    Pass a shared `distractor_cache` (word -> incorrect answers) to reuse
+    distractors across stories written over the same words. With `lazy`,
+    only the first step is finished before the storyline is readable; later
+    steps are generated as the student reads.
+    """
+    print(f"Generating story for storyline_id: {storyline_id}")
+    with span("generate_story", storyline_id=storyline_id), db_session() as session: # Start DB session context and get session object
+        with span("load_request"):
+            story_request = load_story_request(session, storyline_id)
+        if story_request is None:
+            return None
 
         # 2. Get raw response from LLM
         try:
-            response = llm([HumanMessage(content=user_prompt)]).content
+            with span("llm.story", required_words=len(story_request["required_words"])) as llm_span:
+                story_message = llm(story_request["messages"])
+                record_token_usage(llm_span, story_message)
+            response = story_message.content
             print("--- LLM RAW RESPONSE ---")
             print(response)
             print("-----------------------")
@@ -176,222 +612,127 @@ Make the story about 4 paragraphs long.
             print(f"Error calling LLM: {e}")
             return None # Still inside db_session, but returning early
 
-        # 3. Break into paragraphs
-        paragraphs = [p.strip() for p in response.split('\n\n') if p.strip()]
-        if not paragraphs:
-            print("Warning: LLM response did not contain paragraphs separated by double newlines.")
-            paragraphs = [response.strip()] if response.strip() else []
-            if not paragraphs:
-                print("Error: LLM response was empty.")
-                return None # Still inside db_session
-
-        processed_paragraphs = []
-        all_questions_map = {} # To store questions created for each unique word
-
-        # Get Vercel Blob token
-        vercel_blob_token = os.getenv("BLOB_READ_WRITE_TOKEN")
-        if not vercel_blob_token:
-            print("Warning: BLOB_READ_WRITE_TOKEN environment variable not set. Audio upload will be skipped.")
-
-        # 4 & 5. Validate, rewrite (if needed), link keywords, and generate/upload audio for each paragraph
-        for i, para in enumerate(paragraphs):
-            print(f"--- PROCESSING PARAGRAPH {i+1} ---")
-            tries = 0
-            max_tries = 7
-
-            while tries < max_tries:
-                validated_para = validate_and_rewrite_paragraph(para, required_words)
-                if not validated_para:
-                    print(f"Skipping paragraph {i+1} due to validation/rewrite failure.")
-
-                # Find which required words are actually in the *final* paragraph text
-                words_in_para = [word for word in required_words if word.lower().strip() in validated_para.lower()]
-                print(f"Words found in paragraph {i+1}: {words_in_para}")
-
-                # Link keywords in the validated paragraph
-                linked_para = replace_keywords_with_links(validated_para, words_in_para)
-                print(f"Linked paragraph {i+1}: {linked_para}")
-
-                if len(words_in_para) == len(required_words):
-                    break
-
-            # Create Question objects for words in this paragraph
-            para_questions = []
-            for word in words_in_para:
-                if word not in all_questions_map:
-                    # Create a new 'select' type question for this word
-                    try:
-                        # Generate incorrect answers for the select question
-                        incorrect_answers = gen_incorrect_answers(word, num_incorrect=3)
-                        all_answers = [word] + incorrect_answers
-                        random.shuffle(all_answers)  # Randomize answer order
-                        
-                        # Create the question object
-                        question_obj = Question(
-                            type='select',
-                            question=f"What word best fits in this story?",
-                            key=f"vocab_{vocab_id}_{word}",  # Unique key based on vocab and word
-                            correct=word,
-                            answers=','.join(all_answers),  # Store as comma-separated string
-                            classroom=f"vocab_{vocab_id}"  # Use vocab_id as classroom identifier
-                        )
-                        
-                        # Add to session to persist to database
-                        session.add(question_obj)
-                        session.flush()  # Get the ID without committing
-                        
-                        # Add the created question to the map for later use in linking
-                        all_questions_map[word] = question_obj
-                        print(f"Created new select question for '{word}': ID={question_obj.id}, Key='{question_obj.key}'")
-                        
-                    except Exception as e:
-                        print(f"Error creating question for word '{word}': {e}")
-                        continue # Skip if we can't create the question
-
-                # Add the Question object (if found/created) to this paragraph's list
-                if word in all_questions_map:
-                    para_questions.append(all_questions_map[word])
-
-            audio_url = None # Initialize audio URL for this paragraph
-
-            if validated_para and vercel_blob_token: # Only proceed if paragraph is valid and token exists
-                try:
-                    # 1. Generate TTS locally
-                    filename_base = f"story_{storyline_id}_para_{i+1}"
-                    output_filename = f"{filename_base}.mp3"
-                    local_audio_dir = "./media/tts_temp" # Temporary local storage
-                    os.makedirs(local_audio_dir, exist_ok=True) # Ensure dir exists
-                    local_audio_path = os.path.join(local_audio_dir, output_filename)
-
-                    print(f"Generating TTS for paragraph {i+1}...")
-                    # Use validated_para for TTS input
-                    generate_tts(validated_para, output_filename, output_dir=local_audio_dir)
-
-                    # Check if file exists after generation
-                    if not os.path.exists(local_audio_path):
-                         raise FileNotFoundError(f"TTS file not found at {local_audio_path} after generation attempt.")
-
-                    # 2. Upload to Vercel Blob
-                    # Add random suffix for uniqueness
-                    blob_pathname = f"audio/{filename_base}_{random.randint(1000, 9999)}.mp3"
-                    upload_url = f"https://blob.vercel-storage.com/{blob_pathname}"
-                    headers = {
-                        "Authorization": f"Bearer {vercel_blob_token}",
-                        "Content-Type": "audio/mpeg",
-                        "x-vercel-blob-client": "python-requests-manual-0.1" # Identify client
-                    }
-
-                    print(f"Uploading {local_audio_path} to Vercel Blob at {blob_pathname}...")
-                    with open(local_audio_path, "rb") as audio_file:
-                        audio_data = audio_file.read()
-
-                    response = requests.put(upload_url, headers=headers, data=audio_data)
-                    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-                    # 3. Get the public URL from response
-                    blob_result = response.json()
-                    audio_url = blob_result.get("url")
-                    if not audio_url:
-                        print(f"Warning: Vercel Blob upload successful but no URL found in response for {blob_pathname}.")
-                    else:
-                        print(f"Vercel Blob upload successful. URL: {audio_url}")
-
-                    # 4. Cleanup local file (optional)
-                    try:
-                        os.remove(local_audio_path)
-                        print(f"Removed temporary local file: {local_audio_path}")
-                    except OSError as e:
-                        print(f"Warning: Could not remove temporary file {local_audio_path}: {e}")
-
-                except FileNotFoundError as e:
-                     print(f"Error during TTS file handling for paragraph {i+1}: {e}")
-                except requests.exceptions.RequestException as e:
-                    print(f"Error uploading audio to Vercel Blob for paragraph {i+1}: {e}")
-                    if hasattr(e, 'response') and e.response is not None:
-                         print(f"Vercel Response Status: {e.response.status_code}")
-                         print(f"Vercel Response Body: {e.response.text}")
-                except Exception as e:
-                    print(f"An unexpected error occurred during audio processing for paragraph {i+1}: {e}")
-
-            elif not vercel_blob_token:
-                 print(f"Skipping audio generation/upload for paragraph {i+1} due to missing BLOB_READ_WRITE_TOKEN.")
-            else: # validated_para was None
-                 print(f"Skipping audio generation/upload for paragraph {i+1} because paragraph validation failed.")
-
-            # Append processed data including the audio_url (which might be None)
-            processed_paragraphs.append({
-                "content": linked_para,
-                "raw_content": validated_para, # Keep raw content
-                "questions": para_questions,
-                "audio_url": audio_url # Add the URL here
-            })
-            print("--------------------------")
-
-        # --- Save Storyline, Steps, Stories, and Questions to DB ---
-        # This section is correctly indented within the `with db_session` block
-        if not processed_paragraphs:
-            print("Error: No paragraphs were successfully processed after validation/rewriting.")
-            # Storyline object exists, but we won't add steps.
-            return storyline # Return existing storyline, indicating no steps added
-
-        # Clear existing steps if needed (optional)
-        # storyline.steps.clear()
-
-        # session object is already available from the 'with' statement above
-
-        step_number_counter = 1
-        for para_data in processed_paragraphs:
-            # Create Story object, now including the audio URL
-            story_obj = Story(
-                content=para_data["content"],
-                audio=para_data["audio_url"] # Get URL from processed data
-            )
-            step = StorylineStep(
-                storyline=storyline,
-                step=step_number_counter, # Correct keyword argument based on orm.py
-                story=story_obj
-            )
-            session.add(step) # Explicitly add the new step to the session
-
-            for question_obj in para_data["questions"]:
-                # Link Questions to Story using SQLAlchemy's relationship management
-                # Cascades should handle adding StoryQuestion, but ensure question_obj is handled.
-                # If Question objects are created outside the session, they might need adding too.
-                # Let's assume Question objects from all_questions_map are transient and need adding
-                # when first used in a relationship within the session.
-                if question_obj not in session:
-                     # Check if it's already pending or persistent to avoid duplicates
-                     # A simple check might be session.is_modified(question_obj) or checking its state,
-                     # but adding it if not present is often safe if the object has its PK already.
-                     # For simplicity, let's rely on SQLAlchemy to manage duplicates if added again.
-                     # However, the most robust way is to ensure Questions are fetched/created within the session.
-                     # Let's add the StoryQuestion link directly, relying on cascades.
-                     pass # Relying on cascade for StoryQuestion for now.
-
-                story_question_link = StoryQuestion(
-                    story=story_obj,
-                    question=question_obj
-                )
-                session.add(story_question_link) # Explicitly add the link object
-                # session.add(story_question_link) # Cascade should handle this
-            step_number_counter += 1
-
-        print(f"Successfully added {step_number_counter - 1} steps to Storyline {storyline.storyline_id}") # Use correct PK attribute name
-        storyline.status = 'completed'
-        session.add(storyline)
-        return storyline # Return the updated storyline object
+        with span("save_story"):
+            return save_story_response(session, story_request, response, distractor_cache,
+                                       eager_steps=EAGER_STEPS if lazy else None)
     # End of `with db_session` context
 
+def generate_classroom_stories(storyline_ids: List[int], max_workers: int = 8, lazy: bool = False) -> Dict[int, bool]:
+    """
+    Generate many pending storylines at once, e.g. one per student in a class.
+
+    Words the vocabulary bank does not know yet get their distractors and
+    question once, up front, and every story links to the banked question.
+    Storylines over the same word list are sent together so their common
+    prompt prefix stays warm in the provider's prompt cache. Stories are then
+    generated concurrently.
+
+    Returns:
+        A mapping of storyline ID to whether generation succeeded
+    """
+    with db_session() as session:
+        rows = (
+            session.query(Storyline.storyline_id, Storyline.original_request)
+            .filter(Storyline.storyline_id.in_(storyline_ids))
+            .filter(Storyline.status.in_(GENERATABLE_STATUSES))
+            .all()
+        )
+
+    words_by_storyline = {}
+    needed = set() # (word, classroom) pairs the stories will ask the vocabulary bank for
+    for storyline_id, original_request in rows:
+        try:
+            request_data = json.loads(original_request or '{}')
+        except json.JSONDecodeError as e:
+            print(f"Error parsing original_request JSON for storyline {storyline_id}: {e}")
+            continue
+        words_by_storyline[storyline_id] = tuple(sorted(request_data.get('words') or []))
+        needed |= {(word, question_classroom(request_data)) for word in words_by_storyline[storyline_id]}
+
+    skipped = set(storyline_ids) - set(words_by_storyline)
+    if skipped:
+        print(f"Skipping storylines that are missing or not pending: {sorted(skipped)}")
+
+    unique_words = sorted({word for words in words_by_storyline.values() for word in words})
+    print(f"Generating {len(words_by_storyline)} storylines over {len(unique_words)} unique words with {max_workers} workers")
+
+    # Words the vocabulary bank already has a question for need no distractors
+    with db_session() as session:
+        banked = {
+            (correct, classroom) for correct, classroom in
+            session.query(Question.correct, Question.classroom)
+            .filter(Question.type == 'select')
+            .filter(Question.correct.in_(unique_words))
+            .filter(Question.classroom.in_({classroom for _, classroom in needed}))
+            .all()
+        } if needed else set()
+    new_words = sorted({word for word, classroom in needed - banked})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # 1. Distractors once per new word, shared by every story
+        distractor_cache = dict(zip(new_words, pool.map(generate_distractors, new_words)))
+
+        # Bank the new questions before fanning out, so concurrent stories all
+        # link to the same committed row
+        with db_session() as session:
+            for word, classroom in sorted(needed - banked):
+                vocabulary_bank.get_or_create_question(
+                    session, word, classroom,
+                    key=f"{classroom}_{word}",
+                    generate_answers=lambda: get_select_answers(word, distractor_cache),
+                )
+
+        # 2. Fan out, keeping storylines with the same word list (same prompt prefix) adjacent
+        ordered_ids = sorted(words_by_storyline, key=lambda sid: (words_by_storyline[sid], sid))
+        results = list(pool.map(lambda sid: generate_story(sid, distractor_cache=distractor_cache, lazy=lazy), ordered_ids))
+
+    outcome = {sid: result is not None for sid, result in zip(ordered_ids, results)}
+    outcome.update({sid: False for sid in skipped})
+    print(f"Generated {sum(outcome.values())} of {len(outcome)} storylines")
+    return outcome
+
+
 # --- Command Line Execution ---
 # This block is now at the top level (correct indentation)
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a story for a given Storyline ID.")
-    parser.add_argument("storyline_id", type=int, help="The ID of the Storyline to generate the story for.")
+    parser.add_argument("storyline_ids", type=int, nargs='*', help="The ID(s) of the Storyline(s) to generate the story for.")
+    parser.add_argument("--batch-id", help="Generate every pending storyline of a bulk-created batch.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent generations when generating several storylines.")
+    parser.add_argument("--lazy", action="store_true", help="Only generate the first step now, later steps are generated as the student reads.")
+    parser.add_argument("--pending-steps", action="store_true", help="Generate the queued steps of lazily generated storylines (all of them without IDs).")
+    parser.add_argument("--trace", default=os.getenv("SNOWDAY_TRACE"), help="Export per-stage timing spans: console, json[:path] or otel.")
+    parser.add_argument("--profile", action="store_true", help="Profile this run with cProfile and save the result under profiles/.")
     args = parser.parse_args()
 
+    configure_tracing(args.trace)
+    if args.profile:
+        enable_cli_profiling(f"generators.stories {' '.join(map(str, args.storyline_ids))}".strip())
+        # cProfile only sees the main thread, so generate one storyline at a time
+        args.workers = 1
+
+    if args.pending_steps:
+        generate_pending_steps(args.storyline_ids or None)
+        raise SystemExit(0)
+
+    if args.batch_id or len(args.storyline_ids) > 1:
+        storyline_ids = list(args.storyline_ids)
+        if args.batch_id:
+            with db_session() as session:
+                storyline_ids += [
+                    row[0] for row in
+                    session.query(Storyline.storyline_id).filter(Storyline.batch_id == args.batch_id).all()
+                ]
+        generate_classroom_stories(storyline_ids, max_workers=args.workers, lazy=args.lazy)
+        raise SystemExit(0)
+
+    if not args.storyline_ids:
+        parser.error("Provide a storyline ID or --batch-id.")
+    args.storyline_id = args.storyline_ids[0]
+
     print(f"Received request to generate story for Storyline ID: {args.storyline_id}")
     # generate_story handles its own db_session
-    generated_storyline = generate_story(args.storyline_id)
+    generated_storyline = generate_story(args.storyline_id, lazy=args.lazy)
 
     if generated_storyline:
         # Re-enter db_session to safely access potentially lazy-loaded attributes for printing
@@ -5,11 +5,16 @@ from io import BytesIO
 import os
 from dotenv import load_dotenv
 
+from src.fakes import fake_backend_enabled, fake_image
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Function to generate an image using OpenAI's DALL-E API
 def generate_image_with_dalle(prompt, api_key):
+    if fake_backend_enabled("image"):
+        return fake_image(prompt)
+
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
@@ -50,7 +55,7 @@ if __name__ == "__main__":
     # Get API key from environment variable
     api_key = os.getenv("OPENAI_API_KEY")
     
-    if not api_key:
+    if not api_key and not fake_backend_enabled("image"):
         print("Error: OPENAI_API_KEY environment variable not set.")
         print("Please set your OpenAI API key as an environment variable.")
         print("Example: export OPENAI_API_KEY='your-api-key-here'")
@@ -0,0 +1,129 @@
+"""
+Gunicorn settings for serving src.main:app with uvicorn workers.
+
+    gunicorn src.main:app -c gunicorn.conf.py
+
+Every setting can be overridden through the environment:
+
+    PORT                       Port to bind (default 8000)
+    WEB_CONCURRENCY            Worker count, otherwise sized from CPU and memory
+    WEB_MEMORY_PER_WORKER_MB   Memory budgeted per worker when sizing (default 256)
+    MAX_REQUESTS               Recycle a worker after this many requests, 0 disables (default 1000)
+    MAX_REQUESTS_JITTER        Random extra requests so workers don't recycle together (default 100)
+    GRACEFUL_TIMEOUT           Seconds in-flight requests get to finish on shutdown (default 25)
+    WORKER_TIMEOUT             Seconds before a silent worker is killed (default 120)
+    PROMETHEUS_MULTIPROC_DIR   Where workers write their metrics, emptied on start
+                               (default $TMPDIR/snowday-prometheus)
+    FRAGMENT_CACHE_VERSION_TTL Seconds a fragment cache hit skips the version check (default 2)
+
+Workers are separate processes, so in-process state is per worker:
+
+    - The fragment cache and the review queues are checked against versions
+      in the cache_version table, so a write in one worker invalidates the
+      others. A fragment another worker invalidated can still be served for
+      up to FRAGMENT_CACHE_VERSION_TTL seconds.
+    - Metrics use prometheus_client's multiprocess mode: each worker writes
+      to PROMETHEUS_MULTIPROC_DIR and /metrics, whichever worker answers it,
+      reports the sum over all of them. Counters and histograms keep the
+      samples of recycled workers (MAX_REQUESTS); gauges count live workers
+      only. Cache hits and pool gauges are refreshed after each request, so
+      an idle worker reports its numbers as of its last request.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+
+logger = logging.getLogger("gunicorn.error")
+
+# Memory budget of the container, cgroup v2 then v1
+CGROUP_MEMORY_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+def memory_limit_mb():
+    """
+    Memory available to this container in MB, None when it isn't limited.
+    """
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_workers():
+    """
+    2 * CPUs + 1, capped by how many workers fit in memory.
+    """
+    workers = multiprocessing.cpu_count() * 2 + 1
+    memory = memory_limit_mb()
+    if memory:
+        per_worker = int(os.getenv("WEB_MEMORY_PER_WORKER_MB", "256"))
+        workers = min(workers, memory // per_worker)
+    return max(workers, 1)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY") or default_workers())
+
+# Import the app once in the master so workers fork with it loaded
+preload_app = True
+
+# Recycle workers to bound slow memory growth
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+
+# On SIGTERM, stop accepting and let in-flight requests finish. Kept below the
+# 30 seconds most platforms wait before sending SIGKILL.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "25"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+
+# Must exist before the preloaded app imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "snowday-prometheus"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+accesslog = "-"
+errorlog = "-"
+forwarded_allow_ips = "*"
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's. The
+    # preloaded app has already opened the master's own files, keep those.
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    own = f"_{os.getpid()}.db"
+    for name in os.listdir(metrics_dir):
+        if not name.endswith(own):
+            os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server):
+    logger.info(f"Serving with {workers} workers (max_requests={max_requests}, graceful_timeout={graceful_timeout}s)")
+
+
+def post_fork(server, worker):
+    # The preloaded app created the engine in the master; pooled connections
+    # must not be shared across processes.
+    from src.orm import dispose_engine_after_fork
+
+    dispose_engine_after_fork()
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges; its counters stay in the totals
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -3,8 +3,10 @@ from fastapi.responses import RedirectResponse, HTMLResponse # Keep RedirectResp
 from fastapi.templating import Jinja2Templates
 import logging
 import json # Keep json for /assignments POST
+import re
 from typing import List, Dict, Tuple
-from .orm import db_session # Removed unused ORM models
+from .orm import db_session, Question, Story, StoryQuestion, StorylineStep
+from .storyline.progress import GradeAndSaveProgress
 # Removed unused imports: random, re, markdown, SessionLocal, Storyline, StorylineStep, Story, Question, func, joinedload, StorylineProgress
 from .utils import (
     get_validated_response, # Assuming this might be used by create_assignment or submit_form indirectly
@@ -88,27 +90,20 @@ def save_assignment(story: str, questions: List[QuestionViewModel]):
     :param questions: A list of QuestionViewModel objects.
     """
     with db_session() as session:
-
-        # Insert the story
-        session.execute('INSERT INTO story (content) VALUES (%s) RETURNING id', (story,))
-        story_id = session.fetchone()[0]
-
-        # Insert questions into the questions table (without story_id)
+        new_story = Story(content=story)
         for question in questions:
-            # Insert the question
-            session.execute('''
-                INSERT INTO questions (type, question, key, correct, answers)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-            ''', (question.type, question.question, question.key, question.correct, ','.join(question.answers or [])))
-            
-            question_id = session.fetchone()[0]
-            
-            # Create the association in the story_question table
-            session.execute('''
-                INSERT INTO story_question (story_id, question_id)
-                VALUES (%s, %s)
-            ''', (story_id, question_id))
+            new_question = Question(
+                type=question.type,
+                question=question.question,
+                key=question.key,
+                correct=question.correct,
+                answer_list=question.answers or [],
+                classroom=""
+            )
+            new_story.story_questions.append(StoryQuestion(question=new_question))
+        session.add(new_story)
+        session.flush()
+        story_id = new_story.id
 
     return {
         "story_id": story_id,
@@ -117,29 +112,18 @@ def save_assignment(story: str, questions: List[QuestionViewModel]):
 
 def get_assignment(story_id: int) -> Tuple[str, List[QuestionViewModel]]:
     with db_session() as session:
+        story = session.get(Story, story_id)
 
-        # Fetch the story content
-        session.execute("SELECT content FROM story WHERE id = %s", (story_id,))
-        story_content = session.fetchone()
-        
-        if story_content is None:
+        if story is None:
             raise ValueError(f"No story found for ID: {story_id}")
-        
-        story_content = story_content[0]
-        
-        # Fetch all questions associated with the story through the association table
-        session.execute("""
-            SELECT q.type, q.question, q.key, q.correct, q.answers
-            FROM questions q
-            JOIN story_question sq ON q.id = sq.question_id
-            WHERE sq.story_id = %s
-        """, (story_id,))
-        questions = session.fetchall()
-
-        # Convert each fetched question into a Question object
-        question_list = [QuestionViewModel(type=q[0], question=q[1], key=q[2], correct=q[3], answers=(q[4] or '').split(',')) for q in questions]
-        
-    return story_content, question_list
+
+        # Answer options come back from the database as a list, ready for the view model
+        question_list = [
+            QuestionViewModel(type=q.type, question=q.question, key=q.key, correct=q.correct, answers=q.answer_list)
+            for q in story.questions
+        ]
+
+        return story.content, question_list
 # Removed get_storyline_step_details function (moved to storyline.py)
 
 
@@ -150,61 +134,34 @@ def setup_routes(app: FastAPI):
         form_data = await request.form()
 
         form_dict = {key: value for key, value in form_data.items()}
-
-        # Create a set to collect unique question numbers dynamically
-        question_numbers = set()
-        last_answer = 0
-
-        # Use a regular expression to find all question numbers from keys
-        for key in form_dict.keys():
-            match = re.match(r'question(.+)_answer', key)
-            if match:
-                question_numbers.add(int(match.group(1)))
-
-        # Sort the question numbers to maintain order
-        question_numbers = sorted(question_numbers)
-
-        # Create the questions array
-        questions = []
-
+        page_load_time = int(form_dict.get('pageLoadTime', 0) or 0)
+
+        answers = {}
+        durations = {}
+        # Answers come in as question<ID>_answer, with a question<ID>_lastEdit timestamp in ms
+        for key, value in form_dict.items():
+            match = re.match(r'question(\d+)_answer$', key)
+            if not match:
+                continue
+            question_id = int(match.group(1))
+            answers[question_id] = value
+            last_edit = form_dict.get(f'question{question_id}_lastEdit')
+            if last_edit and page_load_time:
+                durations[question_id] = max(0, (int(last_edit) - page_load_time) // 1000)
 
         with db_session() as session:
+            storyline_step_id = (
+                session.query(StorylineStep.storyline_step_id)
+                .filter(StorylineStep.story_id == story_id)
+                .order_by(StorylineStep.storyline_step_id)
+                .limit(1)
+                .scalar()
+            )
+        if storyline_step_id is None:
+            raise HTTPException(status_code=404, detail=f"No storyline step found for story {story_id}.")
 
-            # Collect the answer and lastEdit pairs for each question
-            for num in question_numbers:
-                answer_key = f'question{num}_answer'
-                last_edit_key = f'question{num}_lastEdit'
-                last_edit_time = int(form_dict[last_edit_key])
-                if last_edit_time > last_answer:
-                    last_answer = last_edit_time
-
-                if answer_key in form_dict and last_edit_key in form_dict:
-
-                    session.execute(
-                        """
-                        INSERT INTO question_results (correct, answer, last_edit, score)
-                        VALUES (%s, %s, %s, %s)
-                        """,
-                        (f"{story_id}", form_dict[answer_key], form_dict[last_edit_key], int(form_dict[last_edit_key]) - int(form_dict['paLoadTime']))
-                    )
-                    questions.append({
-                        'answer': form_dict[answer_key],
-                        'lastEdit': form_dict[last_edit_key]
-                    })
-
-            # # Insert cumulative score into the database
-            try:
-                story_id, story_content, questions = get_storyline_step_details(storyline_step_id) # Unpack story_id
-                session.execute(
-                    """
-                    INSERT INTO results (score, story_id)
-                    VALUES (%s, %s)
-                    """,
-                    (last_answer - int(form_dict['pageLoadTime']),story_id)
-                )
-                session.commit()
-            except Exception as e:
-                logger.error(e)
+        result = GradeAndSaveProgress(storyline_step_id, answers, durations=durations)
+        logger.info(f"Graded story {story_id}: {result['score']}")
 
         return RedirectResponse(url='/assignments/', status_code=303)
 
@@ -297,7 +254,7 @@ def setup_routes(app: FastAPI):
                     "question": q.question,
                     "key": q.key,
                     "correct": q.correct,
-                    "answers": q.answers.split(',') if q.answers else None
+                    "answers": q.answer_list or None
                 })
         
         # Create JSON data package
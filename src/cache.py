@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.orm import bump_cache_version, db_session, get_cache_version
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+
+class FragmentCache:
+    """
+    In-process cache for rendered HTML fragments.
+
+    Entries live under a namespace (e.g. "storylines" or "classroom_questions")
+    and a key inside it. Writers call `invalidate` for the namespace they touch,
+    which also bumps its shared version in the `cache_version` table; every
+    worker, and every process such as the generators, compares that version
+    before serving an entry. The TTL is a backstop for writers that don't
+    invalidate.
+
+    So that a hit doesn't cost a database round trip, an entry's version is
+    only re-read once it was last confirmed more than `version_ttl` seconds
+    ago. A write made in another process can therefore be served stale for
+    up to `version_ttl` seconds; writes in this process drop the entry at once.
+    """
+
+    def __init__(self, ttl: float = 60, shared: bool = True, version_ttl: float = 2):
+        self.ttl = ttl
+        self.shared = shared
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        # (namespace, key) -> [expires, version, fragment, version confirmed at]
+        self._entries: Dict[Tuple[str, str], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str, version: Any = None) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def set(self, namespace: str, key: str, fragment: str, version: Any = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[(namespace, key)] = [now + self.ttl, version, fragment, now]
+
+    def _recently_confirmed(self, namespace: str, key: str) -> Optional[str]:
+        """
+        The fragment if its version was confirmed within `version_ttl`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None or entry[0] < now or now - entry[3] > self.version_ttl:
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def shared_version(self, namespace: str, key: str) -> Any:
+        """
+        The shared version of an entry, None when sharing is off or the
+        version can't be read (entries then only expire by TTL).
+        """
+        if not self.shared:
+            return None
+        try:
+            with db_session() as session:
+                return get_cache_version(session, namespace, key)
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not read cache version of {namespace}/{key}: {e}")
+            return None
+
+    def get_or_render(self, namespace: str, key: str, render: Callable[[], str]) -> str:
+        """
+        Return the cached fragment, rendering and storing it on a miss.
+        """
+        if self.shared:
+            fragment = self._recently_confirmed(namespace, key)
+            if fragment is not None:
+                return fragment
+
+        version = self.shared_version(namespace, key)
+        fragment = self.get(namespace, key, version)
+        if fragment is None:
+            fragment = render()
+            self.set(namespace, key, fragment, version)
+        else:
+            with self._lock:
+                entry = self._entries.get((namespace, key))
+                if entry is not None:
+                    entry[3] = time.monotonic()
+        return fragment
+
+    def invalidate(self, namespace: str, key: Optional[str] = None, session=None) -> None:
+        """
+        Drop one fragment, or every fragment in the namespace when no key is given,
+        here and in every other process.
+
+        Args:
+            namespace: The namespace written to
+            key: The key written to, None for the whole namespace
+            session: Bump the shared version in this session's transaction
+                instead of a separate one
+        """
+        with self._lock:
+            if key is not None:
+                self._entries.pop((namespace, key), None)
+            else:
+                for cached_key in [k for k in self._entries if k[0] == namespace]:
+                    del self._entries[cached_key]
+
+        if not self.shared:
+            return
+        if session is not None:
+            bump_cache_version(session, namespace, key)
+            return
+        try:
+            with db_session() as own_session:
+                bump_cache_version(own_session, namespace, key)
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not bump cache version of {namespace}/{key}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache(
+    ttl=float(os.getenv("FRAGMENT_CACHE_TTL", "60")),
+    shared=os.getenv("FRAGMENT_CACHE_SHARED", "1") != "0",
+    version_ttl=float(os.getenv("FRAGMENT_CACHE_VERSION_TTL", "2")),
+)
@@ -0,0 +1,221 @@
+import csv
+import datetime
+import io
+import logging
+from typing import Any, Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from src.orm import Question, Story, StoryQuestion, StorylineProgress, StorylineStep, db_session
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# pyarrow is optional, without it only CSV can be exported
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+    parquet = None
+
+# Rows fetched per round trip and written per CSV chunk / Parquet row group
+DEFAULT_CHUNK_SIZE = 5000
+
+EXPORT_COLUMNS = [
+    ("storyline_progress_id", StorylineProgress.storyline_progress_id),
+    ("created_at", StorylineProgress.created_at),
+    ("student_id", StorylineProgress.student_id),
+    ("storyline_id", StorylineProgress.storyline_id),
+    ("storyline_step_id", StorylineProgress.storyline_step_id),
+    ("step", StorylineStep.step),
+    ("story_id", StoryQuestion.story_id),
+    ("question_id", StoryQuestion.question_id),
+    ("question_type", Question.type),
+    ("question_key", Question.key),
+    ("classroom", Question.classroom),
+    ("correct", Question.correct),
+    ("answer", StorylineProgress.answer),
+    ("score", StorylineProgress.score),
+    ("duration", StorylineProgress.duration),
+    ("attempts", StorylineProgress.attempts),
+]
+# Story text is large, so it is only included on request
+STORY_CONTENT_COLUMN = ("story_content", Story.content)
+
+
+def export_columns(include_story_content: bool = False) -> List[str]:
+    columns = [name for name, _ in EXPORT_COLUMNS]
+    return columns + [STORY_CONTENT_COLUMN[0]] if include_story_content else columns
+
+
+def progress_export_query(classroom: Optional[str] = None,
+                          since: Optional[datetime.date] = None,
+                          until: Optional[datetime.date] = None,
+                          storyline_ids: Optional[Sequence[int]] = None,
+                          include_story_content: bool = False):
+    """
+    SELECT of storyline_progress joined with its step, question and story.
+
+    Args:
+        classroom: Only questions of this classroom
+        since: Only progress created on or after this day
+        until: Only progress created on or before this day
+        storyline_ids: Only these storylines
+        include_story_content: Add the story text as the last column
+    """
+    columns = [column for _, column in EXPORT_COLUMNS]
+    if include_story_content:
+        columns.append(STORY_CONTENT_COLUMN[1])
+
+    query = (
+        select(*columns)
+        .select_from(StorylineProgress)
+        .join(StoryQuestion, StoryQuestion.id == StorylineProgress.story_question_id)
+        .join(Question, Question.id == StoryQuestion.question_id)
+        .outerjoin(StorylineStep, StorylineStep.storyline_step_id == StorylineProgress.storyline_step_id)
+    )
+    if include_story_content:
+        query = query.join(Story, Story.id == StoryQuestion.story_id)
+    if classroom is not None:
+        query = query.where(Question.classroom == classroom)
+    if since is not None:
+        query = query.where(StorylineProgress.created_at >= datetime.datetime.combine(since, datetime.time.min))
+    if until is not None:
+        next_day = datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min)
+        query = query.where(StorylineProgress.created_at < next_day)
+    if storyline_ids:
+        query = query.where(StorylineProgress.storyline_id.in_(storyline_ids))
+    return query.order_by(StorylineProgress.storyline_progress_id)
+
+
+def iter_progress_chunks(chunk_size: int = DEFAULT_CHUNK_SIZE, **filters) -> Iterator[List[Sequence[Any]]]:
+    """
+    Stream the export rows in lists of `chunk_size`.
+
+    Uses a server-side cursor (`stream_results`) where the driver supports
+    one, so memory stays flat however many rows match.
+    """
+    query = progress_export_query(**filters)
+    with db_session() as session:
+        result = session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+
+def iter_csv(chunk_size: int = DEFAULT_CHUNK_SIZE, **filters) -> Iterator[str]:
+    """
+    The export as CSV text, one piece per chunk of rows, header first.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(filters.get("include_story_content", False)))
+
+    for rows in iter_progress_chunks(chunk_size, **filters):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def parquet_schema(include_story_content: bool = False):
+    fields = [
+        ("storyline_progress_id", pyarrow.int64()),
+        ("created_at", pyarrow.timestamp("us")),
+        ("student_id", pyarrow.int64()),
+        ("storyline_id", pyarrow.int64()),
+        ("storyline_step_id", pyarrow.int64()),
+        ("step", pyarrow.int64()),
+        ("story_id", pyarrow.int64()),
+        ("question_id", pyarrow.int64()),
+        ("question_type", pyarrow.string()),
+        ("question_key", pyarrow.string()),
+        ("classroom", pyarrow.string()),
+        ("correct", pyarrow.string()),
+        ("answer", pyarrow.string()),
+        ("score", pyarrow.int64()),
+        ("duration", pyarrow.int64()),
+        ("attempts", pyarrow.int64()),
+    ]
+    if include_story_content:
+        fields.append(("story_content", pyarrow.string()))
+    return pyarrow.schema(fields)
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands out what was written since the last
+    `drain()`, so a Parquet file can be streamed while it is being built.
+    """
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._buffer.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def iter_parquet(chunk_size: int = DEFAULT_CHUNK_SIZE, **filters) -> Iterator[bytes]:
+    """
+    The export as a Parquet file, one row group per chunk of rows.
+
+    Raises:
+        RuntimeError: When pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is not installed, install it to export Parquet")
+
+    schema = parquet_schema(filters.get("include_story_content", False))
+    sink = _ChunkSink()
+    writer = parquet.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in iter_progress_chunks(chunk_size, **filters):
+            columns = list(zip(*rows))
+            writer.write_batch(pyarrow.record_batch(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def write_export(path: str, file_format: str = "csv", chunk_size: int = DEFAULT_CHUNK_SIZE, **filters) -> int:
+    """
+    Write the export to `path` in `csv` or `parquet` format.
+
+    Returns:
+        The number of bytes written
+    """
+    chunks = iter_parquet(chunk_size, **filters) if file_format == "parquet" else iter_csv(chunk_size, **filters)
+    written = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            f.write(data)
+            written += len(data)
+    return written
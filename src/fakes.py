@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from typing import List, Optional
+
+from langchain.schema import AIMessage
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# Comma separated list of backends to fake: llm, tts, image, blob (or "all")
+FAKE_BACKENDS = os.getenv("SNOWDAY_FAKE_BACKENDS", "")
+# Simulated latency per call, "250" or a "100-400" range in milliseconds
+FAKE_LATENCY_MS = os.getenv("SNOWDAY_FAKE_LATENCY_MS", "0")
+# Share of calls that raise FakeBackendError
+FAKE_ERROR_RATE = float(os.getenv("SNOWDAY_FAKE_ERROR_RATE", "0"))
+# Share of story paragraphs that leave out a word, to exercise the rewrite path
+FAKE_MISS_RATE = float(os.getenv("SNOWDAY_FAKE_MISS_RATE", "0"))
+FAKE_SEED = os.getenv("SNOWDAY_FAKE_SEED", "snowday")
+
+FAKE_BLOB_DIR = os.path.join("media", "fake_blob")
+
+# A silent MPEG-1 Layer III frame (128kbps, 44.1kHz), about 26ms of audio
+_SILENT_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+_FILLER = [
+    "Everyone laughed so hard that the clouds wobbled.",
+    "Nobody expected the pancakes to start singing.",
+    "It was, without a doubt, the silliest afternoon in history.",
+    "A goose in a top hat nodded wisely.",
+    "Then the whole street started dancing backwards.",
+]
+
+_error_rng = random.Random(FAKE_SEED)
+_error_lock = threading.Lock()
+
+
+class FakeBackendError(Exception):
+    """
+    Raised by a fake backend to simulate a provider failure.
+    """
+
+
+def fake_backend_enabled(name: str) -> bool:
+    enabled = {backend.strip() for backend in FAKE_BACKENDS.split(",") if backend.strip()}
+    return "all" in enabled or name in enabled
+
+
+def _rng_for(*parts: str) -> random.Random:
+    """
+    A random generator seeded by the request, so the same input always
+    produces the same output.
+    """
+    digest = hashlib.sha256("\x00".join((FAKE_SEED,) + parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def simulate_call(backend: str) -> None:
+    """
+    Sleep for the configured latency and fail at the configured rate.
+    """
+    low, _, high = FAKE_LATENCY_MS.partition("-")
+    latency_ms = random.uniform(float(low), float(high)) if high else float(low)
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+
+    with _error_lock:
+        failed = _error_rng.random() < FAKE_ERROR_RATE
+    if failed:
+        raise FakeBackendError(f"Injected {backend} failure")
+
+
+def _words_after(label: str, text: str) -> List[str]:
+    match = re.search(re.escape(label) + r"\s*([^\n]+)", text)
+    if not match:
+        return []
+    return [word.strip().rstrip(".") for word in match.group(1).split(",") if word.strip()]
+
+
+def misspell(word: str, rng: random.Random) -> str:
+    if len(word) < 3:
+        return word + word[-1]
+    i = rng.randrange(1, len(word) - 1)
+    edits = [
+        word[:i] + word[i + 1:],                      # drop a letter
+        word[:i] + word[i] + word[i:],                # double a letter
+        word[:i - 1] + word[i] + word[i - 1] + word[i + 1:],  # swap two letters
+    ]
+    candidates = [edit for edit in edits if edit != word]
+    return rng.choice(candidates) if candidates else word + "e"
+
+
+class FakeChatModel:
+    """
+    Offline stand-in for ChatOpenAI that answers the prompts this project
+    sends: stories that use the required vocabulary, paragraph rewrites and
+    misspelled distractors.
+    """
+
+    def __call__(self, messages) -> AIMessage:
+        prompt = "\n".join(message.content for message in messages)
+        simulate_call("llm")
+        rng = _rng_for("llm", prompt)
+
+        if "Here is the word:" in prompt:
+            content = self._distractors(prompt, rng)
+        elif prompt.lstrip().startswith("Rewrite the following paragraph"):
+            content = self._rewrite(prompt, rng)
+        else:
+            content = self._story(prompt, rng)
+
+        input_tokens = len(prompt.split())
+        output_tokens = len(content.split())
+        return AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens},
+        )
+
+    def invoke(self, messages) -> AIMessage:
+        return self(messages)
+
+    def _distractors(self, prompt: str, rng: random.Random) -> str:
+        word = _words_after("Here is the word:", prompt)[0]
+        # Two close misspellings and one that is completely wrong
+        close = [misspell(word, rng) for _ in range(6)] + [word + "e", word + "z"]
+        close = [c for c in dict.fromkeys(close) if c != word][:2]
+        wrong = "".join(rng.sample(word, len(word)))
+        if wrong == word or wrong in close:
+            wrong = word[::-1] + "x"
+        return ", ".join(close + [wrong])
+
+    def _rewrite(self, prompt: str, rng: random.Random) -> str:
+        missing = _words_after("to include the words:", prompt)
+        match = re.search(r'Original paragraph:\s*"(.*)"', prompt, re.DOTALL)
+        original = match.group(1).strip() if match else ""
+        return f"{original} Suddenly a {', a '.join(missing)} appeared. {rng.choice(_FILLER)}".strip()
+
+    def _story(self, prompt: str, rng: random.Random) -> str:
+        words = _words_after("Use each of these vocabulary words at least once:", prompt)
+        paragraphs = []
+        for _ in range(rng.randint(3, 5)):
+            used = [word for word in words if rng.random() >= FAKE_MISS_RATE]
+            rng.shuffle(used)
+            sentences = [f"Then came the {word}, which was much sillier than anyone expected." for word in used]
+            sentences.insert(rng.randrange(len(sentences) + 1), rng.choice(_FILLER))
+            paragraphs.append(" ".join(sentences))
+        return "\n\n".join(paragraphs)
+
+
+def fake_tts(audio_text: str, output_filename: str, output_dir: str = "./media") -> str:
+    """
+    Write a silent MP3 roughly as long as reading the text aloud would take.
+    """
+    simulate_call("tts")
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, output_filename)
+    # About 15 characters a second, 38 frames a second
+    frames = max(1, len(audio_text) * 38 // 15)
+    with open(output_path, "wb") as audio_file:
+        audio_file.write(_SILENT_MP3_FRAME * frames)
+    return output_path
+
+
+def fake_image(prompt: str, size: int = 1024):
+    """
+    A solid colour image derived from the prompt.
+    """
+    from PIL import Image
+
+    simulate_call("image")
+    rng = _rng_for("image", prompt)
+    return Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+
+
+def fake_blob_upload(local_path: str, blob_pathname: str) -> Optional[str]:
+    """
+    Copy the file under media/fake_blob and return the URL the app serves it from.
+    """
+    simulate_call("blob")
+    destination = os.path.join(FAKE_BLOB_DIR, blob_pathname)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copyfile(local_path, destination)
+    return "/" + destination.replace(os.sep, "/")
@@ -0,0 +1,202 @@
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, update
+
+from src.orm import Question, SessionLocal, StoryQuestion, StorylineProgress, db_session
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+MAX_SCORE = 100
+
+# Multiple choice: the student picks the word, so it is right or wrong
+EXACT_MATCH_TYPES = {"select"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_answer(answer: Optional[str]) -> str:
+    """
+    Lowercase, trim and collapse whitespace so formatting never costs points.
+    """
+    return _WHITESPACE.sub(" ", (answer or "").strip().lower())
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Levenshtein distance between two strings, keeping only two rows of the table.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,                      # deletion
+                current[j - 1] + 1,                   # insertion
+                previous[j - 1] + (char_a != char_b)  # substitution
+            ))
+        previous = current
+    return previous[-1]
+
+
+def score_answer(question_type: str, correct: str, answer: Optional[str]) -> int:
+    """
+    Score one answer out of MAX_SCORE.
+
+    `select` questions need an exact (normalized) match. Typed answers get
+    partial credit for near misses: one minus the edit distance divided by the
+    longer of the two words, so "freind" for "friend" still earns 67.
+    """
+    correct = normalize_answer(correct)
+    answer = normalize_answer(answer)
+    if not answer:
+        return 0
+    if answer == correct:
+        return MAX_SCORE
+    if question_type in EXACT_MATCH_TYPES:
+        return 0
+    distance = edit_distance(answer, correct)
+    return max(0, round(MAX_SCORE * (1 - distance / max(len(answer), len(correct)))))
+
+
+def score_answers(items: Iterable[Tuple[str, str, Optional[str]]]) -> List[int]:
+    """
+    Batch form of `score_answer` for re-grading history.
+
+    Many students give the same answers to the same questions, so each
+    distinct (type, correct, answer) combination is only scored once.
+
+    Args:
+        items: (question type, correct answer, submitted answer) tuples
+
+    Returns:
+        The scores, in the same order as `items`
+    """
+    memo: Dict[Tuple[str, str, str], int] = {}
+    scores = []
+    for question_type, correct, answer in items:
+        key = (question_type, normalize_answer(correct), normalize_answer(answer))
+        if key not in memo:
+            memo[key] = score_answer(*key)
+        scores.append(memo[key])
+    return scores
+
+
+def grade_submission(story_id: int, answers: Dict[int, Optional[str]],
+                     durations: Optional[Dict[int, int]] = None,
+                     attempts: Optional[Dict[int, int]] = None) -> List[Dict]:
+    """
+    Grade every answer submitted for a story against `Question.correct`.
+
+    Loads the story's questions in one query. Questions that don't belong to
+    the story are ignored, and unanswered ones score 0.
+
+    Args:
+        story_id: The story the answers were given for
+        answers: Question ID to the submitted answer
+        durations: Question ID to seconds spent on it
+        attempts: Question ID to number of attempts
+
+    Returns:
+        One progress dictionary per question of the story, in the shape
+        `UpdateProgress` expects, plus the submitted `answer` and `correct`
+    """
+    durations = durations or {}
+    attempts = attempts or {}
+
+    with db_session() as session:
+        questions = (
+            session.query(Question.id, Question.type, Question.correct)
+            .join(StoryQuestion, StoryQuestion.question_id == Question.id)
+            .filter(StoryQuestion.story_id == story_id)
+            .order_by(StoryQuestion.id)
+            .all()
+        )
+
+    scores = score_answers((q.type, q.correct, answers.get(q.id)) for q in questions)
+    return [
+        {
+            "question_id": q.id,
+            "answer": answers.get(q.id),
+            "correct": q.correct,
+            "score": score,
+            "duration": durations.get(q.id),
+            "attempts": attempts.get(q.id, 1),
+        }
+        for q, score in zip(questions, scores)
+    ]
+
+
+def submission_score(graded: Sequence[Dict]) -> int:
+    """
+    Overall score of a graded submission, the mean of its question scores.
+    """
+    if not graded:
+        return 0
+    return round(sum(item["score"] for item in graded) / len(graded))
+
+
+def regrade_progress(batch_size: int = 1000, storyline_ids: Optional[List[int]] = None) -> Dict[str, int]:
+    """
+    Re-score stored answers with the current rules, e.g. after a grading change.
+
+    Walks `storyline_progress` in ID order, scores each batch with
+    `score_answers` and writes back only the scores that changed, with one
+    executemany UPDATE and a commit per batch.
+
+    Args:
+        batch_size: Progress rows per batch
+        storyline_ids: Only re-grade these storylines
+
+    Returns:
+        Counts of the rows checked and updated
+    """
+    checked = 0
+    updated = 0
+    last_id = 0
+    table = StorylineProgress.__table__
+
+    while True:
+        session = SessionLocal()
+        try:
+            query = (
+                session.query(StorylineProgress.storyline_progress_id, StorylineProgress.score,
+                              Question.type, Question.correct, StorylineProgress.answer)
+                .join(StoryQuestion, StoryQuestion.id == StorylineProgress.story_question_id)
+                .join(Question, Question.id == StoryQuestion.question_id)
+                .filter(StorylineProgress.storyline_progress_id > last_id,
+                        StorylineProgress.answer.isnot(None))
+            )
+            if storyline_ids:
+                query = query.filter(StorylineProgress.storyline_id.in_(storyline_ids))
+            rows = query.order_by(StorylineProgress.storyline_progress_id).limit(batch_size).all()
+            if not rows:
+                break
+
+            scores = score_answers((row.type, row.correct, row.answer) for row in rows)
+            changes = [
+                {"progress_id": row.storyline_progress_id, "new_score": score}
+                for row, score in zip(rows, scores)
+                if row.score != score
+            ]
+            if changes:
+                session.execute(
+                    update(table)
+                    .where(table.c.storyline_progress_id == bindparam("progress_id"))
+                    .values(score=bindparam("new_score")),
+                    changes,
+                )
+                session.commit()
+        finally:
+            session.close()
+
+        last_id = rows[-1].storyline_progress_id
+        checked += len(rows)
+        updated += len(changes)
+        logger.info(f"Re-graded {checked} progress rows, {updated} scores changed")
+
+    return {"checked": checked, "updated": updated}
@@ -0,0 +1,163 @@
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import or_, update
+
+from src.orm import StorylineStep, TaskQueue, TaskStatus, claim_task, db_session
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+GENERATE_STEP_TASK = "generate_storyline_step"
+# Steps generated while the storyline is created; the rest wait for a reader
+EAGER_STEPS = 1
+# How many steps past the one being read are generated in the background
+STEP_LOOKAHEAD = int(os.getenv("STEP_LOOKAHEAD", "1"))
+# Threads per web worker generating steps, kept apart from the request threadpool
+STEP_WORKERS = int(os.getenv("STEP_WORKERS", "2"))
+# An IN_PROGRESS step task untouched for this long is assumed abandoned
+STEP_TASK_TIMEOUT_MINUTES = float(os.getenv("STEP_TASK_TIMEOUT_MINUTES", "15"))
+
+_step_executor: Optional[ThreadPoolExecutor] = None
+
+
+def step_task(storyline_id: int, step: int, paragraph: str, required_words: List[str],
+              classroom: str, priority: int = 1) -> TaskQueue:
+    """
+    Queue task holding an unprocessed paragraph until its step is needed.
+
+    Args:
+        storyline_id: Storyline the step belongs to
+        step: Step number the paragraph becomes
+        paragraph: Raw paragraph text from the story response
+        required_words: Vocabulary words the story has to use
+        classroom: Classroom the step's questions are filed under
+        priority: Priority of the task
+    """
+    return TaskQueue(
+        title=GENERATE_STEP_TASK,
+        status=TaskStatus.PENDING,
+        context={
+            "storyline_id": storyline_id,
+            "step": step,
+            "paragraph": paragraph,
+            "required_words": required_words,
+            "classroom": classroom,
+        },
+        storyline_id=storyline_id,
+        priority=priority,
+    )
+
+
+def pending_step_tasks(session, storyline_id: Optional[int] = None, up_to_step: Optional[int] = None) -> List[TaskQueue]:
+    """
+    Step tasks still waiting to run, in step order.
+    """
+    query = (
+        session.query(TaskQueue)
+        .filter(TaskQueue.title == GENERATE_STEP_TASK)
+        .filter(TaskQueue.status == TaskStatus.PENDING)
+    )
+    if storyline_id is not None:
+        query = query.filter(TaskQueue.storyline_id == storyline_id)
+    tasks = sorted(query.all(), key=lambda task: (task.context["storyline_id"], task.context["step"]))
+    if up_to_step is not None:
+        tasks = [task for task in tasks if task.context["step"] <= up_to_step]
+    return tasks
+
+
+def has_pending_steps(storyline_id: int) -> bool:
+    """
+    Whether the storyline still has steps queued, which is only ever the case
+    for lazily generated storylines. One lookup on the task_queue index.
+    """
+    with db_session() as session:
+        return session.query(
+            session.query(TaskQueue.id)
+            .filter(TaskQueue.storyline_id == storyline_id)
+            .filter(TaskQueue.title == GENERATE_STEP_TASK)
+            .filter(TaskQueue.status == TaskStatus.PENDING)
+            .exists()
+        ).scalar()
+
+
+def reclaim_step_tasks(session, storyline_ids: Optional[List[int]] = None,
+                       timeout_minutes: float = STEP_TASK_TIMEOUT_MINUTES) -> int:
+    """
+    Put failed step tasks, and claimed ones whose worker went quiet for
+    `timeout_minutes`, back to PENDING so they are tried again.
+
+    Returns:
+        The number of tasks reclaimed
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(minutes=timeout_minutes)
+    statement = (
+        update(TaskQueue)
+        .where(TaskQueue.title == GENERATE_STEP_TASK)
+        .where(or_(
+            TaskQueue.status == TaskStatus.FAILED,
+            (TaskQueue.status == TaskStatus.IN_PROGRESS) & (TaskQueue.updated_at < cutoff),
+        ))
+        .values(status=TaskStatus.PENDING)
+    )
+    if storyline_ids:
+        statement = statement.where(TaskQueue.storyline_id.in_(storyline_ids))
+    return session.execute(statement).rowcount
+
+
+def claim_upcoming_steps(storyline_id: int, storyline_step_id: int, lookahead: int = STEP_LOOKAHEAD) -> List[int]:
+    """
+    Claim the pending steps within `lookahead` of the step being read.
+
+    Returns:
+        The claimed task IDs, in step order
+    """
+    with db_session() as session:
+        current = (
+            session.query(StorylineStep.step)
+            .filter(StorylineStep.storyline_step_id == storyline_step_id)
+            .filter(StorylineStep.storyline_id == storyline_id)
+            .scalar()
+        )
+        if current is None:
+            return []
+        tasks = pending_step_tasks(session, storyline_id, up_to_step=current + lookahead)
+        return [task.id for task in tasks if claim_task(session, task.id)]
+
+
+def generate_upcoming_steps(storyline_id: int, storyline_step_id: int, lookahead: int = STEP_LOOKAHEAD) -> Dict[int, bool]:
+    """
+    Background task of the storyline page: generate the next `lookahead`
+    steps while the student reads this one.
+
+    Returns:
+        A mapping of task ID to whether its step was generated
+    """
+    task_ids = claim_upcoming_steps(storyline_id, storyline_step_id, lookahead)
+    if not task_ids:
+        return {}
+
+    # The generator pulls in the LLM client, only load it once there is work
+    from generators.stories import generate_storyline_step
+
+    results = {task_id: generate_storyline_step(task_id) is not None for task_id in task_ids}
+    logger.info(f"Generated {sum(results.values())} of {len(results)} upcoming steps of storyline {storyline_id}")
+    return results
+
+
+def schedule_upcoming_steps(storyline_id: int, storyline_step_id: int, lookahead: int = STEP_LOOKAHEAD) -> None:
+    """
+    Start `generate_upcoming_steps` on the step threads, so LLM, TTS and
+    upload calls never hold a thread the web server needs for requests.
+    """
+    global _step_executor
+    if _step_executor is None:
+        # Created on first use, i.e. after gunicorn forked the worker
+        _step_executor = ThreadPoolExecutor(max_workers=STEP_WORKERS, thread_name_prefix="storyline-steps")
+    future = _step_executor.submit(generate_upcoming_steps, storyline_id, storyline_step_id, lookahead)
+    future.add_done_callback(
+        lambda f: f.exception() and logger.error(f"Generating upcoming steps of storyline {storyline_id} failed: {f.exception()}")
+    )
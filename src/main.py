@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
 from fastapi.responses import FileResponse
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import random
@@ -12,6 +12,10 @@ from dotenv import load_dotenv
 from openai import OpenAI
 
 from .storyline import router as storyline_router
+from .compression import CompressionMiddleware
+from .profiling import ProfilingMiddleware, router as profiling_router
+from .query_log import QUERY_LOG_ENABLED, QueryCountMiddleware
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, instrument_templates, render_metrics
 
 logger = logging.getLogger(name=__file__)
 logger.setLevel(logging.DEBUG)
@@ -50,6 +54,12 @@ def get_openai_response(system, prompt):
         return None
 
 app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+if QUERY_LOG_ENABLED:
+    app.add_middleware(QueryCountMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# Added last so it wraps compression and times the whole response
+app.add_middleware(MetricsMiddleware)
 # Define a Pydantic model for the incoming request data
 class Answer(BaseModel):
     key: str
@@ -73,9 +83,10 @@ app.mount("/static", NoCacheStaticFiles(directory="static"), name="static")
 app.mount("/media", NoCacheStaticFiles(directory="media"), name="media")
 
 # Initialize Jinja2 templates
-templates = Jinja2Templates(directory="templates")
+templates = instrument_templates(Jinja2Templates(directory="templates"))
 
 app.include_router(storyline_router) # Include the new storyline router
+app.include_router(profiling_router)
 
 # @app.get("/classroom_page", response_class=HTMLResponse)
 # async def read_root(request: Request):
@@ -120,4 +131,6 @@ app.include_router(storyline_router) # Include the new storyline router
 def health_check(request: Request):
     return { "status": "up" }
 
-
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,214 @@
+import datetime
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+from src.grading import MAX_SCORE, normalize_answer
+from src.orm import (
+    Question, StoryQuestion, StorylineProgress, WordMastery, bump_cache_version, db_session, dialect_insert
+)
+from src.spaced_repetition import REVIEW_QUEUE_NAMESPACE, review_queue_key, schedule_review, scheduler
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# Weight of the newest answer in the moving average of durations
+DURATION_EWMA_ALPHA = 0.3
+
+MasteryKey = Tuple[str, str, int, str]
+
+
+def mastery_subject(student_id: Optional[int], storyline_id: int) -> Tuple[str, int]:
+    """
+    Whose mastery a progress row counts towards: the student when known,
+    otherwise the storyline it was answered in.
+    """
+    if student_id is not None:
+        return "student", student_id
+    return "storyline", storyline_id
+
+
+def mastery_key(classroom: str, student_id: Optional[int], storyline_id: int, word: str) -> MasteryKey:
+    subject_type, subject_id = mastery_subject(student_id, storyline_id)
+    return classroom, subject_type, subject_id, normalize_answer(word)
+
+
+def apply_answer(row: WordMastery, score: Optional[int], duration: Optional[int],
+                 attempts: Optional[int], answered_at: Optional[datetime.datetime]) -> None:
+    """
+    Fold one answer into a rollup row.
+    """
+    row.answers = (row.answers or 0) + 1
+    row.correct_answers = (row.correct_answers or 0) + (1 if score is not None and score >= MAX_SCORE else 0)
+    row.total_attempts = (row.total_attempts or 0) + (attempts or 1)
+    if score is not None:
+        row.last_score = score
+    if duration is not None:
+        if row.ewma_duration is None:
+            row.ewma_duration = float(duration)
+        else:
+            row.ewma_duration = DURATION_EWMA_ALPHA * duration + (1 - DURATION_EWMA_ALPHA) * row.ewma_duration
+    if answered_at is not None and (row.last_answered_at is None or answered_at >= row.last_answered_at):
+        row.last_answered_at = answered_at
+    schedule_review(row, score, answered_at)
+
+
+def new_mastery_row(key: MasteryKey) -> WordMastery:
+    classroom, subject_type, subject_id, word = key
+    return WordMastery(
+        classroom=classroom, subject_type=subject_type, subject_id=subject_id, word=word,
+        answers=0, correct_answers=0, total_attempts=0,
+    )
+
+
+def record_mastery(session, answers: Iterable[Dict[str, Any]]) -> List[Tuple[str, int, str, str, datetime.datetime]]:
+    """
+    Update the rollup for freshly written progress, in the caller's transaction.
+
+    Args:
+        session: Session the progress rows are being written in
+        answers: One dictionary per progress row with `classroom`, `word`,
+            `student_id`, `storyline_id`, `score`, `duration`, `attempts`
+            and `answered_at`
+
+    Returns:
+        The new review schedules, to pass to `scheduler.observe` after commit
+    """
+    answers = list(answers)
+    if not answers:
+        return []
+
+    keys = {mastery_key(a["classroom"], a.get("student_id"), a["storyline_id"], a["word"]) for a in answers}
+    key_columns = (WordMastery.classroom, WordMastery.subject_type, WordMastery.subject_id, WordMastery.word)
+
+    # Create missing rows first; a concurrent submission that creates the
+    # same row makes this a no-op instead of a unique index violation
+    session.execute(
+        dialect_insert(session, WordMastery.__table__)
+        .values([
+            {"classroom": classroom, "subject_type": subject_type, "subject_id": subject_id, "word": word,
+             "answers": 0, "correct_answers": 0, "total_attempts": 0}
+            for classroom, subject_type, subject_id, word in sorted(keys)
+        ])
+        .on_conflict_do_nothing(index_elements=[column.name for column in key_columns])
+    )
+
+    # Lock the rows until the caller commits so concurrent submissions
+    # can't lose each other's updates; key order keeps them from deadlocking
+    existing = (
+        session.query(WordMastery)
+        .filter(tuple_(*key_columns).in_(sorted(keys)))
+        .order_by(*key_columns)
+        .with_for_update()
+        .populate_existing()
+        .all()
+    )
+    rows = {(r.classroom, r.subject_type, r.subject_id, r.word): r for r in existing}
+
+    for a in answers:
+        key = mastery_key(a["classroom"], a.get("student_id"), a["storyline_id"], a["word"])
+        apply_answer(rows[key], a.get("score"), a.get("duration"), a.get("attempts"), a.get("answered_at"))
+
+    # Tell every worker's scheduler these learners' queues changed
+    for subject_type, subject_id in sorted({(key[1], key[2]) for key in keys}):
+        bump_cache_version(session, REVIEW_QUEUE_NAMESPACE, review_queue_key(subject_type, subject_id))
+
+    return [
+        (rows[key].subject_type, rows[key].subject_id, rows[key].classroom, rows[key].word, rows[key].due_at)
+        for key in keys
+    ]
+
+
+def rebuild_word_mastery(classroom: Optional[str] = None, batch_size: int = 5000) -> int:
+    """
+    Recompute the rollup from the full progress history, e.g. after progress
+    was written by another app or the rollup rules changed.
+
+    Streams storyline_progress in answer order, folds it in memory and swaps
+    the old rows for the new ones in a single transaction.
+
+    Args:
+        classroom: Only rebuild this classroom
+        batch_size: Progress rows fetched per round trip
+
+    Returns:
+        The number of rollup rows written
+    """
+    rows: Dict[MasteryKey, WordMastery] = {}
+
+    with db_session() as session:
+        query = (
+            session.query(
+                Question.classroom, Question.correct,
+                StorylineProgress.student_id, StorylineProgress.storyline_id,
+                StorylineProgress.score, StorylineProgress.duration,
+                StorylineProgress.attempts, StorylineProgress.created_at,
+            )
+            .join(StoryQuestion, StoryQuestion.id == StorylineProgress.story_question_id)
+            .join(Question, Question.id == StoryQuestion.question_id)
+        )
+        if classroom is not None:
+            query = query.filter(Question.classroom == classroom)
+        query = query.order_by(StorylineProgress.created_at, StorylineProgress.storyline_progress_id)
+
+        for p in query.yield_per(batch_size):
+            key = mastery_key(p.classroom, p.student_id, p.storyline_id, p.correct)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = new_mastery_row(key)
+            apply_answer(row, p.score, p.duration, p.attempts, p.created_at)
+
+        stale = session.query(WordMastery)
+        if classroom is not None:
+            stale = stale.filter(WordMastery.classroom == classroom)
+        stale.delete(synchronize_session=False)
+        session.add_all(rows.values())
+        bump_cache_version(session, REVIEW_QUEUE_NAMESPACE)
+
+    scheduler.forget()
+    logger.info(f"Rebuilt {len(rows)} word mastery rows" + (f" for {classroom}" if classroom else ""))
+    return len(rows)
+
+
+def get_classroom_heatmap(classroom: str, subject_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Every learner x word cell of a classroom, read from the rollup in one query.
+
+    Args:
+        classroom: The classroom (question group) to report on
+        subject_type: Only `student` or only `storyline` rows
+
+    Returns:
+        The sorted word list and one entry per learner with a cell per word practised
+    """
+    with db_session() as session:
+        query = session.query(WordMastery).filter(WordMastery.classroom == classroom)
+        if subject_type is not None:
+            query = query.filter(WordMastery.subject_type == subject_type)
+        rows = query.order_by(WordMastery.subject_type, WordMastery.subject_id, WordMastery.word).all()
+
+        words = set()
+        subjects: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for row in rows:
+            words.add(row.word)
+            subject = subjects.setdefault((row.subject_type, row.subject_id), {
+                "subject_type": row.subject_type,
+                "subject_id": row.subject_id,
+                "cells": {},
+            })
+            subject["cells"][row.word] = {
+                "answers": row.answers,
+                "correct_answers": row.correct_answers,
+                "accuracy": round(row.correct_answers / row.answers, 3) if row.answers else None,
+                "total_attempts": row.total_attempts,
+                "last_score": row.last_score,
+                "ewma_duration": round(row.ewma_duration, 1) if row.ewma_duration is not None else None,
+                "last_answered_at": row.last_answered_at,
+            }
+
+    return {
+        "classroom": classroom,
+        "words": sorted(words),
+        "subjects": list(subjects.values()),
+    }
@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+from jinja2 import Template
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.cache import fragment_cache
+from src.orm import engine
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Seconds spent in the database and in templates by the current request
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+# (see gunicorn.conf.py) and a scrape of any worker reports all of them.
+# Gauges count only live workers; counters and histograms keep the samples
+# of workers that have exited, so recycling a worker doesn't reset them.
+REQUEST_DURATION = Histogram(
+    "snowday_http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of the response.",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "snowday_http_requests_in_flight",
+    "Requests currently being handled.",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "snowday_db_query_duration_seconds",
+    "Time spent executing individual SQL statements.",
+    buckets=DB_BUCKETS,
+)
+TEMPLATE_RENDER_DURATION = Histogram(
+    "snowday_template_render_duration_seconds",
+    "Time spent rendering a Jinja2 template, excluding database queries it triggers.",
+    ("template",),
+    buckets=DB_BUCKETS,
+)
+CACHE_HITS = Counter("snowday_cache_hits", "Cache lookups answered from the cache.", ("cache",))
+CACHE_MISSES = Counter("snowday_cache_misses", "Cache lookups that missed.", ("cache",))
+
+_POOL_STATS = {"size": "size", "checked_in": "checkedin", "checked_out": "checkedout", "overflow": "overflow"}
+# NullPool/StaticPool don't keep these numbers
+POOL_GAUGES = {
+    name: Gauge(f"snowday_db_pool_{name}", f"Connection pool {name.replace('_', ' ')}.", multiprocess_mode="livesum")
+    for name, attr in _POOL_STATS.items()
+    if hasattr(engine.pool, attr)
+}
+
+# name -> callable returning (hits, misses)
+_caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+# name -> (hits, misses) already added to the counters
+_reported: Dict[str, Tuple[int, int]] = {}
+_reported_lock = threading.Lock()
+
+
+def register_cache(name: str, stats: Callable[[], Tuple[int, int]]) -> None:
+    """
+    Report the hits and misses of an in-process cache on /metrics.
+    The hit ratio is rate(snowday_cache_hits_total) over hits plus misses.
+    """
+    _caches[name] = stats
+
+
+register_cache("fragment", lambda: (fragment_cache.hits, fragment_cache.misses))
+
+
+def _advance(counter: Counter, name: str, current: int, previous: int) -> None:
+    # A cache that reset its stats starts counting from zero again
+    delta = current - previous if current >= previous else current
+    if delta:
+        counter.labels(cache=name).inc(delta)
+
+
+def _sync_process_metrics() -> None:
+    """
+    Copy this worker's cache stats and pool size into the metrics. Caches
+    keep plain integers, so the counters are advanced by what changed since
+    the last sync.
+    """
+    with _reported_lock:
+        for name, stats in list(_caches.items()):
+            hits, misses = stats()
+            prev_hits, prev_misses = _reported.get(name, (0, 0))
+            _advance(CACHE_HITS, name, hits, prev_hits)
+            _advance(CACHE_MISSES, name, misses, prev_misses)
+            _reported[name] = (hits, misses)
+    for name, gauge in POOL_GAUGES.items():
+        gauge.set(getattr(engine.pool, _POOL_STATS[name])())
+
+
+def _add_timing(kind: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + seconds
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    DB_QUERY_DURATION.observe(elapsed)
+    _add_timing("db", elapsed)
+    _add_timing("queries", 1)
+
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for a failed statement; drop its start
+    # time so the next statement on this connection isn't timed from it
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get("metrics_query_start"):
+        conn.info["metrics_query_start"].pop()
+
+
+class TimedTemplate(Template):
+    """
+    Template that records how long each render takes. Queries fired from
+    inside the template (lazy loads) are booked as db time, not render time.
+    """
+
+    def render(self, *args, **kwargs) -> str:
+        timings = _request_timings.get()
+        db_before = timings.get("db", 0.0) if timings is not None else 0.0
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if timings is not None:
+                elapsed -= timings.get("db", 0.0) - db_before
+            TEMPLATE_RENDER_DURATION.labels(template=self.name or "<string>").observe(elapsed)
+            _add_timing("render", elapsed)
+
+
+def instrument_templates(templates):
+    """
+    Time every template loaded through a `Jinja2Templates` instance.
+    Call before any template has been loaded.
+    """
+    templates.env.template_class = TimedTemplate
+    return templates
+
+
+def _route_name(scope: Scope) -> str:
+    """
+    The path template of the matched route, so /storyline/1 and /storyline/2
+    land in the same series.
+    """
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    partial = None
+    for route in getattr(router, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # Path matched but the method did not (405)
+            partial = route.path
+    return partial or "unmatched"
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    db = timings.get("db", 0.0)
+    render = timings.get("render", 0.0)
+    other = max(total - db - render, 0.0)
+    return (
+        f'db;dur={db * 1000:.1f};desc="{int(timings.get("queries", 0))} queries", '
+        f'render;dur={render * 1000:.1f}, '
+        f'other;dur={other * 1000:.1f}'
+    )
+
+
+class MetricsMiddleware:
+    """
+    Record latency and in-flight requests per route, and add a Server-Timing
+    header splitting the time to first byte into db, render and other.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Match before the router rewrites root_path for mounted apps
+        route = _route_name(scope)
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing_header(timings, time.perf_counter() - start))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            _request_timings.reset(token)
+            REQUEST_DURATION.labels(method=scope["method"], route=route, status=status).observe(time.perf_counter() - start)
+            _sync_process_metrics()
+
+
+def render_metrics() -> str:
+    """
+    Every metric in the Prometheus text exposition format, summed over all
+    gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    _sync_process_metrics()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry).decode("utf-8")
@@ -3,9 +3,12 @@ import enum
 import logging
 import os
 
-from sqlalchemy import JSON, Column, DateTime, Enum, ForeignKeyConstraint, Integer, String, Table, Text, ForeignKey, create_engine, func
+from sqlalchemy import JSON, Column, DateTime, Enum, Float, ForeignKeyConstraint, Index, Integer, String, Table, Text, ForeignKey, create_engine, func, update
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker, joinedload
 
+from src.query_log import QUERY_LOG_ENABLED, SLOW_QUERY_MS, count_queries, instrument_engine
+
 Base = declarative_base()
 
 logger = logging.getLogger(__name__)
@@ -18,21 +21,50 @@ else:
     logger.error("DATABASE_URL environment variable not set")
     engine = create_engine("sqlite:///results.db")  # SQLite
 
+if QUERY_LOG_ENABLED or SLOW_QUERY_MS:
+    instrument_engine(engine)
+
 SessionLocal = sessionmaker(autoflush=False, bind=engine)
 
-from contextlib import contextmanager
+
+def dispose_engine_after_fork():
+    """
+    Give a forked worker its own connection pool. Connections the parent
+    opened are left to the parent (close=False) rather than shared.
+    """
+    engine.dispose(close=False)
+
+from contextlib import contextmanager, nullcontext
 
 @contextmanager
 def db_session():
     db = SessionLocal()
-    try:
-        yield db
-        db.commit() # Commit the transaction on successful completion
-    except Exception:
-        db.rollback() # Rollback on error
-        raise # Re-raise the exception
-    finally:
-        db.close()
+    with count_queries("db_session") if QUERY_LOG_ENABLED else nullcontext() as counter:
+        try:
+            yield db
+            db.commit() # Commit the transaction on successful completion
+        except Exception:
+            db.rollback() # Rollback on error
+            raise # Re-raise the exception
+        finally:
+            db.close()
+    if counter is not None:
+        logger.info(f"db_session issued {counter.count} queries in {counter.elapsed * 1000:.1f}ms")
+
+
+def dialect_insert(session, table):
+    """
+    INSERT with `on_conflict_do_update` / `on_conflict_do_nothing`, which
+    Postgres and SQLite both support through their own dialect constructs.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"No upsert support for {dialect}")
+    return insert(table)
 
 
 # Association class for many-to-many relationship between Story and Question
@@ -67,12 +99,51 @@ class Question(Base):
     question = Column(Text, nullable=False)
     key = Column(Text, nullable=False)
     correct = Column(Text, nullable=False)
+    # Legacy comma-joined copy of `answer_options`, still read by the Next.js app
     answers = Column(Text)
+    # Answer options as a JSON array (JSONB on Postgres, so it can be indexed and queried)
+    answer_options = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=True)
+    classroom = Column(Text, nullable=False)
 
     # Many-to-many relationship with Story through StoryQuestion
     story_questions = relationship("StoryQuestion", back_populates="question", cascade="all, delete-orphan")
     stories = relationship("Story", secondary="story_question", viewonly=True)
 
+    @property
+    def answer_list(self):
+        """
+        The answer options as a list, falling back to the legacy column for
+        rows the backfill has not reached yet.
+        """
+        if self.answer_options is not None:
+            return list(self.answer_options)
+        return split_answers(self.answers)
+
+    @answer_list.setter
+    def answer_list(self, answers):
+        # Write both columns until nothing reads the comma-joined one
+        self.answer_options = normalize_answers(answers)
+        self.answers = ','.join(self.answer_options) if self.answer_options is not None else None
+
+
+def split_answers(answers):
+    """
+    Split a legacy comma-joined answers string into a list.
+    """
+    return answers.split(',') if answers else []
+
+
+def normalize_answers(answers):
+    """
+    Accept answer options as a list or a legacy comma-joined string.
+    """
+    if answers is None:
+        return None
+    if isinstance(answers, str):
+        return split_answers(answers)
+    return list(answers)
+
+
 class Storyline(Base):
     __tablename__ = 'storyline'
 
@@ -83,6 +154,13 @@ class Storyline(Base):
     # Status tracking for storyline processing states
     status = Column(String, nullable=False)
 
+    # Student the storyline was written for (column managed by the Prisma migrations)
+    assigned_to = Column(Integer, ForeignKey('student.id', ondelete='SET NULL'), nullable=True)
+
+    # Bulk creation batch this storyline belongs to, if any
+    batch_id = Column(String(36), ForeignKey('storyline_batch.batch_id', ondelete='SET NULL'), nullable=True, index=True)
+    batch = relationship("StorylineBatch", back_populates="storylines")
+
     steps = relationship(
         "StorylineStep",
         back_populates="storyline",
@@ -117,12 +195,23 @@ class StorylineStep(Base):
 
 class StorylineProgress(Base):
     __tablename__ = 'storyline_progress'
+    # On Postgres the table is range-partitioned by created_at month (see the
+    # f4a2d8c61b37 migration); filter on created_at to skip old partitions
+    __table_args__ = (
+        Index('ix_storyline_progress_storyline_created', 'storyline_id', 'created_at'),
+    )
 
     storyline_progress_id = Column(Integer, primary_key=True, autoincrement=True)
     story_question_id = Column(Integer, ForeignKey('story_question.id'), nullable=False)
+    storyline_id = Column(Integer, ForeignKey('storyline.storyline_id'), nullable=False)
+    storyline_step_id = Column(Integer, ForeignKey('storyline_step.storyline_step_id'), nullable=False)
+    # Student who answered (column managed by the Prisma migrations)
+    student_id = Column(Integer, ForeignKey('student.id', ondelete='SET NULL'), nullable=True)
     duration = Column(Integer)
     score = Column(Integer)
     attempts = Column(Integer)
+    # The submitted answer, kept so historical answers can be re-graded
+    answer = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # Existing relationships
@@ -153,11 +242,17 @@ class TaskStatus(enum.Enum):
 
 class TaskQueue(Base):
     __tablename__ = 'task_queue'
+    __table_args__ = (
+        # Finds a storyline's queued steps without scanning the JSON context
+        Index('ix_task_queue_storyline_title_status', 'storyline_id', 'title', 'status'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(255), nullable=False)
     status = Column(Enum(TaskStatus), default=TaskStatus.PENDING, nullable=False)
     context = Column(JSON, nullable=True)
+    # Set for tasks that work on a single storyline
+    storyline_id = Column(Integer, ForeignKey('storyline.storyline_id', ondelete='CASCADE'), nullable=True)
     priority = Column(Integer, default=1)  # Assuming higher numbers mean higher priority
     created_at = Column(DateTime, default=func.now(), nullable=False)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
@@ -167,6 +262,29 @@ class TaskQueue(Base):
                f"priority={self.priority}, created_at={self.created_at}, updated_at={self.updated_at})>"
 
 
+def claim_task(session, task_id):
+    """
+    Move a task from PENDING to IN_PROGRESS. Only one worker can win the
+    claim, so a task never runs twice at the same time.
+    """
+    claimed = session.execute(
+        update(TaskQueue)
+        .where(TaskQueue.id == task_id, TaskQueue.status == TaskStatus.PENDING)
+        .values(status=TaskStatus.IN_PROGRESS, updated_at=func.now())
+    )
+    return claimed.rowcount == 1
+
+
+class StorylineBatch(Base):
+    __tablename__ = 'storyline_batch'
+
+    batch_id = Column(String(36), primary_key=True)
+    classroom = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+    storylines = relationship("Storyline", back_populates="batch")
+
+
 class Student(Base):
    __tablename__ = 'student'
 
@@ -184,61 +302,196 @@ class Student(Base):
        return f"<Student(id={self.id}, genre='{self.genre}', location='{self.location}', style='{self.style}')>"
 
 
+class WordMastery(Base):
+    """
+    Rollup of storyline_progress per learner and word, kept up to date as
+    progress is written (see src/mastery.py) so teacher views never rescan
+    the progress history.
+    """
+    __tablename__ = 'word_mastery'
+    __table_args__ = (
+        # Unique key, also serves the per-classroom heatmap query
+        Index('ix_word_mastery_classroom_subject_word', 'classroom', 'subject_type', 'subject_id', 'word', unique=True),
+        # Loads a learner's review queue in due order
+        Index('ix_word_mastery_subject_due', 'subject_type', 'subject_id', 'due_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    classroom = Column(Text, nullable=False)
+    # 'student' when the progress rows carry a student, 'storyline' otherwise
+    subject_type = Column(String(16), nullable=False)
+    subject_id = Column(Integer, nullable=False)
+    word = Column(Text, nullable=False)
+    answers = Column(Integer, nullable=False, default=0)
+    correct_answers = Column(Integer, nullable=False, default=0)
+    total_attempts = Column(Integer, nullable=False, default=0)
+    last_score = Column(Integer, nullable=True)
+    ewma_duration = Column(Float, nullable=True)
+    last_answered_at = Column(DateTime, nullable=True)
+    # Spaced repetition (SM-2) state, see src/spaced_repetition.py
+    ease_factor = Column(Float, nullable=True)
+    interval_days = Column(Float, nullable=True)
+    repetitions = Column(Integer, nullable=True)
+    due_at = Column(DateTime, nullable=True)
+
+
+class StorylinePoolEntry(Base):
+    """
+    A storyline generated ahead of time for a classroom word list and
+    genre/style bucket, handed out by `POST /storylines` instead of waiting
+    for a fresh one (see src/warm_pool.py).
+    """
+    __tablename__ = 'storyline_pool_entry'
+    __table_args__ = (
+        # Finds the oldest ready entry of a bucket
+        Index('ix_storyline_pool_entry_bucket', 'classroom', 'words_key', 'status', 'genre', 'style'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    storyline_id = Column(Integer, ForeignKey('storyline.storyline_id', ondelete='CASCADE'), nullable=False, unique=True)
+    classroom = Column(Text, nullable=False)
+    # Hash of the normalized, sorted word list
+    words_key = Column(String(40), nullable=False)
+    words = Column(JSON, nullable=False)
+    genre = Column(Text, nullable=False)
+    style = Column(Text, nullable=False)
+    # 'generating', 'ready' or 'claimed'
+    status = Column(String(16), nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+
+    storyline = relationship("Storyline")
+
+
+class CacheVersion(Base):
+    """
+    Version stamp of an in-process cache entry (or a whole namespace when
+    `key` is empty). Writers bump it in their own transaction and readers
+    compare it before serving a cached value, so an invalidation reaches every
+    worker and process (see src/cache.py).
+    """
+    __tablename__ = 'cache_version'
+
+    namespace = Column(String(64), primary_key=True)
+    key = Column(Text, primary_key=True, default='')
+    version = Column(Integer, nullable=False, default=0)
+
+
+def bump_cache_version(session, namespace, key=None):
+    """
+    Invalidate `key` of a namespace, or the whole namespace when no key is given.
+    """
+    table = CacheVersion.__table__
+    statement = dialect_insert(session, table).values(namespace=namespace, key=key or '', version=1)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.namespace, table.c.key],
+        set_={"version": table.c.version + 1},
+    ))
+
+
+def get_cache_version(session, namespace, key):
+    """
+    Combined version of a namespace and one of its keys; changes whenever either is bumped.
+    """
+    rows = session.query(CacheVersion.key, CacheVersion.version).filter(
+        CacheVersion.namespace == namespace,
+        CacheVersion.key.in_(['', key]),
+    ).all()
+    versions = dict(rows)
+    return versions.get('', 0), versions.get(key, 0)
+
+
 def get_storyline_with_step_progress(session, storyline_id):
     """
     Return a dictionary representing a single Storyline record, 
     including each StorylineStep and its associated StorylineProgress entries.
     """
-    # 1. Query the Storyline, loading steps, stories, and progress in one go.
-    storyline = (
-        session.query(Storyline)
-        .options(
-            # Load each step plus the associated Story
-            joinedload(Storyline.steps).joinedload(StorylineStep.story),
-            # Load the StorylineStep.progress relationship
-            joinedload(Storyline.steps).joinedload(StorylineStep.progress)
-        )
-        .filter(Storyline.storyline_id == storyline_id)
-        .one_or_none()
-    )
+    return get_storylines_with_step_progress(session, [storyline_id]).get(storyline_id)
 
-    if storyline is None:
-        return None
 
-    # 2. Build a nested dictionary response
-    # Top-level: storyline info
-    storyline_dict = {
-        "storyline_id": storyline.storyline_id,
-        "steps": []
-    }
-
-    # 3. For each step, add a "progress" key which is a list of progress dictionaries
-    for step in storyline.steps:
-        step_dict = {
-            "storyline_step_id": step.storyline_step_id,
-            "step": step.step,
-            "story_id": step.story_id,
-            "progress": []
-        }
-
-        for p in step.progress:
-            progress_dict = {
-                "storyline_progress_id": p.storyline_progress_id,
-                "storyline_id": p.storyline_id,
-                "storyline_step_id": p.storyline_step_id,
-                "story_id": p.story_question.story_id if p.story_question else None,
-                "question_id": p.story_question.question_id if p.story_question else None,
-                "duration": p.duration,
-                "score": p.score,
-                "attempts": p.attempts,
-            }
-            step_dict["progress"].append(progress_dict)
+# Keep IN (...) lists well under every database's bound parameter limit
+REPORT_CHUNK_SIZE = 500
 
-        storyline_dict["steps"].append(step_dict)
 
-    return storyline_dict
+def get_storylines_with_step_progress(session, storyline_ids, since=None):
+    """
+    Report loader for many storylines at once, e.g. every storyline in a class.
 
-def create_storyline_from_dict(session, stories_data):
+    Runs two flat queries per chunk of IDs, one for the storylines and their
+    steps and one for the progress joined to its story question, selecting only the columns the
+    report needs, and nests the rows in a single pass.
+
+    :param session: SQLAlchemy session object
+    :param storyline_ids: IDs of the storylines to load
+    :param since: Only include progress created after this datetime, which
+        lets Postgres skip older partitions
+    :return: Dictionary of storyline ID to the same nested dictionary
+        `get_storyline_with_step_progress` returns; missing IDs are left out
+    """
+    storyline_ids = list(dict.fromkeys(storyline_ids))
+    storylines = {}
+    steps_by_id = {}
+
+    for i in range(0, len(storyline_ids), REPORT_CHUNK_SIZE):
+        chunk = storyline_ids[i:i + REPORT_CHUNK_SIZE]
+
+        # Outer join so storylines without steps are still reported
+        step_rows = (
+            session.query(Storyline.storyline_id, StorylineStep.storyline_step_id,
+                          StorylineStep.step, StorylineStep.story_id)
+            .outerjoin(StorylineStep, StorylineStep.storyline_id == Storyline.storyline_id)
+            .filter(Storyline.storyline_id.in_(chunk))
+            .order_by(Storyline.storyline_id, StorylineStep.step, StorylineStep.storyline_step_id)
+            .all()
+        )
+        for storyline_id, storyline_step_id, step, story_id in step_rows:
+            storyline_dict = storylines.setdefault(storyline_id, {"storyline_id": storyline_id, "steps": []})
+            if storyline_step_id is None:
+                continue
+            step_dict = {
+                "storyline_step_id": storyline_step_id,
+                "step": step,
+                "story_id": story_id,
+                "progress": []
+            }
+            steps_by_id[storyline_step_id] = step_dict
+            storyline_dict["steps"].append(step_dict)
+
+        progress_query = (
+            session.query(
+                StorylineProgress.storyline_progress_id,
+                StorylineProgress.storyline_id,
+                StorylineProgress.storyline_step_id,
+                StoryQuestion.story_id,
+                StoryQuestion.question_id,
+                StorylineProgress.duration,
+                StorylineProgress.score,
+                StorylineProgress.attempts,
+            )
+            # Progress belongs to the report through its step, like StorylineStep.progress
+            .join(StorylineStep, StorylineStep.storyline_step_id == StorylineProgress.storyline_step_id)
+            .outerjoin(StoryQuestion, StoryQuestion.id == StorylineProgress.story_question_id)
+            .filter(StorylineStep.storyline_id.in_(chunk))
+        )
+        if since is not None:
+            progress_query = progress_query.filter(StorylineProgress.created_at >= since)
+        progress_rows = progress_query.order_by(StorylineProgress.storyline_progress_id).all()
+        for row in progress_rows:
+            steps_by_id[row.storyline_step_id]["progress"].append({
+                "storyline_progress_id": row.storyline_progress_id,
+                "storyline_id": row.storyline_id,
+                "storyline_step_id": row.storyline_step_id,
+                "story_id": row.story_id,
+                "question_id": row.question_id,
+                "duration": row.duration,
+                "score": row.score,
+                "attempts": row.attempts,
+            })
+
+    return storylines
+
+def create_storyline_from_dict(session, stories_data, status="completed"):
     """
     Creates a new Storyline record, a StorylineStep for each story item in stories_data,
     and corresponding Story/Question entries as described in stories_data.
@@ -255,58 +508,70 @@ def create_storyline_from_dict(session, stories_data):
                 "question": "text",
                 "key": "unique key",
                 "correct": "correct answer",
-                "answers": "comma,seperated,answers"
+                "answers": ["list", "of", "answers"],  # or "comma,seperated,answers"
+                "classroom": "classroom name"
               }
             ]
           }
         ]
+    :param status: Status of the new storyline
     :return: The newly created Storyline object
     """
 
-    # 1. Create a new Storyline
-    storyline = Storyline()
+    storyline = build_storyline(stories_data, status=status)
+
+    # One flush inserts each table in a batch (multi-row INSERT .. RETURNING
+    # where the database supports it), then commit the entire transaction
     session.add(storyline)
-    session.flush()  
-    # flush ensures storyline_id is available for subsequent inserts
+    session.flush()
+    session.commit()
+
+    return storyline
+
+
+def create_storylines_from_dicts(session, storylines_data, status="completed"):
+    """
+    Bulk variant of `create_storyline_from_dict` for imports: every storyline
+    in `storylines_data` (a list of `stories_data` lists) is written with a
+    single flush and commit.
+
+    :return: The newly created Storyline objects, in input order
+    """
+    storylines = [build_storyline(stories_data, status=status) for stories_data in storylines_data]
+    session.add_all(storylines)
+    session.flush()
+    session.commit()
+
+    return storylines
+
+
+def build_storyline(stories_data, status="completed"):
+    """
+    Build an unsaved Storyline with its steps, stories and questions.
+    Relationships fill in the foreign keys at flush time, so nothing has to be
+    flushed to learn an ID.
+    """
+    storyline = Storyline(status=status)
 
-    # 2. Iterate over each item in stories_data
     for step_index, item in enumerate(stories_data, start=1):
         # Create a Story
         new_story = Story(content=item["content"])
-        session.add(new_story)
-        session.flush()  
-        # flush ensures new_story.id is available for the questions/step
 
         # Optionally create the Questions for this Story
-        questions = item.get("questions", [])
-        for q in questions:
+        for q in item.get("questions", []):
             new_question = Question(
                 type=q["type"],
                 question=q["question"],
                 key=q["key"],
                 correct=q["correct"],
-                answers=q["answers"]
+                answer_list=q["answers"],
+                classroom=q.get("classroom", "")
             )
-            session.add(new_question)
-            session.flush()  # Ensure new_question.id is available
-            
             # Create a StoryQuestion association
-            story_question = StoryQuestion(
-                story_id=new_story.id,
-                question_id=new_question.id
-            )
-            session.add(story_question)
+            new_story.story_questions.append(StoryQuestion(question=new_question))
 
         # Create a StorylineStep referencing our new Story
-        new_step = StorylineStep(
-            storyline_id=storyline.storyline_id,
-            step=step_index,
-            story_id=new_story.id
-        )
-        session.add(new_step)
-
-    # 3. Commit the entire transaction
-    session.commit()
+        storyline.steps.append(StorylineStep(step=step_index, story=new_story))
 
     return storyline
 
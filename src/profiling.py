@@ -0,0 +1,223 @@
+import atexit
+import cProfile
+import datetime
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# Profiling over HTTP is off unless an admin token is configured
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_PER_MINUTE = int(os.getenv("PROFILE_MAX_PER_MINUTE", "6"))
+# Older artifacts are deleted once there are more than this many
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+_PROFILE_ID = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+router = APIRouter(prefix="/profiles")
+
+
+class RateLimiter:
+    """
+    Allow at most `limit` events in any `window` seconds.
+    """
+
+    def __init__(self, limit: int, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._events and self._events[0] <= now - self.window:
+                self._events.popleft()
+            if len(self._events) >= self.limit:
+                return False
+            self._events.append(now)
+            return True
+
+
+_rate_limiter = RateLimiter(PROFILE_MAX_PER_MINUTE)
+# cProfile can only run one profiler at a time
+_active = threading.Lock()
+
+
+def new_profile_id() -> str:
+    return f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def save_profile(profiler: cProfile.Profile, profile_id: str, label: str) -> str:
+    """
+    Write the raw stats (for snakeviz/pstats) and a text summary, then prune
+    old artifacts.
+
+    Returns:
+        The path of the raw stats file
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats_path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    profiler.dump_stats(stats_path)
+
+    summary = io.StringIO()
+    summary.write(f"# {label}\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats("cumulative").print_stats(60)
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.txt"), "w") as f:
+        f.write(summary.getvalue())
+
+    prune_profiles()
+    return stats_path
+
+
+def prune_profiles(keep: int = PROFILE_KEEP) -> None:
+    for profile_id in list_profiles()[keep:]:
+        for extension in ("prof", "txt"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{profile_id}.{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> List[str]:
+    """
+    Stored profile IDs, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    ids = {name.rsplit(".", 1)[0] for name in os.listdir(PROFILE_DIR) if name.endswith(".prof")}
+    return sorted((i for i in ids if _PROFILE_ID.match(i)), reverse=True)
+
+
+def enable_cli_profiling(job_name: str) -> cProfile.Profile:
+    """
+    Profile the rest of a generator run and save it when the process exits.
+    """
+    profiler = cProfile.Profile()
+    profile_id = new_profile_id()
+
+    def finish():
+        profiler.disable()
+        path = save_profile(profiler, profile_id, job_name)
+        print(f"Profile saved to {path} (summary in {path[:-len('.prof')]}.txt)")
+
+    atexit.register(finish)
+    profiler.enable()
+    return profiler
+
+
+def _token_matches(token: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+class ProfilingMiddleware:
+    """
+    Profile one request when an admin sends `X-Profile: 1` (or `?profile=1`)
+    together with the token in `X-Profile-Token`. The artifact ID comes back in
+    `X-Profile-Id`. Requests are rate limited and only one is profiled at a
+    time; anything else is served normally.
+
+    cProfile follows the event loop thread, so sync endpoints that FastAPI
+    hands to the threadpool only show up as time spent waiting for them.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def _wants_profile(self, scope: Scope) -> bool:
+        headers = Headers(scope=scope)
+        query = parse_qs(scope.get("query_string", b"").decode())
+        requested = headers.get("x-profile") == "1" or query.get("profile") == ["1"]
+        return requested and _token_matches(headers.get("x-profile-token"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not PROFILE_TOKEN or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if not _rate_limiter.allow() or not _active.acquire(blocking=False):
+            logger.info(f"Skipped profiling {scope['path']}: rate limited or another profile is running")
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = new_profile_id()
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Id"] = profile_id
+            await send(message)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profiler.disable()
+            save_profile(profiler, profile_id, f"{scope['method']} {scope['path']}")
+        finally:
+            _active.release()
+
+
+def require_profile_token(request: Request) -> None:
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+    if not _token_matches(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Invalid profile token.")
+
+
+def _profile_path(profile_id: str, extension: str) -> str:
+    if not _PROFILE_ID.match(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{extension}")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return path
+
+
+@router.get("")
+def profiles_index(request: Request) -> Dict[str, List[str]]:
+    require_profile_token(request)
+    return {"profiles": list_profiles()}
+
+
+@router.get("/{profile_id}")
+def profile_summary(request: Request, profile_id: str):
+    """
+    Text summary of a stored profile, sorted by cumulative time.
+    """
+    require_profile_token(request)
+    with open(_profile_path(profile_id, "txt")) as f:
+        return PlainTextResponse(f.read())
+
+
+@router.get("/{profile_id}/download")
+def download_profile(request: Request, profile_id: str):
+    """
+    Raw cProfile stats, for pstats or snakeviz.
+    """
+    require_profile_token(request)
+    return FileResponse(
+        _profile_path(profile_id, "prof"),
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.prof",
+    )
@@ -0,0 +1,120 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# Opt-in: count statements per session/request and log the slow ones
+QUERY_LOG_ENABLED = os.getenv("SQL_QUERY_LOG", "").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "0"))
+
+_active_counters: ContextVar[Tuple["QueryCounter", ...]] = ContextVar("active_query_counters", default=())
+_instrumented = set()
+
+
+class QueryCounter:
+    """
+    Statements executed while the counter is active, with their timings.
+    """
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.count = 0
+        self.elapsed = 0.0
+        self.statements: List[Tuple[str, float]] = []
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.elapsed += elapsed
+        self.statements.append((statement, elapsed))
+
+
+def _format_statement(statement: str, parameters) -> str:
+    return f"{' '.join(statement.split())} -- params: {parameters!r}"
+
+
+def instrument_engine(engine, slow_query_ms: Optional[float] = None) -> None:
+    """
+    Attach the query counting and slow-query listeners to an engine.
+    Safe to call more than once.
+    """
+    if id(engine) in _instrumented:
+        return
+    _instrumented.add(id(engine))
+    threshold = SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_log_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_log_start"].pop()
+        for counter in _active_counters.get():
+            counter.record(statement, elapsed)
+        if threshold and elapsed * 1000 >= threshold:
+            logger.warning(f"Slow query ({elapsed * 1000:.1f}ms): {_format_statement(statement, parameters)}")
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        # A failed statement never reaches after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and exception_context.execution_context is not None and conn.info.get("query_log_start"):
+            conn.info["query_log_start"].pop()
+
+
+@contextmanager
+def count_queries(label: str = ""):
+    """
+    Count the statements executed inside the block. Counters nest, so a
+    request counter keeps counting while a session counter is active.
+
+    Usage:
+        with count_queries() as counter:
+            get_all_storylines()
+        print(counter.count)
+    """
+    counter = QueryCounter(label)
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+
+
+@contextmanager
+def assert_max_queries(n: int):
+    """
+    Fail with AssertionError when the block executes more than `n` statements.
+    The engine must have been passed to `instrument_engine`.
+    """
+    with count_queries() as counter:
+        yield counter
+    if counter.count > n:
+        statements = "\n".join(f"  {i + 1}. {' '.join(statement.split())}" for i, (statement, _) in enumerate(counter.statements))
+        raise AssertionError(f"Expected at most {n} queries, {counter.count} were executed:\n{statements}")
+
+
+class QueryCountMiddleware:
+    """
+    Log how many statements each request issued and how long they took.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries(f"{scope['method']} {scope['path']}") as counter:
+            await self.app(scope, receive, send)
+        logger.info(f"{counter.label} issued {counter.count} queries in {counter.elapsed * 1000:.1f}ms")
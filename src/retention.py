@@ -0,0 +1,222 @@
+import csv
+import datetime
+import gzip
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, text
+
+from src.orm import StorylineProgress, db_session
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# Months of progress kept in the database, older months are archived
+PROGRESS_RETENTION_MONTHS = int(os.getenv("PROGRESS_RETENTION_MONTHS", "24"))
+# How far ahead monthly partitions are created
+PARTITION_MONTHS_AHEAD = 3
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Window of the storyline page's progress lookup; 0 reads the whole history
+RECENT_PROGRESS_DAYS = int(os.getenv("RECENT_PROGRESS_DAYS", "180"))
+
+TABLE = StorylineProgress.__tablename__
+_PARTITION_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def is_partitioned(session) -> bool:
+    """
+    Whether storyline_progress is a partitioned Postgres table; everywhere
+    else it is a single table.
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return False
+    return session.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": TABLE},
+    ).first() is not None
+
+
+def list_partitions(session) -> Dict[datetime.date, str]:
+    """
+    Monthly partitions by their first day (the default partition is left out).
+    """
+    names = session.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+             "WHERE i.inhparent = to_regclass(:table)"),
+        {"table": TABLE},
+    ).scalars()
+    partitions = {}
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD, today: Optional[datetime.date] = None) -> List[str]:
+    """
+    Create the monthly partitions up to `months_ahead` months from now, so new
+    rows never land in the default partition.
+
+    Returns:
+        The names of the partitions created
+    """
+    first = month_start(today or datetime.date.today())
+    created = []
+    with db_session() as session:
+        if not is_partitioned(session):
+            return created
+        existing = list_partitions(session)
+        for offset in range(months_ahead + 1):
+            month = add_months(first, offset)
+            if month in existing:
+                continue
+            name = partition_name(month)
+            session.execute(text(
+                f'CREATE TABLE "{name}" PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+    for name in created:
+        logger.info(f"Created partition {name}")
+    return created
+
+
+def archive_path(month: datetime.date, archive_dir: str = ARCHIVE_DIR) -> str:
+    directory = os.path.join(archive_dir, TABLE)
+    os.makedirs(directory, exist_ok=True)
+    # Timestamped, so archiving late rows for a month never overwrites an earlier archive
+    return os.path.join(directory, f"{month:%Y-%m}.{datetime.datetime.utcnow():%Y%m%dT%H%M%S}.csv.gz")
+
+
+def write_archive(result, path: str) -> int:
+    """
+    Stream a result into a gzip-compressed CSV file, header first.
+    """
+    rows = 0
+    with gzip.open(path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(result.keys())
+        for partition in result.partitions():
+            writer.writerows(partition)
+            rows += len(partition)
+    return rows
+
+
+def archive_month(month: datetime.date, archive_dir: str = ARCHIVE_DIR, chunk_size: int = 5000) -> int:
+    """
+    Move one month of progress out of the database into a compressed CSV.
+
+    On a partitioned table the month's partition is detached, dumped and
+    dropped; otherwise the month's rows are dumped and deleted. Either way it
+    happens in one transaction, so a failed write leaves the data in place.
+
+    Returns:
+        The number of rows archived
+    """
+    start = datetime.datetime.combine(month, datetime.time.min)
+    end = datetime.datetime.combine(add_months(month, 1), datetime.time.min)
+    path = archive_path(month, archive_dir)
+
+    with db_session() as session:
+        if is_partitioned(session):
+            name = list_partitions(session).get(month)
+            if name is None:
+                return 0
+            session.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION "{name}"'))
+            result = session.execute(
+                text(f'SELECT * FROM "{name}" ORDER BY storyline_progress_id')
+                .execution_options(stream_results=True, yield_per=chunk_size)
+            )
+            rows = write_archive(result, path)
+            session.execute(text(f'DROP TABLE "{name}"'))
+        else:
+            table = StorylineProgress.__table__
+            in_month = (table.c.created_at >= start) & (table.c.created_at < end)
+            result = session.execute(
+                select(table).where(in_month).order_by(table.c.storyline_progress_id)
+                .execution_options(stream_results=True, yield_per=chunk_size)
+            )
+            rows = write_archive(result, path)
+            session.execute(table.delete().where(in_month))
+
+    if rows:
+        logger.info(f"Archived {rows} progress rows from {month:%Y-%m} to {path}")
+    else:
+        os.remove(path)
+    return rows
+
+
+def months_to_archive(retention_months: int, today: Optional[datetime.date] = None) -> List[datetime.date]:
+    """
+    Months older than the retention window that still hold progress.
+    """
+    cutoff = add_months(month_start(today or datetime.date.today()), -retention_months)
+    with db_session() as session:
+        if is_partitioned(session):
+            return sorted(month for month in list_partitions(session) if month < cutoff)
+
+        oldest = session.execute(
+            select(StorylineProgress.created_at)
+            .where(StorylineProgress.created_at < datetime.datetime.combine(cutoff, datetime.time.min))
+            .order_by(StorylineProgress.created_at)
+            .limit(1)
+        ).scalar()
+    if oldest is None:
+        return []
+    months = []
+    month = month_start(oldest)
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def apply_retention(retention_months: int = PROGRESS_RETENTION_MONTHS, archive_dir: str = ARCHIVE_DIR,
+                    months_ahead: int = PARTITION_MONTHS_AHEAD, dry_run: bool = False) -> Dict[str, object]:
+    """
+    The periodic maintenance job: create upcoming partitions and archive
+    every month that fell out of the retention window.
+
+    Args:
+        retention_months: Months of progress to keep in the database
+        archive_dir: Where the compressed archives are written
+        months_ahead: Partitions to keep ready beyond the current month
+        dry_run: Only report the months that would be archived
+
+    Returns:
+        The partitions created and rows archived per month
+    """
+    months = months_to_archive(retention_months)
+    if dry_run:
+        return {"created": [], "archived": {f"{month:%Y-%m}": None for month in months}}
+
+    created = ensure_partitions(months_ahead)
+    archived = {f"{month:%Y-%m}": archive_month(month, archive_dir) for month in months}
+    return {"created": created, "archived": archived}
+
+
+def recent_progress_since(days: Optional[int] = None) -> Optional[datetime.datetime]:
+    """
+    Lower bound on created_at for "recent progress" lookups. Filtering on it
+    lets Postgres skip every partition before it. None when no limit is set.
+    """
+    days = days if days is not None else RECENT_PROGRESS_DAYS
+    if days <= 0:
+        return None
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
@@ -0,0 +1,232 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.metrics import register_cache
+from src.orm import WordMastery, db_session, get_cache_version
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# SM-2 constants
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# Answers scoring below this quality (0-5) restart the word's schedule
+PASSING_QUALITY = 3
+
+# Reload a cached queue after this long even if its shared version is unchanged
+QUEUE_TTL_SECONDS = 300
+# cache_version namespace bumped whenever a learner's schedules change, so
+# every worker notices answers recorded by the others
+REVIEW_QUEUE_NAMESPACE = "review_queue"
+
+Subject = Tuple[str, int]
+WordKey = Tuple[str, str]  # (classroom, word)
+
+
+def review_queue_key(subject_type: str, subject_id: int) -> str:
+    return f"{subject_type}:{subject_id}"
+
+
+def quality_from_score(score: Optional[int]) -> int:
+    """
+    Map a 0-100 score onto SM-2's 0-5 answer quality.
+    """
+    if score is None:
+        return 0
+    return max(0, min(5, round(score / 20)))
+
+
+def review(ease_factor: Optional[float], interval_days: Optional[float], repetitions: Optional[int],
+           score: Optional[int], reviewed_at: datetime.datetime) -> Tuple[float, float, int, datetime.datetime]:
+    """
+    One SM-2 step: the word's new ease factor, interval and repetition count
+    after an answer, and when it is next due.
+
+    Args:
+        ease_factor: Current ease factor, None for a word never reviewed
+        interval_days: Current interval in days
+        repetitions: Successful reviews in a row
+        score: Score of the answer, 0-100
+        reviewed_at: When the answer was given
+
+    Returns:
+        (ease_factor, interval_days, repetitions, due_at)
+    """
+    ease_factor = INITIAL_EASE if ease_factor is None else ease_factor
+    repetitions = repetitions or 0
+    quality = quality_from_score(score)
+
+    if quality < PASSING_QUALITY:
+        repetitions = 0
+        interval_days = 1.0
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = round((interval_days or 1.0) * ease_factor, 2)
+
+    ease_factor = max(MIN_EASE, ease_factor + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ease_factor, interval_days, repetitions, reviewed_at + datetime.timedelta(days=interval_days)
+
+
+def schedule_review(row: WordMastery, score: Optional[int], reviewed_at: Optional[datetime.datetime]) -> None:
+    """
+    Advance a rollup row's schedule for one answer.
+    """
+    reviewed_at = reviewed_at or datetime.datetime.utcnow()
+    row.ease_factor, row.interval_days, row.repetitions, row.due_at = review(
+        row.ease_factor, row.interval_days, row.repetitions, score, reviewed_at
+    )
+
+
+class ReviewQueue:
+    """
+    A learner's words in a min-heap ordered by due date.
+
+    Rescheduled words are pushed again rather than moved; the outdated heap
+    entries are skipped when they surface (`_due` holds the live due dates).
+    """
+
+    def __init__(self, entries: Iterable[Tuple[datetime.datetime, str, str]], version: Tuple[int, int] = (0, 0)):
+        self._heap = list(entries)
+        heapq.heapify(self._heap)
+        self._due: Dict[WordKey, datetime.datetime] = {(c, w): due for due, c, w in self._heap}
+        self.loaded_at = time.monotonic()
+        # Shared version the entries were loaded at
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def update(self, classroom: str, word: str, due_at: datetime.datetime) -> None:
+        self._due[(classroom, word)] = due_at
+        heapq.heappush(self._heap, (due_at, classroom, word))
+        # Compact once outdated entries outnumber live ones
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, c, w) for (c, w), due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def peek(self, n: int) -> List[Tuple[datetime.datetime, str, str]]:
+        """
+        The `n` words due soonest, most overdue first. O(log n) per word.
+        """
+        picked = []
+        while self._heap and len(picked) < n:
+            entry = heapq.heappop(self._heap)
+            due_at, classroom, word = entry
+            if self._due.get((classroom, word)) != due_at:
+                continue  # Outdated entry of a rescheduled word
+            picked.append(entry)
+        # Picking a word doesn't review it, so it stays queued
+        for entry in picked:
+            heapq.heappush(self._heap, entry)
+        return picked
+
+
+class SpacedRepetitionScheduler:
+    """
+    Per-learner review queues, loaded from `word_mastery` with one indexed
+    query on first use and kept current as answers are recorded.
+
+    Every lookup checks the learner's shared version in `cache_version`,
+    which `record_mastery` bumps, so a queue never outlives an answer
+    recorded by another worker or process.
+    """
+
+    def __init__(self, ttl: float = QUEUE_TTL_SECONDS):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._queues: Dict[Subject, ReviewQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, subject: Subject) -> ReviewQueue:
+        with db_session() as session:
+            version = get_cache_version(session, REVIEW_QUEUE_NAMESPACE, review_queue_key(*subject))
+            queue = self._queues.get(subject)
+            if queue is not None and queue.version == version and time.monotonic() - queue.loaded_at < self.ttl:
+                self.hits += 1
+                return queue
+
+            self.misses += 1
+            rows = (
+                session.query(WordMastery.due_at, WordMastery.classroom, WordMastery.word)
+                .filter(
+                    WordMastery.subject_type == subject[0],
+                    WordMastery.subject_id == subject[1],
+                    WordMastery.due_at.isnot(None),
+                )
+                .all()
+            )
+        queue = self._queues[subject] = ReviewQueue((tuple(row) for row in rows), version)
+        return queue
+
+    def next_due_words(self, student_id: int, n: int) -> List[Dict]:
+        """
+        The student's `n` words due for review soonest.
+
+        Returns:
+            Dictionaries with `classroom`, `word` and `due_at`, most overdue first
+        """
+        with self._lock:
+            picked = self._queue(("student", student_id)).peek(n)
+        return [{"classroom": classroom, "word": word, "due_at": due_at} for due_at, classroom, word in picked]
+
+    def observe(self, schedules: Iterable[Tuple[str, int, str, str, datetime.datetime]]) -> None:
+        """
+        Apply committed schedule changes to the queues already loaded.
+
+        `record_mastery` bumped each learner's shared version once, so a queue
+        whose version moved by exactly that is updated in place; if another
+        writer got in between, it is dropped and reloaded on next use.
+
+        Args:
+            schedules: (subject_type, subject_id, classroom, word, due_at) tuples
+        """
+        by_subject: Dict[Subject, List[Tuple[str, str, datetime.datetime]]] = {}
+        for subject_type, subject_id, classroom, word, due_at in schedules:
+            by_subject.setdefault((subject_type, subject_id), []).append((classroom, word, due_at))
+
+        with self._lock:
+            loaded = [subject for subject in by_subject if subject in self._queues]
+        if not loaded:
+            return
+        with db_session() as session:
+            versions = {
+                subject: get_cache_version(session, REVIEW_QUEUE_NAMESPACE, review_queue_key(*subject))
+                for subject in loaded
+            }
+
+        with self._lock:
+            for subject, version in versions.items():
+                queue = self._queues.get(subject)
+                if queue is None:
+                    continue
+                if version != (queue.version[0], queue.version[1] + 1):
+                    self._queues.pop(subject, None)
+                    continue
+                for classroom, word, due_at in by_subject[subject]:
+                    if due_at is not None:
+                        queue.update(classroom, word, due_at)
+                queue.version = version
+
+    def forget(self, student_id: Optional[int] = None) -> None:
+        """
+        Drop cached queues, e.g. after the rollup was rebuilt.
+        """
+        with self._lock:
+            if student_id is None:
+                self._queues.clear()
+            else:
+                self._queues.pop(("student", student_id), None)
+
+
+scheduler = SpacedRepetitionScheduler()
+register_cache("review_queues", lambda: (scheduler.hits, scheduler.misses))
@@ -0,0 +1,294 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import func
+
+from src import export
+from src.mastery import get_classroom_heatmap
+from src.orm import Question, Story, StoryQuestion, Storyline, StorylineStep, db_session, split_answers
+from src.warm_pool import POOL_STATUSES
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+router = APIRouter(prefix="/api")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Plain columns that can be requested through `fields`
+QUESTION_COLUMNS = {
+    "id": Question.id,
+    "type": Question.type,
+    "question": Question.question,
+    "key": Question.key,
+    "correct": Question.correct,
+    "answers": Question.answer_options,
+    "classroom": Question.classroom,
+}
+# Related data that costs an extra query, only loaded when asked for
+QUESTION_EXTRAS = {"stories"}
+DEFAULT_QUESTION_FIELDS = ["id", "type", "question", "key", "correct", "answers", "classroom"]
+
+STORYLINE_COLUMNS = {
+    "storyline_id": Storyline.storyline_id,
+    "status": Storyline.status,
+    "original_request": Storyline.original_request,
+}
+STORYLINE_EXTRAS = {"step_count", "steps"}
+DEFAULT_STORYLINE_FIELDS = ["storyline_id", "status", "step_count"]
+
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({"after": last_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """
+    Turn an opaque cursor back into the last ID the client has seen.
+    """
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded))["after"]
+        return int(after)
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def parse_fields(fields: Optional[str], allowed: set, default: List[str]) -> List[str]:
+    if not fields:
+        return default
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def get_questions_page(after: int, limit: int, fields: List[str], classroom: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Fetch one page of questions ordered by ID, reading only the requested columns.
+
+    Returns:
+        The page of question dictionaries and the last ID when more rows follow
+    """
+    column_names = [f for f in fields if f in QUESTION_COLUMNS and f != "id"]
+    columns = [Question.id] + [QUESTION_COLUMNS[f] for f in column_names]
+    if "answers" in column_names:
+        # Rows the backfill has not reached yet only have the comma-joined copy
+        columns.append(Question.answers)
+
+    with db_session() as session:
+        query = session.query(*columns).filter(Question.id > after)
+        if classroom:
+            query = query.filter(Question.classroom == classroom)
+        rows = query.order_by(Question.id).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        items = []
+        for row in rows:
+            item = {"id": row[0]} if "id" in fields else {}
+            for name, value in zip(column_names, row[1:]):
+                if name == "answers" and value is None:
+                    value = split_answers(row[-1])
+                item[name] = value
+            items.append(item)
+
+        if "stories" in fields and rows:
+            question_ids = [row[0] for row in rows]
+            story_rows = (
+                session.query(StoryQuestion.question_id, Story.id, Story.content)
+                .join(Story, StoryQuestion.story_id == Story.id)
+                .filter(StoryQuestion.question_id.in_(question_ids))
+                .order_by(Story.id)
+                .all()
+            )
+            stories_by_question: Dict[int, List[Dict[str, Any]]] = {qid: [] for qid in question_ids}
+            for question_id, story_id, content in story_rows:
+                stories_by_question[question_id].append({"story_id": story_id, "content": content})
+            for row, item in zip(rows, items):
+                item["stories"] = stories_by_question[row[0]]
+
+    next_after = rows[-1][0] if has_more else None
+    return items, next_after
+
+
+def get_storylines_page(after: int, limit: int, fields: List[str], status: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Fetch one page of storylines ordered by ID. Step counts come from a single
+    grouped subquery and step contents from one extra query for the whole page.
+    """
+    column_names = [f for f in fields if f in STORYLINE_COLUMNS and f != "storyline_id"]
+    columns = [Storyline.storyline_id] + [STORYLINE_COLUMNS[f] for f in column_names]
+
+    with db_session() as session:
+        step_counts = None
+        if "step_count" in fields:
+            step_counts = (
+                session.query(StorylineStep.storyline_id, func.count(StorylineStep.storyline_step_id).label("step_count"))
+                .group_by(StorylineStep.storyline_id)
+                .subquery()
+            )
+            columns.append(func.coalesce(step_counts.c.step_count, 0))
+
+        query = session.query(*columns)
+        if step_counts is not None:
+            query = query.outerjoin(step_counts, step_counts.c.storyline_id == Storyline.storyline_id)
+        query = query.filter(Storyline.storyline_id > after)
+        if status:
+            query = query.filter(Storyline.status == status)
+        else:
+            query = query.filter(Storyline.status.notin_(POOL_STATUSES))
+        rows = query.order_by(Storyline.storyline_id).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        items = []
+        for row in rows:
+            item = {"storyline_id": row[0]} if "storyline_id" in fields else {}
+            for name, value in zip(column_names, row[1:]):
+                item[name] = value
+            if step_counts is not None:
+                item["step_count"] = row[-1]
+            items.append(item)
+
+        if "steps" in fields and rows:
+            storyline_ids = [row[0] for row in rows]
+            step_rows = (
+                session.query(StorylineStep.storyline_id, StorylineStep.storyline_step_id, StorylineStep.step, Story.id, Story.content, Story.audio)
+                .join(Story, StorylineStep.story_id == Story.id)
+                .filter(StorylineStep.storyline_id.in_(storyline_ids))
+                .order_by(StorylineStep.storyline_id, StorylineStep.step)
+                .all()
+            )
+            steps_by_storyline: Dict[int, List[Dict[str, Any]]] = {sid: [] for sid in storyline_ids}
+            for storyline_id, storyline_step_id, step, story_id, content, audio in step_rows:
+                steps_by_storyline[storyline_id].append({
+                    "storyline_step_id": storyline_step_id,
+                    "step": step,
+                    "story_id": story_id,
+                    "content": content,
+                    "audio": audio,
+                })
+            for row, item in zip(rows, items):
+                item["steps"] = steps_by_storyline[row[0]]
+
+    next_after = rows[-1][0] if has_more else None
+    return items, next_after
+
+
+def conditional_json_response(request: Request, payload: Dict[str, Any]) -> Response:
+    """
+    Serialize the payload with a content-hash ETag and answer 304 when the
+    client already holds the same page.
+    """
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/questions")
+def list_questions(
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = Query(None),
+    classroom: Optional[str] = Query(None),
+):
+    """
+    Page through questions, optionally for one classroom.
+    Add `stories` to `fields` to include the story content each question is used in.
+    """
+    selected = parse_fields(fields, set(QUESTION_COLUMNS) | QUESTION_EXTRAS, DEFAULT_QUESTION_FIELDS)
+    items, next_after = get_questions_page(decode_cursor(cursor), limit, selected, classroom)
+    return conditional_json_response(request, {
+        "items": items,
+        "next_cursor": encode_cursor(next_after) if next_after is not None else None,
+    })
+
+
+@router.get("/storylines")
+def list_storylines(
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+):
+    """
+    Page through storylines, optionally filtered by status.
+    `original_request` and `steps` (with story content) are only returned when
+    listed in `fields`.
+    """
+    selected = parse_fields(fields, set(STORYLINE_COLUMNS) | STORYLINE_EXTRAS, DEFAULT_STORYLINE_FIELDS)
+    items, next_after = get_storylines_page(decode_cursor(cursor), limit, selected, status)
+    return conditional_json_response(request, {
+        "items": items,
+        "next_cursor": encode_cursor(next_after) if next_after is not None else None,
+    })
+
+
+@router.get("/classrooms/{classroom}/mastery")
+def classroom_mastery(
+    request: Request,
+    classroom: str,
+    subject_type: Optional[str] = Query(None, pattern="^(student|storyline)$"),
+):
+    """
+    Word mastery heatmap for a classroom: one row per student (or storyline,
+    for progress without a student) and one cell per word practised.
+    """
+    return conditional_json_response(request, get_classroom_heatmap(classroom, subject_type))
+
+
+@router.get("/exports/progress")
+def export_progress(
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    classroom: Optional[str] = Query(None),
+    since: Optional[datetime.date] = Query(None),
+    until: Optional[datetime.date] = Query(None),
+    storyline_id: List[int] = Query([]),
+    include_story_content: bool = Query(False),
+):
+    """
+    Stream storyline progress joined with its questions and stories as CSV
+    or Parquet. Rows are read with a server-side cursor and sent in chunks,
+    so exports of any size run in constant memory.
+    """
+    if format == "parquet" and export.pyarrow is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the server.")
+
+    filters = {
+        "classroom": classroom,
+        "since": since,
+        "until": until,
+        "storyline_ids": storyline_id,
+        "include_story_content": include_story_content,
+    }
+    if format == "parquet":
+        body, media_type = export.iter_parquet(**filters), "application/vnd.apache.parquet"
+    else:
+        body, media_type = export.iter_csv(**filters), "text/csv; charset=utf-8"
+
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="storyline_progress.{format}"',
+    })
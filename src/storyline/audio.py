@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from src.metrics import register_cache
+from src.orm import Story, StorylineStep, db_session
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+MEDIA_DIR = os.path.abspath("media")
+CHUNK_SIZE = 64 * 1024
+
+# Clip sizes never change once uploaded (blob pathnames carry a random suffix),
+# so remember them instead of issuing a HEAD request on every range request.
+_size_cache: Dict[str, int] = {}
+size_cache_stats = {"hits": 0, "misses": 0}
+register_cache("audio_size", lambda: (size_cache_stats["hits"], size_cache_stats["misses"]))
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class AudioSegment:
+    """
+    One paragraph clip inside a storyline's virtual audio stream.
+    `start` and `end` are inclusive byte offsets within the whole stream.
+    """
+    step: int
+    story_id: int
+    source: str
+    start: int
+    end: int
+
+    def __init__(self, step: int, story_id: int, source: str, start: int, end: int):
+        self.step = step
+        self.story_id = story_id
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    def to_dict(self) -> Dict:
+        return {
+            "step": self.step,
+            "story_id": self.story_id,
+            "start": self.start,
+            "end": self.end,
+        }
+
+
+def is_remote(source: str) -> bool:
+    return source.startswith("http://") or source.startswith("https://")
+
+
+def local_audio_path(source: str) -> str:
+    """
+    Map a `Story.audio` value such as `/media/assignment-5.mp3` onto a file
+    inside the media directory, refusing anything that escapes it.
+    """
+    relative = source
+    if relative.startswith("/media/"):
+        relative = relative[len("/media/"):]
+    path = os.path.realpath(os.path.join(MEDIA_DIR, relative.lstrip("/")))
+    if os.path.commonpath([path, MEDIA_DIR]) != MEDIA_DIR:
+        raise ValueError(f"Audio path {source} is outside of the media directory")
+    return path
+
+
+def get_audio_size(source: str) -> int:
+    """
+    Return the size in bytes of a clip, from disk or from a HEAD request.
+    """
+    if source in _size_cache:
+        size_cache_stats["hits"] += 1
+        return _size_cache[source]
+    size_cache_stats["misses"] += 1
+
+    if is_remote(source):
+        response = requests.head(source, allow_redirects=True, timeout=10)
+        response.raise_for_status()
+        size = int(response.headers["Content-Length"])
+    else:
+        size = os.path.getsize(local_audio_path(source))
+
+    _size_cache[source] = size
+    return size
+
+
+def get_storyline_audio_segments(storyline_id: int) -> List[AudioSegment]:
+    """
+    Lay out the audio clip of every step in a storyline back to back.
+
+    Args:
+        storyline_id: The ID of the storyline to stream
+
+    Returns:
+        The segments in step order; steps without audio are skipped
+    """
+    with db_session() as session:
+        rows = (
+            session.query(StorylineStep.step, Story.id, Story.audio)
+            .join(Story, StorylineStep.story_id == Story.id)
+            .filter(StorylineStep.storyline_id == storyline_id)
+            .filter(Story.audio.isnot(None))
+            .order_by(StorylineStep.step)
+            .all()
+        )
+
+    segments = []
+    offset = 0
+    for step, story_id, audio in rows:
+        try:
+            size = get_audio_size(audio)
+        except (OSError, ValueError, KeyError, requests.exceptions.RequestException) as e:
+            logger.warning(f"Skipping audio for story {story_id}: {e}")
+            continue
+        if size == 0:
+            continue
+        segments.append(AudioSegment(step, story_id, audio, offset, offset + size - 1))
+        offset += size
+
+    return segments
+
+
+def parse_range_header(range_header: Optional[str], total_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `Range: bytes=...` header into inclusive offsets.
+
+    Returns None when the whole stream should be sent. Raises ValueError when
+    the range can not be satisfied. Multi-range requests are answered with the
+    first range only, which browsers' media elements never ask for anyway.
+    """
+    if not range_header:
+        return None
+
+    match = _RANGE_PATTERN.match(range_header.split(',')[0].strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(total_size - length, 0), total_size - 1
+
+    start = int(first)
+    end = int(last) if last else total_size - 1
+    if start >= total_size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {total_size} bytes")
+    return start, min(end, total_size - 1)
+
+
+def _iter_clip(source: str, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield bytes `start..end` (inclusive, relative to the clip) of one clip.
+    """
+    if is_remote(source):
+        headers = {"Range": f"bytes={start}-{end}"}
+        with requests.get(source, headers=headers, stream=True, timeout=10) as response:
+            response.raise_for_status()
+            remaining = end - start + 1
+            if response.status_code == 200 and start > 0:
+                # Origin ignored the range, skip ahead ourselves
+                skip = start
+            else:
+                skip = 0
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if skip:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk = chunk[skip:]
+                    skip = 0
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+                if remaining <= 0:
+                    break
+        return
+
+    with open(local_audio_path(source), "rb") as audio_file:
+        audio_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = audio_file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_audio_range(segments: List[AudioSegment], start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield bytes `start..end` (inclusive) of the virtual stream, reading only
+    the parts of the clips that overlap the requested range.
+    """
+    for segment in segments:
+        if segment.end < start:
+            continue
+        if segment.start > end:
+            break
+        clip_start = max(start, segment.start) - segment.start
+        clip_end = min(end, segment.end) - segment.start
+        yield from _iter_clip(segment.source, clip_start, clip_end)
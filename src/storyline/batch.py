@@ -0,0 +1,162 @@
+import json
+import random
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from src.orm import (
+    Question,
+    Storyline,
+    StorylineBatch,
+    Student,
+    TaskQueue,
+    TaskStatus,
+    db_session
+)
+from src.utils import FRIENDS, INTERESTS
+
+GENERATE_STORYLINE_TASK = "generate_storyline"
+
+
+def as_list(value: Any) -> List[str]:
+    """
+    Student interests/friends are JSON arrays, but older rows hold a
+    comma separated string.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return [v.strip() for v in value.split(',') if v.strip()]
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value]
+
+
+def student_storyline_request(student: Student, words: List[str], classroom: str, batch_id: str) -> Dict[str, Any]:
+    """
+    Build the `original_request` payload `generate_story` expects from a Student row.
+    """
+    interests = as_list(student.interests)
+    friends = as_list(student.friends)
+    return {
+        "words": words,
+        "vocab_id": None,
+        "classroom": classroom,
+        "genre": student.genre,
+        "location": student.location,
+        "style": student.style,
+        "selected_interests": interests if interests else random.sample(INTERESTS, 2),
+        "friend": random.choice(friends or FRIENDS),
+        "student_id": student.id,
+        "batch_id": batch_id,
+    }
+
+
+def create_storyline_batch(classroom: str, student_ids: List[int], words: Optional[List[str]] = None, priority: int = 1) -> Dict[str, Any]:
+    """
+    Create one pending Storyline per student, plus a queue task for each,
+    in a single transaction.
+
+    Args:
+        classroom: Classroom whose words the storylines practise
+        student_ids: Students to write a storyline for
+        words: Words to use; defaults to every question word in the classroom
+        priority: Priority of the generated queue tasks
+
+    Returns:
+        A dictionary with the batch ID and the created storyline IDs
+
+    Raises:
+        LookupError: if a student does not exist
+        ValueError: if there are no words to write about
+    """
+    batch_id = str(uuid.uuid4())
+
+    with db_session() as session:
+        students = session.query(Student).filter(Student.id.in_(student_ids)).all()
+        students_by_id = {student.id: student for student in students}
+        missing = [sid for sid in student_ids if sid not in students_by_id]
+        if missing:
+            raise LookupError(f"Students not found: {missing}")
+
+        if not words:
+            rows = (
+                session.query(Question.correct)
+                .filter(Question.classroom == classroom)
+                .distinct()
+                .order_by(Question.correct)
+                .all()
+            )
+            words = [row[0] for row in rows]
+        if not words:
+            raise ValueError(f"No words found for classroom {classroom}")
+
+        batch = StorylineBatch(batch_id=batch_id, classroom=classroom)
+        storylines = [
+            Storyline(
+                original_request=json.dumps(student_storyline_request(students_by_id[sid], words, classroom, batch_id)),
+                status="pending",
+                assigned_to=sid,
+                batch=batch,
+            )
+            for sid in student_ids
+        ]
+        session.add(batch)
+        session.add_all(storylines)
+        # One flush inserts every storyline and hands back their IDs for the tasks
+        session.flush()
+
+        session.add_all([
+            TaskQueue(
+                title=GENERATE_STORYLINE_TASK,
+                status=TaskStatus.PENDING,
+                context={"storyline_id": storyline.storyline_id, "batch_id": batch_id},
+                storyline_id=storyline.storyline_id,
+                priority=priority,
+            )
+            for storyline in storylines
+        ])
+
+        storyline_ids = [storyline.storyline_id for storyline in storylines]
+
+    return {
+        "batch_id": batch_id,
+        "storyline_ids": storyline_ids,
+    }
+
+
+def get_batch_progress(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Summarise the generation status of every storyline in a batch.
+
+    Returns:
+        None if the batch does not exist, otherwise status counts and per-storyline status
+    """
+    with db_session() as session:
+        batch = session.get(StorylineBatch, batch_id)
+        if batch is None:
+            return None
+
+        rows = (
+            session.query(Storyline.storyline_id, Storyline.assigned_to, Storyline.status)
+            .filter(Storyline.batch_id == batch_id)
+            .order_by(Storyline.storyline_id)
+            .all()
+        )
+
+        counts = Counter(status for _, _, status in rows)
+        return {
+            "batch_id": batch.batch_id,
+            "classroom": batch.classroom,
+            "created_at": batch.created_at,
+            "total": len(rows),
+            "status_counts": dict(counts),
+            "done": all(status in ("completed", "failed") for _, _, status in rows),
+            "storylines": [
+                {"storyline_id": storyline_id, "student_id": student_id, "status": status}
+                for storyline_id, student_id, status in rows
+            ],
+        }
@@ -4,10 +4,10 @@ from collections import Counter
 from typing import Dict, List, Optional, Tuple, Any
 
 from sqlalchemy import func, desc
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager
 
 from src.orm import (
-    StorylineProgress, 
+    StorylineProgress as StorylineProgressModel,
     Storyline, 
     StorylineStep, 
     StoryQuestion, 
@@ -15,29 +15,34 @@ from src.orm import (
     Question,
     db_session
 )
+from src.grading import grade_submission, submission_score
+from src.mastery import record_mastery
+from src.spaced_repetition import scheduler
 
 
-def StorylineProgress(storyline_id: int) -> Dict[int, List[Dict[str, Any]]]:
+def StorylineProgress(storyline_id: int, since: Optional[datetime.datetime] = None) -> Dict[int, List[Dict[str, Any]]]:
     """
     Get all StorylineProgress rows for a given storyline_id, grouped by the story_id 
     they are associated with. Limit the number of progress rows returned per story to 1.
     
     Args:
         storyline_id: The ID of the storyline to get progress for
+        since: Only consider progress created after this, which lets Postgres skip older partitions
         
     Returns:
         A dictionary mapping story_id to a list of progress dictionaries
     """
     with db_session() as session:
         # Query to get the latest progress entry for each story in the storyline
-        progress_entries = (
-            session.query(StorylineProgress)
-            .join(StoryQuestion, StorylineProgress.story_question_id == StoryQuestion.id)
-            .join(StorylineStep, StorylineStep.storyline_id == storyline_id)
-            .filter(StorylineProgress.storyline_id == storyline_id)
-            .order_by(StoryQuestion.story_id, desc(StorylineProgress.created_at))
-            .all()
+        query = (
+            session.query(StorylineProgressModel)
+            .join(StoryQuestion, StorylineProgressModel.story_question_id == StoryQuestion.id)
+            .options(contains_eager(StorylineProgressModel.story_question))
+            .filter(StorylineProgressModel.storyline_id == storyline_id)
         )
+        if since is not None:
+            query = query.filter(StorylineProgressModel.created_at >= since)
+        progress_entries = query.order_by(StoryQuestion.story_id, desc(StorylineProgressModel.created_at)).all()
         
         # Group by story_id and take the first (most recent) entry for each
         result = {}
@@ -68,25 +73,28 @@ def StorylineProgress(storyline_id: int) -> Dict[int, List[Dict[str, Any]]]:
         return result
 
 
-def QuestionProgress(question_id: int) -> Dict[str, Any]:
+def QuestionProgress(question_id: int, since: Optional[datetime.datetime] = None) -> Dict[str, Any]:
     """
     Get all StorylineProgress rows for a given question id and calculate 
     the mean score and data distribution.
     
     Args:
         question_id: The ID of the question to get progress for
+        since: Only consider progress created after this, which lets Postgres skip older partitions
         
     Returns:
         A dictionary containing statistics about the question progress
     """
     with db_session() as session:
         # Query all progress entries for the given question
-        progress_entries = (
-            session.query(StorylineProgress)
-            .join(StoryQuestion, StorylineProgress.story_question_id == StoryQuestion.id)
+        query = (
+            session.query(StorylineProgressModel)
+            .join(StoryQuestion, StorylineProgressModel.story_question_id == StoryQuestion.id)
             .filter(StoryQuestion.question_id == question_id)
-            .all()
         )
+        if since is not None:
+            query = query.filter(StorylineProgressModel.created_at >= since)
+        progress_entries = query.all()
         
         # Extract scores and calculate statistics
         scores = [entry.score for entry in progress_entries if entry.score is not None]
@@ -116,25 +124,28 @@ def QuestionProgress(question_id: int) -> Dict[str, Any]:
         return result
 
 
-def StoryProgress(story_id: int) -> List[Dict[str, Any]]:
+def StoryProgress(story_id: int, since: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
     """
     Get all the StorylineProgress rows for a given story id
     
     Args:
         story_id: The ID of the story to get progress for
+        since: Only consider progress created after this, which lets Postgres skip older partitions
         
     Returns:
         A list of dictionaries representing progress entries
     """
     with db_session() as session:
         # Query all progress entries for the given story
-        progress_entries = (
-            session.query(StorylineProgress)
-            .join(StoryQuestion, StorylineProgress.story_question_id == StoryQuestion.id)
+        query = (
+            session.query(StorylineProgressModel)
+            .join(StoryQuestion, StorylineProgressModel.story_question_id == StoryQuestion.id)
+            .options(contains_eager(StorylineProgressModel.story_question))
             .filter(StoryQuestion.story_id == story_id)
-            .order_by(desc(StorylineProgress.created_at))
-            .all()
         )
+        if since is not None:
+            query = query.filter(StorylineProgressModel.created_at >= since)
+        progress_entries = query.order_by(desc(StorylineProgressModel.created_at)).all()
         
         # Convert to list of dictionaries
         result = []
@@ -154,7 +165,8 @@ def StoryProgress(story_id: int) -> List[Dict[str, Any]]:
         return result
 
 
-def UpdateProgress(story_id: int, progress_data: List[Dict[str, Any]]) -> List[StorylineProgress]:
+def UpdateProgress(story_id: int, progress_data: List[Dict[str, Any]], storyline_id: int,
+                   storyline_step_id: int, student_id: Optional[int] = None) -> List[StorylineProgressModel]:
     """
     Save a StorylineProgress row for each question in a story when the user submits the form for a story.
     
@@ -166,6 +178,10 @@ def UpdateProgress(story_id: int, progress_data: List[Dict[str, Any]]) -> List[S
             - duration: Time spent on the question (in seconds)
             - score: Score achieved (typically 0-100)
             - attempts: Number of attempts made
+            - answer: The submitted answer (optional)
+        storyline_id: The storyline the story was read in
+        storyline_step_id: The step of that storyline
+        student_id: The student who submitted the answers
             
     Returns:
         A list of the created StorylineProgress objects
@@ -175,13 +191,15 @@ def UpdateProgress(story_id: int, progress_data: List[Dict[str, Any]]) -> List[S
     with db_session() as session:
         # Get all StoryQuestion entries for this story
         story_questions = (
-            session.query(StoryQuestion)
+            session.query(StoryQuestion.id, StoryQuestion.question_id, Question.correct, Question.classroom)
+            .join(Question, Question.id == StoryQuestion.question_id)
             .filter(StoryQuestion.story_id == story_id)
             .all()
         )
         
         # Create a mapping of question_id to story_question_id for quick lookup
-        question_to_sq = {sq.question_id: sq.id for sq in story_questions}
+        question_to_sq = {sq.question_id: sq for sq in story_questions}
+        mastery_answers = []
         
         # Process each progress item
         for item in progress_data:
@@ -190,21 +208,81 @@ def UpdateProgress(story_id: int, progress_data: List[Dict[str, Any]]) -> List[S
             if question_id not in question_to_sq:
                 continue  # Skip if question doesn't belong to this story
                 
-            story_question_id = question_to_sq[question_id]
+            story_question = question_to_sq[question_id]
+            created_at = datetime.datetime.utcnow()
             
             # Create a new progress entry
-            progress_entry = StorylineProgress(
-                story_question_id=story_question_id,
+            progress_entry = StorylineProgressModel(
+                story_question_id=story_question.id,
+                storyline_id=storyline_id,
+                storyline_step_id=storyline_step_id,
+                student_id=student_id,
                 duration=item.get("duration"),
                 score=item.get("score"),
                 attempts=item.get("attempts"),
-                created_at=datetime.datetime.utcnow()
+                answer=item.get("answer"),
+                created_at=created_at
             )
             
             session.add(progress_entry)
             created_entries.append(progress_entry)
+
+            mastery_answers.append({
+                "classroom": story_question.classroom,
+                "word": story_question.correct,
+                "student_id": student_id,
+                "storyline_id": storyline_id,
+                "score": item.get("score"),
+                "duration": item.get("duration"),
+                "attempts": item.get("attempts"),
+                "answered_at": created_at,
+            })
+
+        # Keep the word mastery rollup in step with the new rows
+        schedules = record_mastery(session, mastery_answers)
         
         # Commit all changes
         session.commit()
+        scheduler.observe(schedules)
         
-        return created_entries
\ No newline at end of file
+        return created_entries
+
+
+def GradeAndSaveProgress(storyline_step_id: int, answers: Dict[int, Optional[str]],
+                         durations: Optional[Dict[int, int]] = None,
+                         attempts: Optional[Dict[int, int]] = None,
+                         student_id: Optional[int] = None,
+                         storyline_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Grade a submission for one storyline step and save a progress row per question.
+
+    Args:
+        storyline_step_id: The step the answers were submitted for
+        answers: Question ID to the submitted answer
+        durations: Question ID to seconds spent on it
+        attempts: Question ID to number of attempts
+        student_id: The student who submitted the answers
+        storyline_id: When given, the step must belong to this storyline
+
+    Returns:
+        The overall score and the graded questions, or None if the step doesn't exist
+    """
+    with db_session() as session:
+        step = session.get(StorylineStep, storyline_step_id)
+        if step is None or (storyline_id is not None and step.storyline_id != storyline_id):
+            return None
+        storyline_id, story_id = step.storyline_id, step.story_id
+
+    graded = grade_submission(story_id, answers, durations=durations, attempts=attempts)
+    UpdateProgress(story_id, graded, storyline_id=storyline_id,
+                   storyline_step_id=storyline_step_id, student_id=student_id)
+
+    return {
+        "storyline_id": storyline_id,
+        "storyline_step_id": storyline_step_id,
+        "score": submission_score(graded),
+        "questions": [
+            {"question_id": item["question_id"], "answer": item["answer"], "correct": item["correct"], "score": item["score"]}
+            for item in graded
+        ],
+    }
@@ -3,13 +3,24 @@ import random
 import markdown
 import logging
 from typing import List, Dict, Tuple, Optional # Added Optional
-from fastapi import APIRouter, Form, HTTPException, Request, Query # Added Query
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi import APIRouter, BackgroundTasks, Form, HTTPException, Request, Query # Added Query
+from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel
 from sqlalchemy.orm import joinedload
 
 from src.orm import SessionLocal, Storyline, StorylineStep, Story, Question, db_session, func
-from .progress import StorylineProgress
+from src.cache import fragment_cache
+from src.grading import normalize_answer
+from src.metrics import instrument_templates
+from src.lazy_steps import has_pending_steps, schedule_upcoming_steps
+from src.retention import recent_progress_since
+from src.spaced_repetition import scheduler
+from src.warm_pool import POOL_STATUSES, claim_pooled_storyline, pool_request_words, refill_bucket
+from .progress import GradeAndSaveProgress, StorylineProgress
+from .audio import get_storyline_audio_segments, iter_audio_range, parse_range_header
+from .api import router as api_router
+from .batch import create_storyline_batch, get_batch_progress
 from src.utils import (
     GENRES,
     LOCATIONS,
@@ -23,27 +34,38 @@ logger = logging.getLogger(name=__file__)
 logger.setLevel(logging.DEBUG)
 
 # Initialize Jinja2 templates - Consider defining this centrally and importing/passing
-templates = Jinja2Templates(directory="src/storyline/templates")
+templates = instrument_templates(Jinja2Templates(directory="src/storyline/templates"))
 
 router = APIRouter()
+router.include_router(api_router) # Read-only JSON API under /api
 
 # === Helper Functions Moved from assignments.py ===
 
 def get_all_storylines() -> List[Dict]:
     """
-    Return all storylines from the database with their status
+    Return all storylines from the database with their status, leaving out
+    pool storylines nobody has claimed yet
     """
     with db_session() as session:
-        storylines = session.query(Storyline).all()
+        # Count the steps in the same query instead of loading them per storyline
+        storylines = (
+            session.query(Storyline.storyline_id, Storyline.original_request, Storyline.status,
+                          func.count(StorylineStep.storyline_step_id))
+            .outerjoin(StorylineStep, StorylineStep.storyline_id == Storyline.storyline_id)
+            .filter(Storyline.status.notin_(POOL_STATUSES))
+            .group_by(Storyline.storyline_id, Storyline.original_request, Storyline.status)
+            .order_by(Storyline.storyline_id)
+            .all()
+        )
 
-        # Convert Storyline objects to dictionaries
+        # Convert Storyline rows to dictionaries
         storyline_list = []
-        for storyline in storylines:
+        for storyline_id, original_request, status, step_count in storylines:
             storyline_dict = {
-                "storyline_id": storyline.storyline_id,
-                "original_request": storyline.original_request,
-                "status": storyline.status,
-                "step_count": len(storyline.steps) if storyline.steps else 0
+                "storyline_id": storyline_id,
+                "original_request": original_request,
+                "status": status,
+                "step_count": step_count
             }
             storyline_list.append(storyline_dict)
 
@@ -75,17 +97,47 @@ def get_storyline_step_details(storyline_step_id: int) -> Tuple[int, str, List[Q
         # Convert Question ORM objects to QuestionViewModel
         question_list = [
             QuestionViewModel(
+                id=q.id,
                 type=q.type,
                 question=q.question,
                 key=q.key,
                 correct=q.correct,
-                answers=(q.answers or '').split(',') if q.answers else [] # Ensure answers is a list
+                answers=q.answer_list
             ) for q in questions
         ]
 
     return story_id, story_content, question_list
 
 
+def due_review_questions(session, student_id: int, count: int) -> List[Question]:
+    """
+    Questions for the student's `count` words due for review soonest, one per
+    word, in due order.
+    """
+    due = scheduler.next_due_words(student_id, count)
+    if not due:
+        return []
+
+    # Mastery words went through normalize_answer, which SQL can't reproduce
+    # (it also collapses inner whitespace), so match on the Python side
+    wanted = {(d["classroom"], d["word"]) for d in due}
+    by_word = {}
+    candidates = (
+        session.query(Question.id, Question.classroom, Question.correct)
+        .filter(Question.classroom.in_({d["classroom"] for d in due}))
+        .order_by(Question.id)
+        .all()
+    )
+    for question_id, classroom, correct in candidates:
+        key = (classroom, normalize_answer(correct))
+        if key in wanted:
+            by_word.setdefault(key, question_id)
+
+    questions = session.query(Question).filter(Question.id.in_(by_word.values())).all()
+    by_id = {q.id: q for q in questions}
+    return [by_id[by_word[(d["classroom"], d["word"])]] for d in due if (d["classroom"], d["word"]) in by_word]
+
+
 # === Routes Moved from assignments.py ===
 
 @router.get("/storylines", response_class=HTMLResponse)
@@ -93,29 +145,40 @@ async def storyline_dashboard(request: Request):
     """
         View the Storyline Dashboard
     """
-    storylines = get_all_storylines()
+    storyline_table = fragment_cache.get_or_render(
+        "storylines", "all",
+        lambda: templates.get_template("_storyline_table.html").render(storylines=get_all_storylines())
+    )
     return templates.TemplateResponse("storylines.html", {
         "request": request,
-        "storylines": storylines
+        "storyline_table": storyline_table
     })
 
 @router.post("/storylines")
 async def create_storyline(
+    background_tasks: BackgroundTasks,
     selected_questions: list[int] = Form([]), # Changed from trick_words to selected_questions (list of IDs)
     genres = Form(None),
     locations = Form(None),
     styles = Form(None),
     interests: list[str] = Form([]),
     gen_ttl: bool = Form(True), # Assuming gen_ttl was meant to be used somewhere, keeping it for now
-    friends: list[str] = Form([])
+    friends: list[str] = Form([]),
+    student_id: Optional[int] = Form(None), # Student the storyline is for
+    due_words: int = Form(0) # Also practise the student's next N words due for review
 ):
     """
-        Create a new Storyline
+        Create a new Storyline, or hand out a pre-generated one from the warm
+        pool when the words, genre and style match
     """
+    if due_words and student_id is None:
+        raise HTTPException(status_code=400, detail="due_words requires a student_id.")
+
     # Fetch Question objects based on selected IDs
-    question_list = []
-    if selected_questions:
-        with db_session() as db:
+    serialized_questions = []
+    with db_session() as db:
+        question_list = []
+        if selected_questions:
             try:
                 # Query questions matching the selected IDs
                 question_list = db.query(Question).filter(Question.id.in_(selected_questions)).all()
@@ -124,25 +187,42 @@ async def create_storyline(
                      # Optionally raise an error or handle partially found questions
             except Exception as e:
                  raise HTTPException(status_code=500, detail=f"Error fetching selected questions: {str(e)}")
-    else:
-        # Handle case where no questions are selected (optional: maybe default to random?)
-        # For now, we proceed with an empty list if none are selected.
-        logger.info("No questions selected for the new storyline.")
 
-    # Create JSON data package
-    # Convert Question objects to serializable format if needed
-    # Convert fetched Question objects to serializable format for storing in original_request
-    serialized_questions = []
-    for q in question_list:
-        serialized_questions.append({
-            "id": q.id,
-            "type": q.type,
-            "question": q.question,
-            "key": q.key,
-            "correct": q.correct,
-            "answers": q.answers.split(',') if q.answers else None,
-            "classroom": q.classroom # Include classroom for context if needed
-        })
+        if due_words:
+            selected_ids = {q.id for q in question_list}
+            question_list += [
+                q for q in due_review_questions(db, student_id, due_words)
+                if q.id not in selected_ids
+            ]
+
+        if not question_list:
+            # Handle case where no questions are selected (optional: maybe default to random?)
+            # For now, we proceed with an empty list if none are selected.
+            logger.info("No questions selected for the new storyline.")
+
+        # Create JSON data package
+        # Convert fetched Question objects to serializable format for storing in original_request
+        # (inside the session, the objects expire once it commits)
+        for q in question_list:
+            serialized_questions.append({
+                "id": q.id,
+                "type": q.type,
+                "question": q.question,
+                "key": q.key,
+                "correct": q.correct,
+                "answers": q.answer_list or None,
+                "classroom": q.classroom # Include classroom for context if needed
+            })
+
+    # The pool's storylines have a random location, interests and friend
+    pool_words = None if (locations or interests or friends) else pool_request_words(serialized_questions)
+    if pool_words:
+        claimed = claim_pooled_storyline(*pool_words, student_id=student_id, genre=genres, style=styles)
+        if claimed:
+            logger.info(f"Handed out pooled storyline {claimed['storyline_id']} for {claimed['classroom']}")
+            background_tasks.add_task(refill_bucket, claimed["classroom"], claimed["words"], claimed["genre"], claimed["style"])
+            fragment_cache.invalidate("storylines")
+            return RedirectResponse(url="/storylines", status_code=303)
 
     storyline_data = {
         "question_list": serialized_questions,
@@ -157,11 +237,13 @@ async def create_storyline(
     try:
         storyline = Storyline(
             original_request=json.dumps(storyline_data),
-            status="pending"
+            status="pending",
+            assigned_to=student_id
         )
         db.add(storyline)
         db.commit()
         db.refresh(storyline) # Refresh to get the generated ID if needed later
+        fragment_cache.invalidate("storylines")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -171,20 +253,68 @@ async def create_storyline(
     # Redirect to the storyline dashboard after creation
     return RedirectResponse(url="/storylines", status_code=303) # Use router.url_path_for('storyline_dashboard') ideally
 
+class BulkStorylineRequest(BaseModel):
+    classroom: str
+    student_ids: list[int]
+    words: Optional[list[str]] = None # Defaults to the classroom's question words
+    priority: int = 1
+
+@router.post("/storylines/bulk", status_code=202)
+async def create_storylines_bulk(bulk_request: BulkStorylineRequest):
+    """
+        Create a personalized Storyline for every listed student in one go
+    """
+    if not bulk_request.student_ids:
+        raise HTTPException(status_code=400, detail="student_ids must not be empty.")
+
+    try:
+        batch = create_storyline_batch(
+            bulk_request.classroom,
+            bulk_request.student_ids,
+            words=bulk_request.words,
+            priority=bulk_request.priority
+        )
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    fragment_cache.invalidate("storylines")
+    return {
+        **batch,
+        "status_url": f"/storylines/batches/{batch['batch_id']}"
+    }
+
+@router.get("/storylines/batches/{batch_id}")
+async def storyline_batch_status(batch_id: str):
+    """
+        Poll the generation progress of a bulk storyline batch
+    """
+    progress = get_batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found.")
+    return progress
+
 @router.get("/storylines/create", response_class=HTMLResponse) # Removed path parameter
 async def storyline_form(request: Request, classroom_name: Optional[str] = Query(None)): # Changed to query parameter 'classroom_name'
     """
         Create Storylines Form
     """
-    questions = []
-    if classroom_name: # Check if classroom_name is provided
+    def render_question_options():
+        questions = []
         with db_session() as db: # Added database session
             # Fetch questions for the specified classroom name
             questions = db.query(Question).filter(Question.classroom == classroom_name).all() # Use classroom_name in query
+            # Render while the session is open so the rows are still loaded
+            return templates.get_template("_question_options.html").render(questions=questions)
+
+    if classroom_name: # Check if classroom_name is provided
+        question_options = fragment_cache.get_or_render("classroom_questions", classroom_name, render_question_options)
     else:
         # Handle case where classroom_name is not provided (optional: show all questions or an error/message)
         logger.info("No classroom_name provided, showing form without specific questions.")
         # You might want to pass a message to the template here
+        question_options = templates.get_template("_question_options.html").render(questions=[])
 
     return templates.TemplateResponse("create_storyline.html", {
         "request": request,
@@ -193,7 +323,7 @@ async def storyline_form(request: Request, classroom_name: Optional[str] = Query
         "styles": STYLES,
         "interests": INTERESTS,
         "friends": FRIENDS,
-        "questions": questions, # Pass questions to the template
+        "question_options": question_options, # Pre-rendered (and cached) question list
         "classroom_name": classroom_name # Pass classroom_name instead of classroom_id
     })
 
@@ -202,9 +332,10 @@ async def view_storyline_step(request: Request, storyline_id: int, storyline_ste
     """
     Display a specific step (page) within a storyline, including its story and questions.
     Fetches and includes the latest progress for each story within the storyline.
+    Lazily generated storylines get their next steps written while this one is read.
     """
     # Fetch the latest progress for each story in this storyline
-    storyline_progress = StorylineProgress(storyline_id=storyline_id)
+    storyline_progress = StorylineProgress(storyline_id=storyline_id, since=recent_progress_since())
 
     try:
         # Unpack story_id, story_content, questions
@@ -216,6 +347,9 @@ async def view_storyline_step(request: Request, storyline_id: int, storyline_ste
          logger.error(f"Error fetching storyline step details for step {storyline_step_id}: {e}")
          raise HTTPException(status_code=500, detail="Internal server error fetching storyline step.")
 
+    if has_pending_steps(storyline_id):
+        schedule_upcoming_steps(storyline_id, storyline_step_id)
+
     return templates.TemplateResponse('classroom.html', {
         "request": request,
         "storyline_id": storyline_id,
@@ -224,4 +358,103 @@ async def view_storyline_step(request: Request, storyline_id: int, storyline_ste
         "story": markdown.markdown(story_content),
         "questions": questions,
         "storyline_progress": storyline_progress # Pass the fetched progress
-    })
\ No newline at end of file
+    })
+
+def parse_submission_form(form_data) -> Tuple[Dict[int, str], Dict[int, int], Dict[int, int]]:
+    """
+    Read the `question_<id>`, `duration_<id>` and `attempts_<id>` fields
+    classroom.html posts for each question into dictionaries keyed by
+    question ID. Durations and attempts left blank are skipped.
+    """
+    fields = {"question": {}, "duration": {}, "attempts": {}}
+    for key, value in form_data.items():
+        prefix, _, question_id = key.partition("_")
+        if prefix not in fields or not question_id.isdigit():
+            continue
+        if prefix != "question" and not str(value).strip():
+            continue
+        if prefix == "question":
+            fields[prefix][int(question_id)] = value
+        else:
+            try:
+                fields[prefix][int(question_id)] = int(float(value))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"{key} must be a number.")
+    return fields["question"], fields["duration"], fields["attempts"]
+
+@router.post("/storyline/{storyline_id}/page/{storyline_step_id}/submit")
+async def submit_storyline_step(request: Request, storyline_id: int, storyline_step_id: int):
+    """
+    Grade the answers for a storyline step and record the student's progress
+    """
+    form_data = await request.form()
+    answers, durations, attempts = parse_submission_form(form_data)
+    if not answers:
+        # Never grade a form whose field names we don't understand as all wrong
+        raise HTTPException(status_code=400, detail="No answers submitted; expected question_<id> fields.")
+
+    student_id = form_data.get("student_id")
+    if student_id is not None and not str(student_id).isdigit():
+        raise HTTPException(status_code=400, detail="student_id must be an integer.")
+
+    result = GradeAndSaveProgress(
+        storyline_step_id,
+        answers,
+        durations=durations,
+        attempts=attempts,
+        student_id=int(student_id) if student_id is not None else None,
+        storyline_id=storyline_id
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Storyline step {storyline_step_id} not found in storyline {storyline_id}.")
+    return result
+
+@router.get("/storyline/{storyline_id}/audio/segments")
+def storyline_audio_segments(storyline_id: int):
+    """
+    Byte offsets of each step's clip within the storyline audio stream, so the
+    player can seek straight to a paragraph.
+    """
+    segments = get_storyline_audio_segments(storyline_id)
+    return [segment.to_dict() for segment in segments]
+
+@router.get("/storyline/{storyline_id}/audio")
+def stream_storyline_audio(request: Request, storyline_id: int):
+    """
+    Stream every paragraph clip of a storyline as one audio file.
+    Honours `Range` headers so playback can start and seek without
+    downloading the whole storyline.
+    """
+    segments = get_storyline_audio_segments(storyline_id)
+    if not segments:
+        raise HTTPException(status_code=404, detail=f"No audio found for storyline {storyline_id}.")
+
+    total_size = segments[-1].end + 1
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",
+    }
+
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), total_size)
+    except ValueError:
+        return Response(
+            status_code=416,
+            headers={**headers, "Content-Range": f"bytes */{total_size}"}
+        )
+
+    if byte_range is None:
+        start, end = 0, total_size - 1
+        status_code = 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total_size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_audio_range(segments, start, end),
+        status_code=status_code,
+        media_type="audio/mpeg",
+        headers=headers
+    )
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+# OpenTelemetry is optional; when present spans are mirrored into it
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
+class Span:
+    """
+    A timed stage of work. Attributes follow OpenTelemetry naming so traces
+    can be exported as-is.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        # Finished spans of the whole trace, only kept on the root span
+        self.finished: List["Span"] = []
+        self._otel_span = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1_000_000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def add(self, key: str, amount: float = 1) -> None:
+        """
+        Increment a numeric attribute, e.g. retries or bytes uploaded.
+        """
+        self.set_attribute(key, self.attributes.get(key, 0) + amount)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class ConsoleExporter:
+    """
+    Print a finished trace as an indented tree with durations.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def export(self, spans: List[Span]) -> None:
+        depth = {}
+        for finished in sorted(spans, key=lambda s: s.start_ns):
+            level = depth[finished.parent.span_id] + 1 if finished.parent and finished.parent.span_id in depth else 0
+            depth[finished.span_id] = level
+            attributes = " ".join(f"{k}={v}" for k, v in finished.attributes.items())
+            status = "" if finished.status == "OK" else f" [{finished.status}]"
+            print(f"{'  ' * level}{finished.name} {finished.duration_ms:.1f}ms{status} {attributes}".rstrip(), file=self.stream)
+
+
+class JSONFileExporter:
+    """
+    Append each finished trace as one JSON line of span dictionaries.
+    """
+
+    def __init__(self, path: str = "traces.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps([s.to_dict() for s in sorted(spans, key=lambda s: s.start_ns)], default=str)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    """
+    Mirror spans into the configured OpenTelemetry tracer provider, so any
+    OTLP exporter set up there receives them.
+    """
+
+    def __init__(self):
+        if otel_trace is None:
+            raise RuntimeError("opentelemetry-api is not installed")
+        self.tracer = otel_trace.get_tracer("snow_day")
+
+    def export(self, spans: List[Span]) -> None:
+        # Spans were already streamed to OpenTelemetry as they ran
+        pass
+
+
+_exporter = None
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def configure_tracing(target: Optional[str]) -> None:
+    """
+    Select where finished traces go: "console", "json" (or "json:path.jsonl"),
+    "otel", or None to keep traces in memory only.
+    """
+    global _exporter
+    if not target:
+        _exporter = None
+    elif target == "console":
+        _exporter = ConsoleExporter()
+    elif target.startswith("json"):
+        _, _, path = target.partition(":")
+        _exporter = JSONFileExporter(path or "traces.jsonl")
+    elif target == "otel":
+        _exporter = OpenTelemetryExporter()
+    else:
+        raise ValueError(f"Unknown trace exporter: {target}")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block of work as a child of the current span (or as a new trace).
+
+    Usage:
+        with span("llm.story", model="gpt-4o-mini") as s:
+            ...
+            s.add("retries")
+    """
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent else secrets.token_hex(16)
+    new_span = Span(name, trace_id, parent=parent, attributes=attributes)
+
+    otel_context = None
+    if isinstance(_exporter, OpenTelemetryExporter):
+        otel_context = _exporter.tracer.start_as_current_span(name, attributes=attributes)
+        new_span._otel_span = otel_context.__enter__()
+
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "ERROR"
+        new_span.set_attribute("error", repr(e))
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if otel_context is not None:
+            otel_context.__exit__(None, None, None)
+
+        root = new_span
+        while root.parent is not None:
+            root = root.parent
+        root.finished.append(new_span)
+
+        if new_span.parent is None and _exporter is not None:
+            try:
+                _exporter.export(root.finished)
+            except Exception as e:
+                logger.error(f"Failed to export trace {trace_id}: {e}")
+
+
+def record_token_usage(target: Span, message: Any) -> None:
+    """
+    Copy token counts from a LangChain chat response onto a span.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    if not usage:
+        token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        usage = {
+            "input_tokens": token_usage.get("prompt_tokens", 0),
+            "output_tokens": token_usage.get("completion_tokens", 0),
+        }
+    input_tokens = usage.get("input_tokens", 0) or 0
+    output_tokens = usage.get("output_tokens", 0) or 0
+    target.add("llm.input_tokens", input_tokens)
+    target.add("llm.output_tokens", output_tokens)
+
+    # Keep a running total on the root span of the trace
+    root = target
+    while root.parent is not None:
+        root = root.parent
+    if root is not target:
+        root.add("llm.input_tokens", input_tokens)
+        root.add("llm.output_tokens", output_tokens)
+
+
+configure_tracing(os.getenv("SNOWDAY_TRACE"))
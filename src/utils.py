@@ -4,30 +4,54 @@ import string
 import requests
 import re
 import logging
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Optional, Tuple, Set
 
 from langchain_openai import ChatOpenAI
 from langchain.schema import AIMessage, HumanMessage
 
 from .orm import db_session
+from .fakes import FakeChatModel, fake_backend_enabled, fake_tts
 
 logger = logging.getLogger(name=__file__)
 logger.setLevel(logging.DEBUG)
 
+
+class UnavailableChatModel:
+    """
+    Takes the place of a chat model that could not be created, e.g. without
+    OPENAI_API_KEY, so importing still works but the first call fails with
+    the original error. The offline fake is only used when asked for with
+    SNOWDAY_FAKE_BACKENDS.
+    """
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def __call__(self, messages):
+        raise RuntimeError(f"ChatOpenAI could not be initialized: {self.error}") from self.error
+
+    def invoke(self, messages):
+        return self(messages)
+
+
+def create_llm():
+    if fake_backend_enabled("llm"):
+        return FakeChatModel()
+    try:
+        return ChatOpenAI(model="gpt-4o-mini", temperature=1)
+    except Exception as e:
+        logger.warning(f"Could not initialize ChatOpenAI: {e}")
+        return UnavailableChatModel(e)
+
+
 # Initialize the LLM
-try:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=1)
-except Exception as e:
-    print(f"Warning: Could not initialize ChatOpenAI: {e}")
-    # Create a dummy LLM for testing
-    class DummyLLM:
-        def __call__(self, messages):
-            class DummyResponse:
-                content = "This is a dummy response for testing."
-            return DummyResponse()
-    llm = DummyLLM()
+llm = create_llm()
 
 def generate_tts(audio_text, output_filename, output_dir="./media"):
+    if fake_backend_enabled("tts"):
+        fake_tts(audio_text, output_filename, output_dir=output_dir)
+        return
+
     # Set up your API key and endpoint
     api_key = os.getenv("OPENAI_API_KEY")  # Pull the API key from the environment variable
     if not api_key:
@@ -221,8 +245,10 @@ class QuestionViewModel:
     key: str
     correct: str
     answers: List[str]
+    id: Optional[int]
 
-    def __init__(self, type: str, question: str, key: str, correct: str, answers: List[str] = None):
+    def __init__(self, type: str, question: str, key: str, correct: str, answers: List[str] = None, id: Optional[int] = None):
+        self.id = id
         self.type = type
         self.question = question
         self.key = key
@@ -0,0 +1,119 @@
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.cache import fragment_cache
+from src.metrics import register_cache
+from src.orm import Question
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+QUESTION_PROMPT = "What word best fits in this story?"
+
+
+class VocabularyBank:
+    """
+    Shared `select` questions, one per (word, classroom).
+
+    Stories that practise a word the bank already knows link to the existing
+    question instead of creating a new row and asking the LLM for fresh
+    distractors. Lookups go through an in-process cache first, then the
+    question table, and only generate on a miss.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # (word, classroom) -> (question ID, answers)
+        self._entries: Dict[Tuple[str, str], Tuple[int, List[str]]] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_or_create_question(self, session, word: str, classroom: str, key: str,
+                               generate_answers: Callable[[], List[str]]) -> Question:
+        """
+        Return the bank's question for `word` in `classroom`, creating it if needed.
+
+        Args:
+            session: Session the question is loaded into or added to
+            word: The correct answer
+            classroom: Classroom (or `vocab_<id>`) the question belongs to
+            key: Key for a newly created question
+            generate_answers: Called on a miss to build the answer options
+
+        Returns:
+            The Question, flushed so it has an ID
+        """
+        bank_key = (word, classroom)
+        # Serialise work on the same word so concurrent stories don't both generate it
+        with self._key_lock(bank_key):
+            entry = self._entries.get(bank_key)
+            if entry is not None:
+                question = session.get(Question, entry[0])
+                # Deleted questions' IDs can be reused by unrelated rows
+                if question is not None and (question.type, question.correct, question.classroom) == ('select', word, classroom):
+                    self.hits += 1
+                    return question
+                if question is not None:
+                    logger.warning(f"Vocabulary bank entry for '{word}' ({classroom}) pointed at question {entry[0]}, which is now another question")
+                    self._entries.pop(bank_key, None)
+                    entry = None
+
+            question = (
+                session.query(Question)
+                .filter(Question.type == 'select', Question.correct == word, Question.classroom == classroom)
+                .order_by(Question.id)
+                .first()
+            )
+            if question is not None:
+                self.hits += 1
+                self._entries[bank_key] = (question.id, question.answer_list)
+                return question
+
+            self.misses += 1
+            # The cached answers survive even if the row itself is not visible yet
+            # (created by another, still open transaction) or was deleted
+            answers = entry[1] if entry is not None else generate_answers()
+            question = Question(
+                type='select',
+                question=QUESTION_PROMPT,
+                key=key,
+                correct=word,
+                answer_list=answers,
+                classroom=classroom,
+            )
+            session.add(question)
+            session.flush()
+            fragment_cache.invalidate("classroom_questions", classroom, session=session)
+            self._entries[bank_key] = (question.id, answers)
+            logger.info(f"Added '{word}' ({classroom}) to the vocabulary bank as question {question.id}")
+            return question
+
+    def forget(self, word: Optional[str] = None, classroom: Optional[str] = None) -> None:
+        """
+        Drop cached entries, e.g. after questions were deleted.
+        """
+        with self._lock:
+            for bank_key in list(self._entries):
+                if (word is None or bank_key[0] == word) and (classroom is None or bank_key[1] == classroom):
+                    del self._entries[bank_key]
+
+    def forget_questions(self, question_ids: Iterable[int]) -> None:
+        """
+        Drop the entries of deleted questions. Other processes find out on
+        their next hit, which checks the row still matches its word.
+        """
+        question_ids = set(question_ids)
+        with self._lock:
+            for bank_key, (question_id, _) in list(self._entries.items()):
+                if question_id in question_ids:
+                    del self._entries[bank_key]
+
+
+vocabulary_bank = VocabularyBank()
+register_cache("vocab_bank", lambda: (vocabulary_bank.hits, vocabulary_bank.misses))
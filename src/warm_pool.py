@@ -0,0 +1,337 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import yaml
+from sqlalchemy import and_, func, or_, update
+
+from src.metrics import register_cache
+from src.orm import Story, Storyline, StorylinePoolEntry, db_session
+from src.utils import FRIENDS, GENRES, INTERESTS, LOCATIONS, STYLES
+
+logger = logging.getLogger(name=__file__)
+logger.setLevel(logging.DEBUG)
+
+CLASSROOM_WORDS_PATH = os.getenv("WARM_POOL_WORDS_PATH", "data/classroom_words.yaml")
+# Ready storylines kept per (classroom word list, genre, style) bucket
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))
+# Unclaimed storylines are thrown away after this long
+WARM_POOL_TTL_HOURS = float(os.getenv("WARM_POOL_TTL_HOURS", "72"))
+# Comma separated genres/styles to stock, every known one by default
+WARM_POOL_GENRES = os.getenv("WARM_POOL_GENRES", "")
+WARM_POOL_STYLES = os.getenv("WARM_POOL_STYLES", "")
+
+# Storyline statuses of pool storylines, from creation until claimed. They
+# keep them out of listings and out of the sweeps over "pending" storylines.
+POOL_PENDING_STATUS = "pool_pending"
+POOLED_STATUS = "pooled"
+POOL_STATUSES = (POOL_PENDING_STATUS, POOLED_STATUS)
+GENERATING = "generating"
+READY = "ready"
+CLAIMED = "claimed"
+EXPIRED = "expired"
+
+# Ready entries tried per claim before giving up on losing races
+CLAIM_CANDIDATES = 5
+
+pool_stats = {"hits": 0, "misses": 0}
+register_cache("storyline_pool", lambda: (pool_stats["hits"], pool_stats["misses"]))
+
+Bucket = Tuple[str, str]  # (genre, style)
+
+
+def normalize_words(words: Iterable[str]) -> List[str]:
+    return sorted({word.strip().lower() for word in words if word and word.strip()})
+
+
+def words_key(words: Iterable[str]) -> str:
+    """
+    Order- and case-insensitive key of a word list.
+    """
+    return hashlib.sha1("\n".join(normalize_words(words)).encode()).hexdigest()
+
+
+def load_classroom_words(path: str = CLASSROOM_WORDS_PATH) -> Dict[str, List[str]]:
+    """
+    Classroom name -> word list, from the same YAML file the classroom
+    questions are generated from.
+    """
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected {path} to map classroom names to word lists")
+    return {
+        classroom: normalize_words(w for w in words if isinstance(w, str))
+        for classroom, words in data.items()
+        if isinstance(words, list)
+    }
+
+
+def pool_buckets(genres: Optional[Sequence[str]] = None, styles: Optional[Sequence[str]] = None) -> List[Bucket]:
+    """
+    Every (genre, style) pair to stock, from the arguments, the environment or
+    all known genres and styles, in that order.
+    """
+    genres = genres or [g.strip() for g in WARM_POOL_GENRES.split(",") if g.strip()] or GENRES
+    styles = styles or [s.strip() for s in WARM_POOL_STYLES.split(",") if s.strip()] or STYLES
+    return [(genre, style) for genre in genres for style in styles]
+
+
+def pooled_storyline_request(classroom: str, words: List[str], genre: str, style: str) -> Dict[str, Any]:
+    """
+    Build the `original_request` payload `generate_story` expects for a
+    storyline that is not written for anyone in particular yet.
+    """
+    return {
+        "words": words,
+        "vocab_id": None,
+        "classroom": classroom,
+        "genre": genre,
+        "location": random.choice(LOCATIONS),
+        "style": style,
+        "selected_interests": random.sample(INTERESTS, 2),
+        "friend": random.choice(FRIENDS),
+        "pool": True,
+    }
+
+
+def stock_bucket(session, classroom: str, words: List[str], genre: str, style: str,
+                 size: int = WARM_POOL_SIZE, now: Optional[datetime.datetime] = None) -> List[int]:
+    """
+    Create the pending storylines a bucket is short of, in the caller's transaction.
+
+    Returns:
+        The IDs of the storylines to generate
+    """
+    now = now or datetime.datetime.utcnow()
+    words = normalize_words(words)
+    key = words_key(words)
+    stocked = (
+        session.query(func.count(StorylinePoolEntry.id))
+        .filter(
+            StorylinePoolEntry.classroom == classroom,
+            StorylinePoolEntry.words_key == key,
+            StorylinePoolEntry.genre == genre,
+            StorylinePoolEntry.style == style,
+            or_(
+                StorylinePoolEntry.status == GENERATING,
+                and_(StorylinePoolEntry.status == READY, StorylinePoolEntry.expires_at > now),
+            ),
+        )
+        .scalar()
+    )
+    if stocked >= size:
+        return []
+
+    entries = [
+        StorylinePoolEntry(
+            storyline=Storyline(
+                original_request=json.dumps(pooled_storyline_request(classroom, words, genre, style)),
+                status=POOL_PENDING_STATUS,
+            ),
+            classroom=classroom,
+            words_key=key,
+            words=words,
+            genre=genre,
+            style=style,
+            status=GENERATING,
+        )
+        for _ in range(size - stocked)
+    ]
+    session.add_all(entries)
+    session.flush()
+    return [entry.storyline_id for entry in entries]
+
+
+def delete_pooled_storyline(session, entry: StorylinePoolEntry) -> None:
+    """
+    Remove an unclaimed pool entry with its storyline, steps and stories.
+    """
+    storyline = entry.storyline
+    story_ids = [step.story_id for step in storyline.steps]
+    session.delete(entry)
+    session.delete(storyline)
+    session.flush()
+    for story in session.query(Story).filter(Story.id.in_(story_ids)):
+        session.delete(story)
+
+
+def generate_pool_entries(storyline_ids: List[int], ttl_hours: float = WARM_POOL_TTL_HOURS, max_workers: int = 4) -> int:
+    """
+    Generate stocked storylines and put the finished ones up for claiming;
+    failed ones are dropped so the next refill tries again.
+
+    Returns:
+        The number of storylines made ready
+    """
+    if not storyline_ids:
+        return 0
+
+    # The generator pulls in the LLM client, only load it once there is work
+    from generators.stories import generate_classroom_stories
+
+    generate_classroom_stories(storyline_ids, max_workers=max_workers)
+
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=ttl_hours)
+    ready = 0
+    with db_session() as session:
+        entries = session.query(StorylinePoolEntry).filter(StorylinePoolEntry.storyline_id.in_(storyline_ids)).all()
+        for entry in entries:
+            # Generation moves a pool storyline straight to POOLED_STATUS
+            if entry.storyline.status == POOLED_STATUS and entry.storyline.steps:
+                entry.status = READY
+                entry.expires_at = expires_at
+                ready += 1
+            else:
+                delete_pooled_storyline(session, entry)
+    logger.info(f"Made {ready} of {len(storyline_ids)} pooled storylines ready")
+    return ready
+
+
+def refill_bucket(classroom: str, words: List[str], genre: str, style: str, size: int = WARM_POOL_SIZE,
+                  ttl_hours: float = WARM_POOL_TTL_HOURS, max_workers: int = 4) -> int:
+    """
+    Top one bucket back up, e.g. in the background after a claim.
+
+    Returns:
+        The number of storylines made ready
+    """
+    with db_session() as session:
+        storyline_ids = stock_bucket(session, classroom, words, genre, style, size)
+    return generate_pool_entries(storyline_ids, ttl_hours, max_workers)
+
+
+def expire_pool(now: Optional[datetime.datetime] = None, ttl_hours: float = WARM_POOL_TTL_HOURS) -> int:
+    """
+    Delete ready storylines past their expiry, and generations that never
+    finished within the TTL.
+
+    Returns:
+        The number of entries removed
+    """
+    now = now or datetime.datetime.utcnow()
+    with db_session() as session:
+        # Conditional on READY, so an entry claimed meanwhile is left alone
+        session.execute(
+            update(StorylinePoolEntry)
+            .where(StorylinePoolEntry.status == READY, StorylinePoolEntry.expires_at <= now)
+            .values(status=EXPIRED)
+        )
+        entries = (
+            session.query(StorylinePoolEntry)
+            .filter(or_(
+                StorylinePoolEntry.status == EXPIRED,
+                and_(
+                    StorylinePoolEntry.status == GENERATING,
+                    StorylinePoolEntry.created_at < now - datetime.timedelta(hours=ttl_hours),
+                ),
+            ))
+            .all()
+        )
+        for entry in entries:
+            delete_pooled_storyline(session, entry)
+    if entries:
+        logger.info(f"Expired {len(entries)} pooled storylines")
+    return len(entries)
+
+
+def refill_pool(classroom_words: Dict[str, List[str]], size: int = WARM_POOL_SIZE, ttl_hours: float = WARM_POOL_TTL_HOURS,
+                buckets: Optional[List[Bucket]] = None, max_workers: int = 4) -> Dict[str, Any]:
+    """
+    The periodic refill job: drop expired storylines, then generate what every
+    bucket is short of. All buckets are generated together, so stories over
+    the same word list share distractors and a warm prompt cache.
+
+    Args:
+        classroom_words: Classroom name -> word list to stock
+        size: Ready storylines to keep per bucket
+        ttl_hours: How long a ready storyline can wait to be claimed
+        buckets: (genre, style) pairs to stock, see `pool_buckets`
+        max_workers: Concurrent generations
+
+    Returns:
+        The number of entries expired, stocked and made ready
+    """
+    buckets = buckets or pool_buckets()
+    expired = expire_pool(ttl_hours=ttl_hours)
+
+    storyline_ids = []
+    with db_session() as session:
+        for classroom, words in classroom_words.items():
+            for genre, style in buckets:
+                storyline_ids += stock_bucket(session, classroom, words, genre, style, size)
+
+    ready = generate_pool_entries(storyline_ids, ttl_hours, max_workers)
+    return {"expired": expired, "stocked": len(storyline_ids), "ready": ready}
+
+
+def pool_request_words(questions: List[Dict[str, Any]]) -> Optional[Tuple[str, List[str]]]:
+    """
+    The (classroom, words) a storyline request could be served from the pool
+    for: its questions have to come from a single classroom.
+    """
+    classrooms = {q.get("classroom") for q in questions}
+    if not questions or len(classrooms) != 1 or None in classrooms:
+        return None
+    return classrooms.pop(), normalize_words(q["correct"] for q in questions)
+
+
+def claim_pooled_storyline(classroom: str, words: List[str], student_id: Optional[int] = None,
+                           genre: Optional[str] = None, style: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Hand out the oldest ready storyline of a matching bucket.
+
+    Args:
+        classroom: Classroom the words come from
+        words: The requested word list, has to match the pooled one exactly
+        student_id: Student the storyline is assigned to
+        genre: Only this genre, any when None
+        style: Only this style, any when None
+
+    Returns:
+        The claimed storyline's ID, classroom, words, genre and style, or None
+        when the pool has nothing that matches
+    """
+    now = datetime.datetime.utcnow()
+    with db_session() as session:
+        # A pool storyline that was reset meanwhile has nothing to read
+        query = session.query(StorylinePoolEntry.id).join(Storyline).filter(
+            StorylinePoolEntry.classroom == classroom,
+            StorylinePoolEntry.words_key == words_key(words),
+            StorylinePoolEntry.status == READY,
+            StorylinePoolEntry.expires_at > now,
+            Storyline.status == POOLED_STATUS,
+        )
+        if genre:
+            query = query.filter(StorylinePoolEntry.genre == genre)
+        if style:
+            query = query.filter(StorylinePoolEntry.style == style)
+        candidates = [row[0] for row in query.order_by(StorylinePoolEntry.created_at, StorylinePoolEntry.id).limit(CLAIM_CANDIDATES)]
+
+        for entry_id in candidates:
+            # Only one request can move an entry out of READY
+            claimed = session.execute(
+                update(StorylinePoolEntry)
+                .where(StorylinePoolEntry.id == entry_id, StorylinePoolEntry.status == READY)
+                .values(status=CLAIMED, claimed_at=now)
+            )
+            if claimed.rowcount != 1:
+                continue
+            entry = session.get(StorylinePoolEntry, entry_id)
+            entry.storyline.status = "completed"
+            entry.storyline.assigned_to = student_id
+            pool_stats["hits"] += 1
+            return {
+                "storyline_id": entry.storyline_id,
+                "classroom": entry.classroom,
+                "words": entry.words,
+                "genre": entry.genre,
+                "style": entry.style,
+            }
+
+    pool_stats["misses"] += 1
+    return None